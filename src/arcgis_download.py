@@ -0,0 +1,210 @@
+"""
+Bulk download of ArcGIS FeatureServer layers. Layer is queried page by page
+(resultOffset/resultRecordCount ordered by object ID) over a pooled session, pages are fetched
+concurrently and every finished page is stored on disk at once, so an interrupted download
+resumes with the missing pages only. Pages are joined into one GeoJSON file at the end.
+"""
+import json
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Any, List
+
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+PAGE_SIZE = 1000
+DEFAULT_WORKERS = 4
+REQUEST_TIMEOUT = 60
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+def pooled_session(workers: int = DEFAULT_WORKERS, retries: int = 3) -> requests.Session:
+    """Session keeping a connection per worker open, transient failures are retried
+    Args:
+        workers (int, optional): number of concurrent requests
+        retries (int, optional): retries of a failed request with exponential backoff
+    Returns:
+        requests.Session: session shared by all workers"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers,
+                          max_retries=Retry(total=retries, backoff_factor=0.5,
+                                            status_forcelist=RETRY_STATUSES))
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def _get_json(session: requests.Session, url: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    """GET request to ArcGIS REST API, errors reported in response body are raised too"""
+    response = session.get(url, params=params, timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+    content = response.json()
+    if 'error' in content:
+        raise requests.HTTPError(f"ArcGIS query {url} failed: {content['error']}",
+                                 response=response)
+    return content
+
+
+def _query_url(base_url: str) -> str:
+    return base_url.rstrip('/') + '/query'
+
+
+def layer_info(session: requests.Session, base_url: str) -> Dict[str, Any]:
+    """Description of FeatureServer layer, e.g. objectIdField and maxRecordCount"""
+    return _get_json(session, base_url.rstrip('/'), {'f': 'json'})
+
+
+def layer_count(session: requests.Session, base_url: str, where: str = '1=1') -> int:
+    """Number of features of the layer matching where clause"""
+    return _get_json(session, _query_url(base_url),
+                     {'where': where, 'returnCountOnly': 'true', 'f': 'json'})['count']
+
+
+# pylint: disable=too-many-arguments
+def _query_page(session: requests.Session, base_url: str, params: Dict[str, Any], offset: int,
+                page_size: int, order_by: str | None) -> Dict[str, Any]:
+    """Query one page of features, ordered by object ID of the layer if order_by is empty"""
+    params = {**params, 'resultOffset': offset, 'resultRecordCount': page_size}
+    if order_by:
+        params['orderByFields'] = order_by
+    return _get_json(session, _query_url(base_url), params)
+
+
+# pylint: disable=too-many-arguments
+def fetch_page(session: requests.Session, base_url: str, offset: int, page_size: int,
+               order_by: str, where: str = '1=1', out_fields: str = '*') -> List[Dict]:
+    """Query one page of features as GeoJSON
+    Args:
+        session (requests.Session): session to query with
+        base_url (str): url of arcGIS FeatureLayer to query
+        offset (int): position of the first feature of the page
+        page_size (int): number of features in page
+        order_by (str): field with stable order of features, object ID of the layer
+        where (str, optional): where clause of the query, defaults to '1=1'
+        out_fields (str, optional): comma separated fields to query, defaults to '*'
+    Returns:
+        List[Dict]: GeoJSON features of the page"""
+    params = {'where': where, 'outFields': out_fields, 'outSR': 4326, 'f': 'geojson'}
+    return _query_page(session, base_url, params, offset, page_size, order_by)['features']
+
+
+# pylint: disable=too-many-arguments
+def query_attributes(session: requests.Session, base_url: str, where: str,
+                     out_fields: str = '*', page_size: int = PAGE_SIZE,
+                     order_by: str | None = None) -> pd.DataFrame:
+    """Query attributes of features without geometry, page by page while the layer reports
+    exceededTransferLimit. Date fields are converted to datetimes, as in FeatureSet.sdf.
+    Args:
+        session (requests.Session): session to query with
+        base_url (str): url of arcGIS FeatureLayer to query
+        where (str): where clause of the query
+        out_fields (str, optional): comma separated fields to query, defaults to '*'
+        page_size (int, optional): features per request, the layer may return less
+        order_by (str | None, optional): field with stable order of features, object ID
+        of the layer if empty
+    Returns:
+        pd.DataFrame: attributes of every matching feature, column per field"""
+    params = {'where': where, 'outFields': out_fields, 'returnGeometry': 'false', 'f': 'json'}
+    records, fields = [], []
+    while True:
+        content = _query_page(session, base_url, params, len(records), page_size, order_by)
+        fields = content.get('fields', fields)
+        records += [feature['attributes'] for feature in content['features']]
+        # next page starts after the returned features, layer may cap page_size
+        if not content.get('exceededTransferLimit') or not content['features']:
+            break
+    frame = pd.DataFrame(records, columns=[field['name'] for field in fields] or None)
+    for field in fields:
+        if field.get('type') == 'esriFieldTypeDate':
+            frame[field['name']] = pd.to_datetime(frame[field['name']], unit='ms')
+    return frame
+
+
+def _write_json(content: Any, filepath: str):
+    """Write json file atomically, half written file is never left behind"""
+    with open(filepath + '.tmp', 'w', encoding='utf-8') as file:
+        json.dump(content, file)
+    os.replace(filepath + '.tmp', filepath)
+
+
+def _page_path(parts_dir: str, offset: int) -> str:
+    return os.path.join(parts_dir, f'{offset:010d}.json')
+
+
+def _prepare_checkpoint(parts_dir: str, checkpoint: Dict[str, Any]):
+    """Keep pages of an interrupted download of the same query, start over otherwise"""
+    checkpoint_path = os.path.join(parts_dir, 'checkpoint.json')
+    if os.path.exists(checkpoint_path):
+        with open(checkpoint_path, encoding='utf-8') as file:
+            if json.load(file) == checkpoint:
+                return
+        shutil.rmtree(parts_dir)
+    os.makedirs(parts_dir, exist_ok=True)
+    _write_json(checkpoint, checkpoint_path)
+
+
+def _join_pages(parts_dir: str, offsets: List[int], savepath: str) -> int:
+    """Stream features of all pages to one GeoJSON FeatureCollection, page by page"""
+    count = 0
+    with open(savepath + '.tmp', 'w', encoding='utf-8') as output:
+        output.write('{"type": "FeatureCollection", "features": [')
+        for offset in offsets:
+            with open(_page_path(parts_dir, offset), encoding='utf-8') as file:
+                features = json.load(file)
+            for feature in features:
+                output.write((',\n' if count else '\n') + json.dumps(feature))
+                count += 1
+        output.write('\n]}\n')
+    os.replace(savepath + '.tmp', savepath)
+    return count
+
+
+# pylint: disable=too-many-arguments
+def download_layer(base_url: str, savepath: str, where: str = '1=1', out_fields: str = '*',
+                   page_size: int = PAGE_SIZE, workers: int = DEFAULT_WORKERS,
+                   session: requests.Session | None = None) -> int:
+    """Download all features of arcGIS FeatureLayer to GeoJSON file, page by page.
+    Finished pages are kept in '<savepath>.parts' until the whole layer is downloaded,
+    repeated call after a failure downloads only the missing pages.
+    Args:
+        base_url (str): url of arcGIS FeatureLayer to query
+        savepath (str): path of the GeoJSON file
+        where (str, optional): where clause of the query, defaults to '1=1'
+        out_fields (str, optional): comma separated fields to query, defaults to '*'
+        page_size (int, optional): features per request, lowered to maxRecordCount of layer
+        workers (int, optional): number of pages fetched concurrently
+        session (requests.Session | None, optional): session to use, pooled_session() if empty
+    Returns:
+        int: number of downloaded features"""
+    session = session or pooled_session(workers)
+    info = layer_info(session, base_url)
+    page_size = min(page_size, info.get('maxRecordCount') or page_size)
+    order_by = info.get('objectIdField') or 'OBJECTID'
+    count = layer_count(session, base_url, where)
+
+    parts_dir = savepath + '.parts'
+    _prepare_checkpoint(parts_dir, {'url': base_url, 'where': where, 'out_fields': out_fields,
+                                    'page_size': page_size, 'count': count})
+    offsets = list(range(0, count, page_size))
+    missing = [offset for offset in offsets if not os.path.exists(_page_path(parts_dir, offset))]
+
+    errors = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pages = {executor.submit(fetch_page, session, base_url, offset, page_size,
+                                 order_by, where, out_fields): offset for offset in missing}
+        for page in as_completed(pages):
+            # finished pages are stored even if other pages fail, to be resumed later
+            try:
+                _write_json(page.result(), _page_path(parts_dir, pages[page]))
+            except (requests.RequestException, ValueError) as error:
+                errors.append(error)
+    if errors:
+        raise errors[0]
+
+    downloaded = _join_pages(parts_dir, offsets, savepath)
+    shutil.rmtree(parts_dir)
+    return downloaded
@@ -0,0 +1,383 @@
+"""
+Offline benchmarks of the matching on synthetic networks of Brno scale. Basemap is a procedurally
+generated street grid with MultiLineStrings and near-parallel streets, foreign networks and
+points are jittered copies of it. Every case is timed and its peak memory traced, results are
+saved as JSON and compared with a baseline to catch regressions.
+"""
+import json
+import os
+import platform
+import tempfile
+import time
+import tracemalloc
+from argparse import ArgumentParser
+from typing import Any, Callable, Dict, List, Tuple
+os.environ['USE_PYGEOS'] = '0'
+
+# pylint: disable=wrong-import-position
+import geopandas as gpd
+import numpy as np
+from shapely import geometry as shp
+
+from geometry_utils import match_lines_by_bbox_overlap, match_overlap_features
+from incremental_update import update_street_network_incremental, commit_fingerprint
+from location_matching import match_street_network_to_osm, match_points_to_osm, \
+    update_street_network, update_point_system
+from osm_basemap import DEFAULT_BBOX
+from segmentation_utils import generate_segments, generate_adaptive_segments, \
+    assign_segments_to_dataset, group_segments, street_bounds, DEFAULT_MAX_STREETS_PER_SEGMENT
+from street_store import build_street_store
+
+
+DEFAULT_SIZES = [2000, 10000, 40000]
+DEFAULT_SEGMENT_COUNTS = [16, 32]
+DEFAULT_BASELINE_PATH = '../benchmarks/baseline.json'
+# relative slowdown or memory growth against baseline reported as regression
+DEFAULT_TOLERANCE = 0.25
+MULTILINE_SHARE = 0.1
+PARALLEL_SHARE = 0.1
+JITTER = 2e-5
+LINE_SAMPLE = 200
+
+
+def _wiggled_line(start: np.ndarray, end: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    """Coordinates of a street between two nodes with few slightly shifted inner vertices"""
+    inner = rng.integers(0, 4)
+    steps = np.linspace(0, 1, inner + 2)[:, np.newaxis]
+    coords = start + steps * (end - start)
+    normal = np.array([start[1] - end[1], end[0] - start[0]])
+    coords[1:-1] += normal * rng.normal(0, 0.05, (inner, 1))
+    return coords
+
+
+def synthetic_basemap(num_streets: int, seed: int = 0,
+                      bounding_box: Tuple[float, float, float, float] = DEFAULT_BBOX) \
+                      -> gpd.GeoDataFrame:
+    """Street grid with irregular nodes covering bounding box, part of streets is split into
+    MultiLineStrings and part has a near-parallel twin (e.g. cycle path along a road)
+    Args:
+        num_streets (int): number of streets
+        seed (int, optional): seed of the generator
+        bounding_box (Tuple[float, float, float, float], optional): extent of the grid
+    Returns:
+        gpd.GeoDataFrame: streets with unique 'id' column"""
+    rng = np.random.default_rng(seed)
+    num_twins = int(num_streets * PARALLEL_SHARE)
+    num_edges = num_streets - num_twins
+    # k x k nodes have 2k(k - 1) edges
+    side = int(np.ceil((1 + np.sqrt(1 + 2 * num_edges)) / 2))
+    min_x, min_y, max_x, max_y = bounding_box
+    step = np.array([(max_x - min_x) / (side - 1), (max_y - min_y) / (side - 1)])
+    grid_x, grid_y = np.meshgrid(np.linspace(min_x, max_x, side), np.linspace(min_y, max_y, side))
+    nodes = np.stack([grid_x, grid_y], axis=-1) + rng.uniform(-0.2, 0.2, (side, side, 2)) * step
+    edges = [((row, col), (row, col + 1)) for row in range(side) for col in range(side - 1)] \
+        + [((row, col), (row + 1, col)) for row in range(side - 1) for col in range(side)]
+    chosen = rng.permutation(len(edges))[:num_edges]
+
+    geometries = []
+    for edge in chosen:
+        start, end = nodes[edges[edge][0]], nodes[edges[edge][1]]
+        coords = _wiggled_line(start, end, rng)
+        if rng.random() < MULTILINE_SHARE:
+            middle = start + (end - start) * rng.uniform(0.4, 0.6)
+            gap = (end - start) * 0.02
+            geometries.append(shp.MultiLineString([[tuple(start), tuple(middle - gap)],
+                                                   [tuple(middle + gap), tuple(end)]]))
+        else:
+            geometries.append(shp.LineString(coords))
+    for twin in rng.choice(len(geometries), num_twins, replace=False):
+        # shifted by few metres, vertices jittered independently
+        offset = rng.normal(0, 5e-5, 2)
+        geometries.append(shp.LineString(
+            [tuple(point + offset + rng.normal(0, JITTER, 2))
+             for point in _line_coords(geometries[twin])]))
+    return gpd.GeoDataFrame({'id': np.arange(1, len(geometries) + 1), 'geometry': geometries},
+                            crs='EPSG:4326')
+
+
+def _line_coords(geometry: shp.base.BaseGeometry) -> np.ndarray:
+    """Coordinates of LineString or of all parts of MultiLineString"""
+    if hasattr(geometry, 'geoms'):
+        return np.concatenate([np.asarray(part.coords) for part in geometry.geoms])
+    return np.asarray(geometry.coords)
+
+
+def _jittered(geometry: shp.base.BaseGeometry, rng: np.random.Generator) \
+        -> shp.base.BaseGeometry:
+    """Copy of (Multi)LineString with every vertex shifted by random jitter"""
+    if hasattr(geometry, 'geoms'):
+        return shp.MultiLineString([np.asarray(part.coords)
+                                    + rng.normal(0, JITTER, (len(part.coords), 2))
+                                    for part in geometry.geoms])
+    coords = np.asarray(geometry.coords)
+    return shp.LineString(coords + rng.normal(0, JITTER, coords.shape))
+
+
+def synthetic_foreign_network(basemap: gpd.GeoDataFrame, seed: int = 1, keep: float = 0.8,
+                              extra: float = 0.1) -> gpd.GeoDataFrame:
+    """Foreign network digitized from the same streets, jittered copy of part of the basemap
+    with some extra streets, IDs in column 'GID'
+    Args:
+        basemap (gpd.GeoDataFrame): synthetic basemap
+        seed (int, optional): seed of the generator
+        keep (float, optional): share of basemap streets in the network
+        extra (float, optional): share of streets missing in basemap
+    Returns:
+        gpd.GeoDataFrame: network with unique 'GID' column"""
+    rng = np.random.default_rng(seed)
+    kept = basemap.geometry[rng.random(len(basemap)) < keep]
+    geometries = [_jittered(geometry, rng) for geometry in kept]
+    extra_streets = synthetic_basemap(int(len(basemap) * extra), seed + 100,
+                                      tuple(basemap.total_bounds)).geometry
+    geometries += [_jittered(geometry, rng) for geometry in extra_streets]
+    return gpd.GeoDataFrame({'GID': rng.permutation(len(geometries)) + 100000,
+                             'geometry': geometries}, crs='EPSG:4326')
+
+
+def synthetic_points(basemap: gpd.GeoDataFrame, num_points: int, seed: int = 2) \
+        -> gpd.GeoDataFrame:
+    """Points (e.g. counters) placed near random streets, IDs in column 'point_id'"""
+    rng = np.random.default_rng(seed)
+    streets = basemap.geometry.iloc[rng.choice(len(basemap), num_points, replace=False)]
+    points = [shp.Point(np.asarray(street.centroid.coords[0]) + rng.normal(0, JITTER, 2))
+              for street in streets]
+    return gpd.GeoDataFrame({'point_id': np.arange(num_points), 'geometry': points},
+                            crs='EPSG:4326')
+
+
+def changed_version(dataset: gpd.GeoDataFrame, id_column: str, seed: int = 3,
+                    changed: float = 0.05, removed: float = 0.02) -> gpd.GeoDataFrame:
+    """Newer version of dataset with part of features moved and part removed"""
+    rng = np.random.default_rng(seed)
+    dataset = dataset[rng.random(len(dataset)) >= removed].copy()
+    moved = rng.random(len(dataset)) < changed
+    dataset.loc[moved, 'geometry'] = dataset.geometry[moved].translate(3e-4, 2e-4)
+    return dataset.sort_values(id_column).reset_index(drop=True)
+
+
+def measure(function: Callable, *args, repeat: int = 1) -> Tuple[Any, float, float]:
+    """Best wall time of repeated calls and peak of memory allocated by one more traced call
+    Args:
+        function (Callable): measured function
+        args: arguments of the function, must not be changed by it
+        repeat (int, optional): number of timed calls
+    Returns:
+        Tuple[Any, float, float]: result, seconds and peak memory in MB"""
+    seconds = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        seconds = min(seconds, time.perf_counter() - start)
+    # tracing slows allocations down, memory is measured in a separate call
+    tracemalloc.start()
+    function(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, seconds, peak / 2**20
+
+
+def _record(case: str, size: int, segments: int, items: int,
+            measured: Tuple[Any, float, float]) -> Dict[str, Any]:
+    _, seconds, peak_mb = measured
+    return {'case': case, 'size': size, 'segments': segments, 'items': items,
+            'seconds': round(seconds, 4), 'items_per_second': round(items / seconds, 1),
+            'peak_mb': round(peak_mb, 2)}
+
+
+def _sample_line_matching(basemap: gpd.GeoDataFrame, foreign: gpd.GeoDataFrame,
+                          lines: np.ndarray) -> int:
+    """Per-line matching API on a sample of basemap lines against their segment"""
+    found = 0
+    for position in lines:
+        segment = basemap['segment_id'].iat[position]
+        candidates = foreign.geometry[foreign['segment_id'].to_numpy() == segment]
+        found += match_lines_by_bbox_overlap(basemap.geometry.iat[position], candidates) \
+            is not None
+    return found
+
+
+def _segment_overlap_matching(basemap: gpd.GeoDataFrame, foreign: gpd.GeoDataFrame) -> int:
+    """Overlap matching of match_line_to_set() for all lines, segment by segment, features
+    are read from the stores of both networks"""
+    line_store, other_store = build_street_store(basemap, 'id'), build_street_store(foreign, 'GID')
+    other_groups = group_segments(other_store.segment_ids)
+    found = 0
+    for segment, rows in group_segments(line_store.segment_ids).items():
+        others = other_groups.get(segment, np.empty(0, dtype=int))
+        found += (match_overlap_features(line_store.overlap.take(rows),
+                                         other_store.overlap.take(others)) >= 0).sum()
+    return int(found)
+
+
+def _assign_segments(basemap: gpd.GeoDataFrame,
+                     segments: List[Tuple[float, float, float, float]]) -> gpd.GeoDataFrame:
+    """Segments assigned to a copy, the function adds column to the basemap"""
+    return assign_segments_to_dataset(basemap.copy(), segments, 'id')
+
+
+def _adaptive_segmentation(basemap: gpd.GeoDataFrame) \
+        -> Tuple[List[Tuple[float, float, float, float]], gpd.GeoDataFrame]:
+    """Quadtree segments of the basemap and a copy of basemap assigned to them"""
+    segments = generate_adaptive_segments(tuple(basemap.total_bounds), street_bounds(basemap),
+                                          DEFAULT_MAX_STREETS_PER_SEGMENT)
+    return segments, assign_segments_to_dataset(basemap.copy(), segments, 'id')
+
+
+def _match_points(basemap: gpd.GeoDataFrame, filepath: str) -> gpd.GeoDataFrame:
+    """Points matching on a copy, the function adds column to the basemap"""
+    return match_points_to_osm(basemap.copy(), filepath, 'point_id', 'point_id')
+
+
+def _update_points(model: gpd.GeoDataFrame, filepath: str) -> gpd.GeoDataFrame:
+    """Points update on a copy, the function changes the model"""
+    return update_point_system(model.copy(), filepath, 'point_id', 'point_id')
+
+
+# pylint: disable=too-many-arguments
+def run_benchmarks(sizes: List[int], segment_counts: List[int], workdir: str,
+                   repeat: int = 1, workers: int = 1) -> List[Dict[str, Any]]:
+    """Benchmark all cases for every combination of network size and segment count
+    Args:
+        sizes (List[int]): numbers of basemap streets
+        segment_counts (List[int]): numbers of segments in one row and column
+        workdir (str): directory for generated dataset files
+        repeat (int, optional): timed calls of every case, best is reported
+        workers (int, optional): number of processes matching the segments
+    Returns:
+        List[Dict[str, Any]]: record of every case"""
+    records = []
+    for size in sizes:
+        basemap = synthetic_basemap(size)
+        foreign = synthetic_foreign_network(basemap)
+        points = synthetic_points(basemap, max(size // 100, 10))
+        paths = {name: os.path.join(workdir, f'{name}_{size}.geojson')
+                 for name in ('foreign', 'foreign_v2', 'points', 'points_v2')}
+        foreign.to_file(paths['foreign'], driver='GeoJSON')
+        changed_version(foreign, 'GID').to_file(paths['foreign_v2'], driver='GeoJSON')
+        points.to_file(paths['points'], driver='GeoJSON')
+        changed_version(points, 'point_id').to_file(paths['points_v2'], driver='GeoJSON')
+
+        for num_segments in segment_counts:
+            segments = generate_segments(tuple(basemap.total_bounds), num_segments)
+            measured = measure(_assign_segments, basemap, segments, repeat=repeat)
+            records.append(_record('assign_segments_to_dataset', size, num_segments,
+                                   size, measured))
+            model = measured[0]
+
+            lines = np.random.default_rng(0).choice(size, min(LINE_SAMPLE, size), replace=False)
+            foreign_segments = assign_segments_to_dataset(foreign, segments, 'GID')
+            records.append(_record('match_lines_by_bbox_overlap', size, num_segments, len(lines),
+                                   measure(_sample_line_matching, model, foreign_segments,
+                                           lines, repeat=repeat)))
+            records.append(_record('match_line_to_set', size, num_segments, size,
+                                   measure(_segment_overlap_matching, model, foreign_segments,
+                                           repeat=repeat)))
+
+            measured = measure(match_street_network_to_osm, model, paths['foreign'], 'GID',
+                               segments, 'foreign_id', None, workers, repeat=repeat)
+            records.append(_record('match_street_network_to_osm', size, num_segments, size,
+                                   measured))
+            matched = model.join(measured[0]['foreign_id'])
+
+            records.append(_record('update_street_network', size, num_segments, size, measure(
+                update_street_network, matched, paths['foreign_v2'], 'GID', segments,
+                'foreign_id', workers, repeat=repeat)))
+            records.append(_record('update_street_network_incremental', size, num_segments,
+                                   size, _measure_incremental(matched, paths, segments,
+                                                              workers, repeat)))
+
+        # quadtree segments are recorded with their number of segments
+        measured = measure(_adaptive_segmentation, basemap, repeat=repeat)
+        segments, model = measured[0]
+        records.append(_record('generate_adaptive_segments', size, len(segments), size,
+                               measured))
+        records.append(_record('match_street_network_to_osm_adaptive', size, len(segments),
+                               size, measure(match_street_network_to_osm, model,
+                                             paths['foreign'], 'GID', segments, 'foreign_id',
+                                             None, workers, repeat=repeat)))
+
+        measured = measure(_match_points, basemap, paths['points'], repeat=repeat)
+        records.append(_record('match_points_to_osm', size, 0, len(points), measured))
+        records.append(_record('update_point_system', size, 0, len(points), measure(
+            _update_points, measured[0], paths['points_v2'], repeat=repeat)))
+    return records
+
+
+def _measure_incremental(model: gpd.GeoDataFrame, paths: Dict[str, str],
+                         segments: List[Tuple[float, float, float, float]], workers: int,
+                         repeat: int) -> Tuple[Any, float, float]:
+    """Incremental update from fingerprint of the first version to the second version"""
+    fingerprint_path = paths['foreign'] + '.fingerprint.parquet'
+    if os.path.exists(fingerprint_path):
+        os.remove(fingerprint_path)
+    first, report = update_street_network_incremental(model.copy(), paths['foreign'], 'GID',
+                                                      segments, 'foreign_id', fingerprint_path,
+                                                      workers)
+    commit_fingerprint(report)
+
+    def incremental_update():
+        # fingerprint isn't committed, every call starts from the first version
+        return update_street_network_incremental(first.copy(), paths['foreign_v2'], 'GID',
+                                                 segments, 'foreign_id', fingerprint_path,
+                                                 workers)
+    return measure(incremental_update, repeat=repeat)
+
+
+def compare_with_baseline(records: List[Dict[str, Any]], baseline: List[Dict[str, Any]],
+                          tolerance: float = DEFAULT_TOLERANCE) -> List[str]:
+    """Cases slower or using more memory than baseline by more than tolerance
+    Args:
+        records (List[Dict[str, Any]]): current results
+        baseline (List[Dict[str, Any]]): results of the baseline run
+        tolerance (float, optional): accepted relative growth
+    Returns:
+        List[str]: description of every regression"""
+    baseline_records = {(record['case'], record['size'], record['segments']): record
+                        for record in baseline}
+    regressions = []
+    for record in records:
+        reference = baseline_records.get((record['case'], record['size'], record['segments']))
+        if reference is None:
+            continue
+        for metric in ('seconds', 'peak_mb'):
+            if record[metric] > reference[metric] * (1 + tolerance):
+                regressions.append(f"{record['case']} size={record['size']} "
+                                   f"segments={record['segments']}: {metric} "
+                                   f"{reference[metric]} -> {record[metric]}")
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Benchmark matching on synthetic street networks')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument('--segments', type=int, nargs='+', default=DEFAULT_SEGMENT_COUNTS)
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--output', help='save results to this JSON file')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='save results as the new baseline instead of comparing')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        results = run_benchmarks(args.sizes, args.segments, workdir, args.repeat, args.workers)
+    for result in results:
+        print(result)
+    report = {'machine': {'python': platform.python_version(), 'cpus': os.cpu_count(),
+                          'platform': platform.platform()},
+              'workers': args.workers, 'results': results}
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline) or '.', exist_ok=True)
+        with open(args.baseline, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as file:
+            found = compare_with_baseline(results, json.load(file)['results'], args.tolerance)
+        for regression in found:
+            print('REGRESSION', regression)
+        if found:
+            raise SystemExit(1)
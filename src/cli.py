@@ -0,0 +1,104 @@
+"""
+Command line entry point of short tasks, e.g. per-street lookups of cron jobs served from the
+query cache. Modules of a command are imported only when the command runs and time spent
+by the imports is reported to stderr.
+    python cli.py biketowork 3515
+    python cli.py street 450098706 --census-id 1234 --start 2022-05-01 --end 2022-06-01
+"""
+import time
+_START = time.perf_counter()
+
+# pylint: disable=wrong-import-position
+import importlib
+import os
+import sys
+from argparse import ArgumentParser, Namespace
+from types import ModuleType
+from typing import Any, Dict
+
+# found next to the sources, the CLI runs from any folder
+STRAVA_CSV_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'datasets',
+                               'strava_daily_2022_may_aug.csv')
+
+
+def _import(module_name: str) -> ModuleType:
+    """Import module of command and report time since start of the CLI"""
+    module = importlib.import_module(module_name)
+    print(f'imports took {time.perf_counter() - _START:.3f} s', file=sys.stderr)
+    return module
+
+
+def _print_frames(frames: Dict[Any, Any]):
+    for key, frame in frames.items():
+        print(f'{key}:')
+        print(frame.to_string() if frame is not None else 'no data')
+
+
+def _biketowork(args: Namespace):
+    _print_frames(_import('dataset_query').get_biketowork_data_batch(args.ids))
+
+
+def _census(args: Namespace):
+    _print_frames(_import('dataset_query').get_census_data_batch(args.ids))
+
+
+def _counters(args: Namespace):
+    _print_frames(_import('dataset_query').get_counters_data_batch(args.ids, args.start,
+                                                                   args.end))
+
+
+def _strava(args: Namespace):
+    _print_frames({args.osm_id: _import('dataset_query').get_strava_data(
+        args.osm_id, args.start, args.end, args.csv)})
+
+
+def _street(args: Namespace):
+    street_data = _import('dataset_query').get_street_data(
+        args.osm_id, args.counters_id, args.biketowork_id, args.census_id, args.start,
+        args.end, args.csv)
+    _print_frames({name: value for name, value in street_data._asdict().items()
+                   if name != 'osm_id'})
+
+
+def build_parser() -> ArgumentParser:
+    """Parser of all commands, command function is stored as 'command' of parsed arguments"""
+    parser = ArgumentParser(description='Short tasks over the Brno cycling datasets')
+    commands = parser.add_subparsers(required=True)
+
+    command = commands.add_parser('biketowork', help='biketowork numbers of roads')
+    command.add_argument('ids', type=int, nargs='+', help='GID_ROAD of roads')
+    command.set_defaults(command=_biketowork)
+
+    command = commands.add_parser('census', help='census numbers of roads')
+    command.add_argument('ids', type=int, nargs='+', help='id of census roads')
+    command.set_defaults(command=_census)
+
+    command = commands.add_parser('counters', help='counted cyclists in time interval')
+    command.add_argument('start', help="first day, 'YYYY-MM-DD'")
+    command.add_argument('end', help="day after the last day, 'YYYY-MM-DD'")
+    command.add_argument('ids', type=int, nargs='+', help='LocationId of counters')
+    command.set_defaults(command=_counters)
+
+    command = commands.add_parser('strava', help='Strava daily counts of street')
+    command.add_argument('osm_id', type=int)
+    command.add_argument('start', help="first day, 'YYYY-MM-DD'")
+    command.add_argument('end', help="day after the last day, 'YYYY-MM-DD'")
+    command.add_argument('--csv', default=STRAVA_CSV_PATH, help='daily Strava export')
+    command.set_defaults(command=_strava)
+
+    command = commands.add_parser('street', help='data of street from all sources at once')
+    command.add_argument('osm_id', type=int)
+    command.add_argument('--counters-id', type=int)
+    command.add_argument('--biketowork-id', type=int)
+    command.add_argument('--census-id', type=int)
+    command.add_argument('--start', required=True, help="first day, 'YYYY-MM-DD'")
+    command.add_argument('--end', required=True, help="day after the last day, 'YYYY-MM-DD'")
+    command.add_argument('--csv', default=STRAVA_CSV_PATH,
+                         help="daily Strava export, '' to skip Strava")
+    command.set_defaults(command=_street)
+    return parser
+
+
+if __name__ == '__main__':
+    arguments = build_parser().parse_args()
+    arguments.command(arguments)
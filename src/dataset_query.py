@@ -1,23 +1,47 @@
 """Query data from arcgis datasets and parse locally store strava data"""
-from configparser import ConfigParser
-import requests
+import asyncio
+import os
+import threading
+from configparser import ConfigParser, SectionProxy
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, NamedTuple, Tuple
+from urllib.parse import urlparse
 import pandas as pd
-import matplotlib.dates as mdates
-from arcgis.features import FeatureLayer
-from matplotlib import pyplot as plt
-from seaborn import lineplot
+import requests
+
+from arcgis_download import download_layer, pooled_session, query_attributes, DEFAULT_WORKERS
+from query_cache import QueryCache
+from strava_store import load_strava_store, street_counts
+
+
+# found next to the sources, not relative to the working directory
+DATA_URLS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data_urls.conf')
+# per-ID lookups of the dashboard are repeated often, keep them locally
+query_cache = QueryCache()
+# IDs in one 'IN (...)' query, keeps the request url short enough
+ID_BATCH_SIZE = 200
+# concurrent requests to one host by all async queries together
+HOST_CONCURRENCY = 4
+_HOST_LIMITS: Dict[str, threading.BoundedSemaphore] = {}
+_HOST_LIMITS_LOCK = threading.Lock()
+BIKETOWORK_COLUMNS = ['data_2019', 'data_2020', 'data_2021', 'dpnk_22']
+CENSUS_COLUMNS = ['prac_2018', 'vik_2018', 'prac_2020', 'vik_2020', 'prac_2022', 'vik_2022']
+COUNTERS_COLUMNS = ['SecondDirection_Cyclists', 'FirstDirection_Cyclists']
+
 
+@lru_cache(maxsize=None)
+def data_urls(config_path: str = DATA_URLS_PATH) -> SectionProxy:
+    """URLs of the ArcGIS layers, config is read on the first use"""
+    cparser = ConfigParser()
+    if not cparser.read(config_path):
+        raise FileNotFoundError(f"Config '{config_path}' not found")
+    return cparser['urls']
 
-cparser = ConfigParser()
-cparser.read('../data_urls.conf')
 
-# ARCGIS api has request limit of 1000-2000 records per query, use python gis lib
-def download_dataset(base_url: str, savepath: str):
-    """Downloads full dataset from the arcgis featureLayer"""
-    params = {'where': '1=1', 'outFields': '*', 'outSR': 4326, 'f': 'geojson'}
-    response = requests.get(base_url, params=params)
-    with open(savepath, 'w', encoding='utf-8') as file:
-        file.write(response.text)
+# ARCGIS api has request limit of 1000-2000 records per query, download page by page
+def download_dataset(base_url: str, savepath: str, workers: int = DEFAULT_WORKERS) -> int:
+    """Downloads full dataset from the arcgis featureLayer, see download_layer()"""
+    return download_layer(base_url, savepath, workers=workers)
 
 
 def query_arcgis_layer(base_url: str, savepath: str | None = None, out_fields: str = '*',
@@ -29,6 +53,8 @@ def query_arcgis_layer(base_url: str, savepath: str | None = None, out_fields: s
         out_fields (str, optional): string of comma separated fields to query, defaults to '*'.
         custom_where (str, optional): custom WHERE sql-like clause, defaults to '1=1'
         result_type (str, optional): type or format of result, defaults to 'geojson'"""
+    # arcgis takes seconds to import, lookups served from query_cache don't need it
+    from arcgis.features import FeatureLayer  # pylint: disable=import-outside-toplevel
     layer = FeatureLayer(base_url)
     response = layer.query(where=custom_where,
                            out_fields=out_fields,
@@ -40,94 +66,229 @@ def query_arcgis_layer(base_url: str, savepath: str | None = None, out_fields: s
     return response
 
 
+def _id_where(id_column: str, value: Any) -> str:
+    """Where clause of a single ID lookup, part of its cache key"""
+    return f"{id_column}={value}"
+
+
+def _id_cache_key(base_url: str, out_fields: str, id_column: str, value: Any,
+                  extra_where: str = '') -> Tuple[str, str, str]:
+    """Cache key of a single ID lookup of query_by_ids()"""
+    where = _id_where(id_column, value)
+    return base_url, out_fields, f"{where} AND {extra_where}" if extra_where else where
+
+
+def _attributes_cache_key(base_url: str, out_fields: str, id_column: str, value: Any,
+                          extra_where: str = '') -> Tuple[str, str, str, str]:
+    """Cache key of a single ID lookup of the async queries, their frames have no geometry
+    and are kept apart from the frames of query_by_ids()"""
+    return _id_cache_key(base_url, out_fields, id_column, value, extra_where) + ('attributes',)
+
+
+def _counters_where(date_start: str, date_end: str) -> str:
+    return f"datum > DATE '{date_start}' AND datum < DATE '{date_end}'"
+
+
+# pylint: disable=too-many-arguments
+def query_by_ids(base_url: str, id_column: str, ids: Iterable[Any], out_fields: str = '*',
+                 extra_where: str = '', batch_size: int = ID_BATCH_SIZE) \
+                 -> Dict[Any, pd.DataFrame]:
+    """Query rows of many IDs with few 'IN (...)' queries, only IDs missing in query_cache
+    are queried and results of every ID are cached as if it was queried alone
+    Args:
+        base_url (str): url of arcGIS FeatureLayer to query
+        id_column (str): exact name of the ID column in the layer
+        ids (Iterable[Any]): numeric IDs to query
+        out_fields (str, optional): comma separated fields to query, defaults to '*'
+        extra_where (str, optional): condition added to the ID condition with AND
+        batch_size (int, optional): maximum number of IDs in one query
+    Returns:
+        Dict[Any, pd.DataFrame]: rows of every ID, empty dataframe for unknown IDs"""
+    results = {value: query_cache.get(_id_cache_key(base_url, out_fields, id_column, value,
+                                                    extra_where))
+               for value in dict.fromkeys(ids)}
+    missing = [value for value, result in results.items() if result is None]
+    for start in range(0, len(missing), batch_size):
+        batch = missing[start:start + batch_size]
+        where = f"{id_column} IN ({', '.join(str(value) for value in batch)})"
+        sdf = query_arcgis_layer(base_url, out_fields=out_fields, result_type='df',
+                                 custom_where=f"{where} AND {extra_where}" if extra_where
+                                 else where).sdf
+        groups = dict(tuple(sdf.groupby(id_column))) if id_column in sdf.columns else {}
+        for value in batch:
+            result = groups.get(value, sdf.iloc[0:0]).reset_index(drop=True)
+            query_cache.put(_id_cache_key(base_url, out_fields, id_column, value, extra_where),
+                            result)
+            results[value] = result
+    return results
+
+
+def get_biketowork_data_batch(gids: Iterable[int]) -> Dict[int, pd.DataFrame]:
+    """Query biketowork dataset as dataframes of many road IDs at once"""
+    frames = query_by_ids(data_urls()['biketowork'], 'GID_ROAD', gids,
+                          ','.join(['GID_ROAD'] + BIKETOWORK_COLUMNS))
+    return {gid: gdf[BIKETOWORK_COLUMNS] for gid, gdf in frames.items()}
+
+
 def get_biketowork_data(gid: int):
     """Query biketowork dataset as dataframe based on road ID"""
-    gdf = query_arcgis_layer(cparser['urls']['biketowork'],
-                             result_type='df',
-                             custom_where=f"GID_ROAD={gid}").sdf
-    gdf = gdf[['data_2019', 'data_2020', 'data_2021', 'dpnk_22']]
-    return gdf
+    return get_biketowork_data_batch([gid])[gid]
+
+
+def get_census_data_batch(road_ids: Iterable[int]) -> Dict[int, pd.DataFrame]:
+    """Query census dataset as dataframes of many road IDs at once"""
+    frames = query_by_ids(data_urls()['census'], 'id', road_ids,
+                          ','.join(['id'] + CENSUS_COLUMNS))
+    return {road_id: gdf[CENSUS_COLUMNS] for road_id, gdf in frames.items()}
 
 
 def get_census_data(road_id: int):
     """Query census dataset as dataframe based on road ID"""
-    gdf = query_arcgis_layer(cparser['urls']['census'],
-                             result_type='df',
-                             custom_where=f"id={road_id}").sdf
-    gdf = gdf[["prac_2018", "vik_2018", "prac_2020",
-               "vik_2020", "prac_2022", "vik_2022"]]
-    return gdf
+    return get_census_data_batch([road_id])[road_id]
+
+
+def get_counters_data_batch(location_ids: Iterable[int], date_start: str,
+                            date_end: str) -> Dict[int, pd.DataFrame]:
+    """Query counters dataset as dataframes of many locationIds and time interval at once
+       datetime parameters in format 'YYYY-MM-DD'"""
+    frames = query_by_ids(data_urls()['counters'], 'LocationId', location_ids,
+                          ','.join(['LocationId'] + COUNTERS_COLUMNS),
+                          _counters_where(date_start, date_end))
+    return {location_id: gdf[COUNTERS_COLUMNS] for location_id, gdf in frames.items()}
 
 
 def get_counters_data(location_id: int, date_start: str, date_end: str):
     """Query counters dataset as dataframe based on locationId and time interval
        datetime parameters in format 'YYYY-MM-DD'"""
-    gdf = query_arcgis_layer(cparser['urls']['counters'],
-                             result_type='df',
-                             custom_where=f"""LocationId={location_id}
-                                              AND datum > DATE '{date_start}'
-                                              AND datum < DATE '{date_end}'""").sdf
-    gdf = gdf[['SecondDirection_Cyclists', 'FirstDirection_Cyclists']]
-    return gdf
+    return get_counters_data_batch([location_id], date_start, date_end)[location_id]
 
 
 def get_strava_data(osm_id: int, date_start: str, date_end: str, csv_path: str) -> pd.DataFrame:
     """Query strava dataset from file as a dataframe based on OSM ID and time interval
        datetime parameters in format 'YYYY-MM-DD',
-       dataset must be on daily granularity and contain the specified time frame"""
-    strava_df = pd.read_csv(csv_path)
-    strava_df['date'] = pd.to_datetime(strava_df['date'])
-    strava_df = strava_df[strava_df['osm_reference_id'] == osm_id] # 48578321
-    strava_df = strava_df[strava_df['date'].dt.strftime('%Y-%m-%d') >= date_start]
-    strava_df = strava_df[strava_df['date'].dt.strftime('%Y-%m-%d') < date_end]
-    strava_df = strava_df.groupby(['date']).mean().reset_index()
-    strava_df = strava_df[['osm_reference_id', 'date', 'ride_count',
-                           'forward_trip_count', 'reverse_trip_count']]
-    return strava_df
+       dataset must be on daily granularity and contain the specified time frame.
+       CSV is ingested to an indexed store on the first call, see strava_store.py"""
+    return street_counts(load_strava_store(csv_path), [osm_id], date_start, date_end)
+
+
+class StreetData(NamedTuple):
+    """Data of one street from all sources, None for sources without matched ID"""
+    osm_id: int
+    counters: pd.DataFrame | None
+    biketowork: pd.DataFrame | None
+    census: pd.DataFrame | None
+    strava: pd.DataFrame | None
+
+
+@lru_cache(maxsize=None)
+def shared_session() -> requests.Session:
+    """Connection pool of the async queries, created on the first use and shared by all calls"""
+    return pooled_session(HOST_CONCURRENCY)
+
+
+def host_limit(base_url: str) -> threading.BoundedSemaphore:
+    """Slots of concurrent requests to host of the url, shared by all calls and event loops"""
+    with _HOST_LIMITS_LOCK:
+        return _HOST_LIMITS.setdefault(urlparse(base_url).netloc,
+                                       threading.BoundedSemaphore(HOST_CONCURRENCY))
+
+
+def _query_attributes_limited(session: requests.Session, base_url: str, where: str,
+                              out_fields: str) -> pd.DataFrame:
+    """query_attributes() once the host has a free slot, waits in the calling thread"""
+    with host_limit(base_url):
+        return query_attributes(session, base_url, where, out_fields)
+
+
+# pylint: disable=too-many-arguments
+async def _query_id_async(session: requests.Session, base_url: str, id_column: str, value: Any,
+                          columns: List[str], extra_where: str = '') -> pd.DataFrame | None:
+    """Rows of one ID from query_cache or the layer, request runs in a thread, None for
+    missing ID"""
+    if value is None or pd.isna(value):
+        return None
+    out_fields = ','.join([id_column] + columns)
+    key = _attributes_cache_key(base_url, out_fields, id_column, value, extra_where)
+    result = query_cache.get(key)
+    if result is None:
+        frame = await asyncio.to_thread(_query_attributes_limited, session, base_url, key[2],
+                                        out_fields)
+        result = frame.reindex(columns=[id_column] + columns)
+        query_cache.put(key, result)
+    return result[columns]
+
+
+async def get_street_data_async(osm_id: int, counters_id: int | None,
+                                biketowork_id: int | None, census_id: int | None,
+                                date_start: str, date_end: str, csv_path: str | None,
+                                session: requests.Session | None = None) -> StreetData:
+    """Query all data of one street concurrently, ArcGIS layers share one connection pool
+    and Strava store is read in a thread, so the latency is about that of the slowest source.
+    Concurrent calls share the pool and at most HOST_CONCURRENCY requests run to one host.
+    Args:
+        osm_id (int): OSM ID of the street
+        counters_id (int | None): matched counter location, see get_counters_data()
+        biketowork_id (int | None): matched biketowork road, see get_biketowork_data()
+        census_id (int | None): matched census road, see get_census_data()
+        date_start (str): first day of counters and Strava data in format 'YYYY-MM-DD'
+        date_end (str): day after the last day in format 'YYYY-MM-DD'
+        csv_path (str | None): daily Strava export, see get_strava_data(), skipped if empty
+        session (requests.Session | None, optional): session to query with, owned by the
+        caller, shared_session() if empty
+    Returns:
+        StreetData: data of every source, None where the street has no matched ID"""
+    session = session or shared_session()
+    counters, biketowork, census, strava = await asyncio.gather(
+        _query_id_async(session, data_urls()['counters'], 'LocationId', counters_id,
+                        COUNTERS_COLUMNS, _counters_where(date_start, date_end)),
+        _query_id_async(session, data_urls()['biketowork'], 'GID_ROAD', biketowork_id,
+                        BIKETOWORK_COLUMNS),
+        _query_id_async(session, data_urls()['census'], 'id', census_id, CENSUS_COLUMNS),
+        asyncio.to_thread(get_strava_data, osm_id, date_start, date_end, csv_path)
+        if csv_path else asyncio.sleep(0))
+    return StreetData(osm_id, counters, biketowork, census, strava)
+
+
+def get_street_data(osm_id: int, counters_id: int | None, biketowork_id: int | None,
+                    census_id: int | None, date_start: str, date_end: str,
+                    csv_path: str | None) -> StreetData:
+    """Blocking variant of get_street_data_async() for callers without event loop"""
+    return asyncio.run(get_street_data_async(osm_id, counters_id, biketowork_id, census_id,
+                                             date_start, date_end, csv_path))
 
 
 def generate_strava_report(osm_id: int, date_start: str, date_end: str, csv_path: str):
     """Generated simple html digesting strava data parsed by parameters
        datetime parameters in format 'YYYY-MM-DD'
-       dataset must be on daily granularity and contain the specified time frame"""
+       dataset must be on daily granularity and contain the specified time frame.
+       Reports of many streets are generated by strava_reports.generate_strava_reports()"""
+    # pylint: disable=import-outside-toplevel
+    from strava_reports import render_report, street_sums
     strava_df = get_strava_data(osm_id, date_start, date_end, csv_path)
-    fig = plt.figure(figsize=(10,8))
-    axis = fig.gca()
-    lineplot(x=strava_df['date'], y=strava_df['ride_count'], ax=axis)
-    x_axis = axis.lines[0].get_xydata()[:,0]
-    y_axis = axis.lines[0].get_xydata()[:,1]
-    axis.fill_between(x_axis, y_axis, color="blue", alpha=0.6)
-    axis.xaxis.set_major_formatter(mdates.DateFormatter('%b-%d'))
-    plt.savefig('../strava_plot.png')
-    sums = strava_df.groupby(['osm_reference_id']).sum().reset_index()
-    with open('../report.html', 'w', encoding='utf-8') as file:
-        file.write(strava_df.to_html() +
-                '<img src="strava_plot.png" alt="text">' +
-                sums.to_html())
-
+    render_report(strava_df, street_sums(strava_df), '../strava_plot.png', '../report.html')
 
 
 if __name__ == '__main__':
     # pylint: disable=pointless-string-statement
-    """download_dataset(cparser['urls']['counters'], 'datasets/testik.geojson')
-    query_arcgis_layer(cparser['urls']['census'],
+    """download_dataset(data_urls()['counters'], 'datasets/testik.geojson')
+    query_arcgis_layer(data_urls()['census'],
                        '../datasets/arcgis_bkom.geojson',
                        out_fields='id')
 
-    query_arcgis_layer(cparser['urls']['counters'],
+    query_arcgis_layer(data_urls()['counters'],
                        '../datasets/arcgis_counters.geojson',
                        out_fields='LocationId')
 
-    query_arcgis_layer(cparser['urls']['biketowork'],
+    query_arcgis_layer(data_urls()['biketowork'],
                        '../datasets/arcgis_biketowork.geojson',
                        out_fields='GID_ROAD')"""
 
     # examples
-    print(query_arcgis_layer(cparser['urls']['biketowork'],
+    print(query_arcgis_layer(data_urls()['biketowork'],
                              result_type='df',
                              custom_where='GID_ROAD=3515.0').sdf)
 
-    print(query_arcgis_layer(cparser['urls']['counters'],
+    print(query_arcgis_layer(data_urls()['counters'],
                              custom_where="datum > DATE '2023-03-22'",
                              result_type='df').sdf)
 
@@ -1,11 +1,12 @@
 """Experiments evaluating the final application"""
-import geopandas as gpd
 import pandas as pd
 
+from model_io import read_model, MODEL_PATH
+
 
 def eval_street_algorithm():
     """Calculate algorithm accuracy on the annotated samples"""
-    model = gpd.read_file('/../datasets/full_model.geojson')
+    model = read_model(MODEL_PATH, columns=['id', 'biketowork_id', 'city_census_id'])
     results = pd.read_csv('../datasets/algo_eval.csv', delimiter=';')
 
     correct_matches_btw = 0
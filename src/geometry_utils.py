@@ -4,80 +4,125 @@ and finding best match for line in a different set.
 """
 import os
 import warnings
+from fractions import Fraction
+from typing import Iterable, List, NamedTuple, Dict, Any, Tuple
 os.environ['USE_PYGEOS'] = '0'
 
 # pylint: disable=wrong-import-position
 import geopandas as gpd
 import numpy as np
 from shapely import geometry as shp
+from shapely.strtree import STRtree
 
+import instrumentation
 from segmentation_utils import generate_segments, assign_segments_to_dataset
 
 
 # older GEOS warns for simple intersections, ignore
 warnings.filterwarnings("ignore", message="invalid value encountered in intersection")
+# shapely 1.8 announces the 2.0 STRtree API change on every tree, the 1.8 API is used here
+warnings.filterwarnings("ignore", message="STRtree will be changed in 2.0.0")
 # http://www.csgnetwork.com/gpsdistcalc.html
 # 4 digits ~ 23m roundup / 5 digits 2m roundup
 NDIGITS = 5
 ANGLE_OFFSET_LIMIT = 15
 ANGLE_STEP = 5
+# roundings tried by match_line_to_set(), every digit down means more benevolent matching
+OVERLAP_DIGITS = range(7, 2, -1)
+# relative error bound of floating point orientation, Shewchuk's ccwerrboundA
+_ORIENTATION_ERROR_BOUND = (3 + 16 * np.finfo(float).eps / 2) * np.finfo(float).eps / 2
 
 
 def lines_overlap(line1: shp.MultiLineString | shp.LineString,
                   line2: shp.MultiLineString | shp.LineString,
                   round_digits: int) -> bool:
-    """Determine whether two lines fully overlap with acceptable deviation.
-    Shapely doesn't compute overlap for MultiLineStrings, so helper method is needed to
-    determine overlap between all pairs of partial lineStrings
+    """Determine whether two lines overlap with acceptable deviation. First segments of all
+    parts of both lines are rounded and compared pair by pair, see segments_overlap()
     Args:
         line1 (shp.MultiLineString | shp.linestring): line checked for covering second line
         line2 (shp.MultiLineString | shp.linestring): line checked for being covered by first line
         round_digits (int): number of digits to round the coordinates - helps with divergency
     Returns:
         bool: True or False whether lines overlap"""
-    # lines may be linestring and multilinestrings
-    lines1, lines2 = None, None
-    if isinstance(line1, shp.MultiLineString):
-        lines1 = list(line1.geoms)
-    if isinstance(line2, shp.MultiLineString):
-        lines2 = list(line2.geoms)
-
-    # case multiline : multiline
-    if lines1 and lines2:
-        return any(
-            any(_lines_overlap(line, other_line, round_digits) for line in lines1)
-            for other_line in lines2)
-    # case multiline : line
-    if lines1 and not lines2:
-        return any(_lines_overlap(line, line2, round_digits) for line in lines1)
-    # case line : multiline
-    if lines2 and not lines1:
-        return any(_lines_overlap(line1, other_line, round_digits) for other_line in lines2)
-    # case line : line
-    return _lines_overlap(line1, line2, round_digits)
-
-
-def _lines_overlap(line1: shp.LineString, line2: shp.LineString, round_digits: int) -> bool:
-    """Private helper method for rounding and comparing partial LineString because
-    Shapely doesn't compute overlap for MultiLineStrings.
-    Args:
-        line1 (shp.linestring): line checked for covering second line
-        line2 (shp.linestring): line checked for being covered by first line
-        round_digits (int): number of digits to round the coordinates - helps with divergency
+    # lines may be linestring and multilinestrings, parts are compared in flat arrays
+    coords, part_offsets, line_offsets = flatten_coordinates([line1, line2])
+    segments = round_coordinates(_first_segments(coords, part_offsets), round_digits)
+    return bool(segments_overlap(segments[:line_offsets[1]], segments[line_offsets[1]:]).any())
+
+
+def _orientations(start: np.ndarray, end: np.ndarray, points: np.ndarray) -> np.ndarray:
+    """Side of every point from line through start and end, -1 right, 0 on the line, 1 left.
+    Floating point determinant is used where its error bound (Shewchuk's orient2d filter)
+    proves the sign, the rest is evaluated exactly, like the robust predicates of GEOS.
+    Args:
+        start (np.ndarray): start points of lines (n, 2)
+        end (np.ndarray): end points of lines (n, 2)
+        points (np.ndarray): tested points (n, 2)
+    Returns:
+        np.ndarray: orientation of every point, 0 for NaN coordinates"""
+    left = (end[:, 0] - start[:, 0]) * (points[:, 1] - start[:, 1])
+    right = (end[:, 1] - start[:, 1]) * (points[:, 0] - start[:, 0])
+    determinant = left - right
+    orientations = (determinant > 0).astype(int) - (determinant < 0)
+    # differences are exactly zero only for equal coordinates, such determinant is exact too
+    uncertain = (np.abs(determinant) <= _ORIENTATION_ERROR_BOUND * (np.abs(left) + np.abs(right))) \
+        & ((left != 0) | (right != 0))
+    for index in np.flatnonzero(uncertain):
+        start_x, start_y, end_x, end_y, point_x, point_y = (
+            Fraction(float(value)) for value in (*start[index], *end[index], *points[index]))
+        exact = (end_x - start_x) * (point_y - start_y) - (end_y - start_y) * (point_x - start_x)
+        orientations[index] = (exact > 0) - (exact < 0)
+    return orientations
+
+
+def _intervals(segments: np.ndarray, axis: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Lowest and highest coordinate of segments (n, 4) on axis, 0 for X and 1 for Y"""
+    return (np.minimum(segments[:, axis], segments[:, axis + 2]),
+            np.maximum(segments[:, axis], segments[:, axis + 2]))
+
+
+def segments_overlap(segments: np.ndarray, other_segments: np.ndarray) -> np.ndarray:
+    """Whether segments overlap for all pairs, the same as shapely overlaps() of LineStrings
+    of two points: segments are collinear and share a part, but neither covers the other
+    Args:
+        segments (np.ndarray): segments (n, 4) as (x1, y1, x2, y2)
+        other_segments (np.ndarray): segments (m, 4) as (x1, y1, x2, y2)
     Returns:
-        bool: whether either line covers the other"""
-    line1_coords = []
-    line2_coords = []
-    # round according to round_digits param
-    # bigger roundup means the lines are more likely to meet, eliminates offset
-    for point_i in range(2):
-        line1_coords.append((round(line1.coords[point_i][0], round_digits),
-                             round(line1.coords[point_i][1], round_digits)))
-        line2_coords.append((round(line2.coords[point_i][0], round_digits),
-                             round(line2.coords[point_i][1], round_digits)))
-    line1 = shp.LineString(line1_coords)
-    line2 = shp.LineString(line2_coords)
-    return line1.overlaps(line2) or line2.overlaps(line1)
+        np.ndarray: matrix (n, m), False for segments of zero length or NaN coordinates"""
+    segments = np.reshape(segments, (-1, 4)).astype(float)
+    other_segments = np.reshape(other_segments, (-1, 4)).astype(float)
+    overlapping = np.zeros((len(segments), len(other_segments)), dtype=bool)
+    (low_x, high_x), (low_y, high_y) = _intervals(segments, 0), _intervals(segments, 1)
+    (other_low_x, other_high_x), (other_low_y, other_high_y) = \
+        _intervals(other_segments, 0), _intervals(other_segments, 1)
+
+    def proper(segments: np.ndarray) -> np.ndarray:
+        return np.isfinite(segments).all(axis=1) \
+            & np.any(segments[:, :2] != segments[:, 2:], axis=1)
+    # only segments with intersecting bounding boxes can share a part
+    rows, columns = np.nonzero(
+        proper(segments)[:, np.newaxis] & proper(other_segments)
+        & (np.maximum(low_x[:, np.newaxis], other_low_x)
+           <= np.minimum(high_x[:, np.newaxis], other_high_x))
+        & (np.maximum(low_y[:, np.newaxis], other_low_y)
+           <= np.minimum(high_y[:, np.newaxis], other_high_y)))
+    start, end = segments[rows, :2], segments[rows, 2:]
+    collinear = (_orientations(start, end, other_segments[columns, :2]) == 0) \
+        & (_orientations(start, end, other_segments[columns, 2:]) == 0)
+    rows, columns = rows[collinear], columns[collinear]
+
+    # collinear segments are compared as intervals on X axis, on Y axis if they are vertical
+    vertical = segments[rows, 0] == segments[rows, 2]
+    low = np.where(vertical, low_y[rows], low_x[rows])
+    high = np.where(vertical, high_y[rows], high_x[rows])
+    other_low = np.where(vertical, other_low_y[columns], other_low_x[columns])
+    other_high = np.where(vertical, other_high_y[columns], other_high_x[columns])
+    shares_part = np.maximum(low, other_low) < np.minimum(high, other_high)
+    covers = (low <= other_low) & (other_high <= high)
+    covered = (other_low <= low) & (high <= other_high)
+    overlaps = shares_part & ~covers & ~covered
+    overlapping[rows[overlaps], columns[overlaps]] = True
+    return overlapping
 
 
 def angle_between(line_1: shp.MultiLineString, line_2: shp.MultiLineString) -> float:
@@ -99,24 +144,333 @@ def angle_between(line_1: shp.MultiLineString, line_2: shp.MultiLineString) -> f
     return np.degrees(angle_radians) % 90
 
 
+class OverlapFeatures(NamedTuple):
+    """Everything match_line_to_set() needs from lines, computed once per line instead of for
+    every pair and rounding. First segments of all parts of all lines are in flat arrays,
+    part p belongs to line part_lines[p]."""
+    directions: np.ndarray
+    part_lines: np.ndarray
+    segments: Dict[int, np.ndarray]
+
+    def take(self, positions: np.ndarray) -> 'OverlapFeatures':
+        """Features of lines at positions, e.g. of one segment"""
+        positions = np.asarray(positions, dtype=int)
+        offsets = np.searchsorted(self.part_lines, np.arange(len(self.directions) + 1))
+        starts, lengths = offsets[positions], offsets[positions + 1] - offsets[positions]
+        # concatenated ranges of parts of every selected line
+        parts = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) \
+            + np.arange(lengths.sum())
+        return OverlapFeatures(self.directions[positions],
+                               np.repeat(np.arange(len(positions)), lengths),
+                               {round_digits: segments[parts]
+                                for round_digits, segments in self.segments.items()})
+
+
+def _line_parts(geometry: shp.base.BaseGeometry) -> List[np.ndarray]:
+    """Coordinates of every part of (Multi)LineString, no parts for empty geometry"""
+    if geometry is None or geometry.is_empty:
+        return []
+    if hasattr(geometry, 'geoms'):
+        return [np.asarray(part.coords)[:, :2] for part in geometry.geoms]
+    return [np.asarray(geometry.coords)[:, :2]]
+
+
+def flatten_coordinates(geometries: Iterable[shp.base.BaseGeometry]) \
+        -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Flatten coordinates of lines into one array with offsets of parts and lines, the only
+    place the matching reads coordinates from shapely objects
+    Args:
+        geometries (Iterable[shp.base.BaseGeometry]): LineStrings or MultiLineStrings
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: coordinates (k, 2), offsets of parts in
+        coordinates (p + 1,) and offsets of lines in parts (n + 1,)"""
+    parts = [_line_parts(geometry) for geometry in geometries]
+    line_offsets = np.cumsum([0] + [len(line) for line in parts])
+    flat_parts = [part for line in parts for part in line]
+    part_offsets = np.cumsum([0] + [len(part) for part in flat_parts])
+    coords = np.concatenate(flat_parts) if flat_parts else np.empty((0, 2))
+    return coords.astype(float), part_offsets, line_offsets
+
+
+def bounds_from_coordinates(coords: np.ndarray, part_offsets: np.ndarray,
+                            line_offsets: np.ndarray) -> np.ndarray:
+    """Bounds of lines from flattened coordinates, same as shapely bounds of every line
+    Args:
+        coords (np.ndarray): coordinates (k, 2) from flatten_coordinates()
+        part_offsets (np.ndarray): offsets of parts in coordinates
+        line_offsets (np.ndarray): offsets of lines in parts
+    Returns:
+        np.ndarray: bounds of lines, shape (n, 4), NaN for empty lines"""
+    starts = part_offsets[line_offsets[:-1]]
+    not_empty = part_offsets[line_offsets[1:]] > starts
+    bounds = np.full((len(starts), 4), np.nan)
+    if not_empty.any():
+        # coordinates of not empty lines follow each other, reduce every line at once
+        line_starts = starts[not_empty]
+        bounds[not_empty, 0] = np.minimum.reduceat(coords[:, 0], line_starts)
+        bounds[not_empty, 1] = np.minimum.reduceat(coords[:, 1], line_starts)
+        bounds[not_empty, 2] = np.maximum.reduceat(coords[:, 0], line_starts)
+        bounds[not_empty, 3] = np.maximum.reduceat(coords[:, 1], line_starts)
+    return bounds
+
+
+def _first_segments(coords: np.ndarray, part_offsets: np.ndarray) -> np.ndarray:
+    """First segment of every part as (x1, y1, x2, y2), NaN for parts with less than
+    two coordinates"""
+    starts = part_offsets[:-1]
+    long_enough = np.diff(part_offsets) >= 2
+    segments = np.full((len(starts), 4), np.nan)
+    segments[long_enough, :2] = coords[starts[long_enough]]
+    segments[long_enough, 2:] = coords[starts[long_enough] + 1]
+    return segments
+
+
+def coordinate_overlap_features(coords: np.ndarray, part_offsets: np.ndarray,
+                                line_offsets: np.ndarray, bounds: np.ndarray) -> OverlapFeatures:
+    """Precompute features of match_line_to_set() from flattened coordinates of lines
+    Args:
+        coords (np.ndarray): coordinates (k, 2) from flatten_coordinates()
+        part_offsets (np.ndarray): offsets of parts in coordinates
+        line_offsets (np.ndarray): offsets of lines in parts
+        bounds (np.ndarray): bounds of lines, shape (n, 4)
+    Returns:
+        OverlapFeatures: features of lines in order of line_offsets"""
+    segments = _first_segments(coords, part_offsets)
+    return OverlapFeatures(bbox_directions(bounds),
+                           np.repeat(np.arange(len(line_offsets) - 1), np.diff(line_offsets)),
+                           {round_digits: round_coordinates(segments, round_digits)
+                            for round_digits in OVERLAP_DIGITS})
+
+
+def overlap_features(lines: Iterable[shp.MultiLineString | shp.LineString]) -> OverlapFeatures:
+    """Precompute directions of bounds diagonals and first segment of every part of lines
+    rounded for every rounding of OVERLAP_DIGITS, see lines_overlap()
+    Args:
+        lines (Iterable[shp.MultiLineString | shp.LineString]): any lines
+    Returns:
+        OverlapFeatures: features of lines in order of lines"""
+    coords, part_offsets, line_offsets = flatten_coordinates(lines)
+    return coordinate_overlap_features(coords, part_offsets, line_offsets,
+                                       bounds_from_coordinates(coords, part_offsets, line_offsets))
+
+
+def match_overlap_features(line_features: OverlapFeatures,
+                           other_features: OverlapFeatures) -> np.ndarray:
+    """Finds best match among other lines for every line, see match_line_to_set().
+    All pairs of parts are compared at once for every rounding, pairs turned too much
+    or accepted with finer rounding don't change the result.
+    Args:
+        line_features (OverlapFeatures): features of base lines
+        other_features (OverlapFeatures): features of lines with possible matches
+    Returns:
+        np.ndarray: position of best match in other lines for every line, -1 if not found"""
+    num_lines, num_others = len(line_features.directions), len(other_features.directions)
+    if num_lines == 0 or num_others == 0:
+        return np.full(num_lines, -1)
+    angles = _direction_angles(line_features.directions, other_features.directions)
+    with np.errstate(invalid='ignore'):
+        turned = angles < ANGLE_OFFSET_LIMIT
+    # rounding in which pair was accepted, candidates are ordered by it and other line
+    accepted_in = np.full((num_lines, num_others), len(OVERLAP_DIGITS))
+    for level, round_digits in enumerate(OVERLAP_DIGITS):
+        pending = turned & (accepted_in == len(OVERLAP_DIGITS))
+        if not pending.any():
+            break
+        # only parts of lines with a pending pair are compared
+        parts = np.flatnonzero(pending.any(axis=1)[line_features.part_lines])
+        other_parts = np.flatnonzero(pending.any(axis=0)[other_features.part_lines])
+        part_rows, part_columns = np.nonzero(segments_overlap(
+            line_features.segments[round_digits][parts],
+            other_features.segments[round_digits][other_parts]))
+        overlapping = np.zeros_like(pending)
+        overlapping[line_features.part_lines[parts[part_rows]],
+                    other_features.part_lines[other_parts[part_columns]]] = True
+        accepted_in[pending & overlapping] = level
+
+    candidates = accepted_in < len(OVERLAP_DIGITS)
+    # smallest angle, the first accepted wins on equality
+    best_angles = np.where(candidates, angles, np.inf).min(axis=1)
+    order = np.where(candidates & (angles == best_angles[:, np.newaxis]),
+                     accepted_in * num_others + np.arange(num_others),
+                     (len(OVERLAP_DIGITS) + 1) * num_others)
+    return np.where(candidates.any(axis=1), order.argmin(axis=1), -1)
+
+
 def match_line_to_set(line: shp.MultiLineString,
-                      other_lines: gpd.GeoSeries) -> shp.MultiLineString | None:
-    """Finds best match in list of other lines for line
+                      other_lines: gpd.GeoSeries,
+                      other_features: OverlapFeatures | None = None) \
+                      -> shp.MultiLineString | None:
+    """Finds best match in list of other lines for line, lines overlapping with any rounding
+    of OVERLAP_DIGITS and turned less than ANGLE_OFFSET_LIMIT are candidates
     Args:
         line (shp.MultiLineString): base line for which the matches should be found
         other_lines (gpd.GeoSeries): series of other lines with possible matches
+        other_features (OverlapFeatures | None, optional): precomputed features of other_lines,
+        e.g. StreetStore.overlap.take() of their rows, computed from other_lines if empty
     Returns:
         shp.MultiLineString | None: best match from other_lines or None if nothing was found"""
-    candidate_lines = {}
-    for round_digits in range(7, 2, -1):  # every digit down means more benevolent matching
-        for index, other_line in enumerate(other_lines):
-            angle = angle_between(line, other_line)
-            if lines_overlap(line, other_line, round_digits) and angle < ANGLE_OFFSET_LIMIT:
-                candidate_lines[f"{index}"] = angle
-    if candidate_lines:
-        best_match = min(candidate_lines, key=candidate_lines.get)
-        return other_lines.iloc[int(best_match)]
-    return None
+    if other_features is None:
+        other_features = overlap_features(other_lines)
+    best_match = match_overlap_features(overlap_features([line]), other_features)[0]
+    if best_match < 0:
+        return None
+    return other_lines.iloc[int(best_match)]
+
+
+def round_coordinates(coordinates: np.ndarray, round_digits: int) -> np.ndarray:
+    """Round array of coordinates with the same results as built-in round() on every item.
+    Numpy rounds by scaling, which can differ from round() only close to halfway values,
+    so only those few coordinates are rounded one by one.
+    Args:
+        coordinates (np.ndarray): array of coordinates of any shape
+        round_digits (int): number of digits to round the coordinates to
+    Returns:
+        np.ndarray: rounded copy of coordinates"""
+    coordinates = np.asarray(coordinates, dtype=float)
+    rounded = np.round(coordinates, round_digits)
+    scaled = coordinates * 10.0 ** round_digits
+    tolerance = np.abs(scaled) * 1e-12 + 1e-9
+    with np.errstate(invalid='ignore'):
+        halfway = np.abs(scaled - np.floor(scaled) - 0.5) < tolerance
+    for index in zip(*np.nonzero(halfway)):
+        rounded[index] = round(float(coordinates[index]), round_digits)
+    return rounded
+
+
+def _rounded_overlaps(line_bounds: np.ndarray, other_bounds: np.ndarray) -> np.ndarray:
+    """Overlap (intersection over union) of already rounded bounds (n, 4) and (m, 4)"""
+    minx, miny, maxx, maxy = (line_bounds[:, [coord]] for coord in range(4))
+    other_minx, other_miny, other_maxx, other_maxy = other_bounds.T
+    width = np.minimum(maxx, other_maxx) - np.maximum(minx, other_minx)
+    height = np.minimum(maxy, other_maxy) - np.maximum(miny, other_miny)
+    intersection = np.clip(width, 0, None) * np.clip(height, 0, None)
+    union = (maxx - minx) * (maxy - miny) \
+        + (other_maxx - other_minx) * (other_maxy - other_miny) - intersection
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(union > 0, intersection / union, np.nan)
+
+
+def bbox_directions(bounds: np.ndarray) -> np.ndarray:
+    """Unit vectors of bounds diagonals, used for angles between lines
+    Args:
+        bounds (np.ndarray): bounds of lines, shape (n, 4) or (4,)
+    Returns:
+        np.ndarray: unit vectors (n, 2), NaN for lines without extent"""
+    bounds = np.reshape(bounds, (-1, 4)).astype(float)
+    vectors = bounds[:, :2] - bounds[:, 2:]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return vectors / np.linalg.norm(vectors, axis=1)[:, np.newaxis]
+
+
+def _direction_angles(v1_unit: np.ndarray, v2_unit: np.ndarray) -> np.ndarray:
+    """Angles in degrees between unit vectors (n, 2) and (m, 2), modulo 90"""
+    with np.errstate(invalid='ignore'):
+        cosines = v1_unit[:, [0]] * v2_unit[:, 0] + v1_unit[:, [1]] * v2_unit[:, 1]
+        angle_radians = np.arccos(np.clip(cosines, -1.0, 1.0))
+    # modulo 90 to ignore direction of vector
+    return np.degrees(angle_radians) % 90
+
+
+def relaxation_steps() -> List[Tuple[int, int]]:
+    """Progressively bigger allowed angles used by the bbox overlap matching, with coarser
+    rounding in the last step once the angle reaches 45 degrees
+    Returns:
+        List[Tuple[int, int]]: pairs of (max accepted angle, round digits) in order of trying"""
+    steps = []
+    max_accepted_angle = ANGLE_OFFSET_LIMIT
+    while max_accepted_angle < 45:
+        max_accepted_angle = max_accepted_angle + ANGLE_STEP
+        round_digits = NDIGITS - 1 if max_accepted_angle >= 45 else NDIGITS
+        steps.append((max_accepted_angle, round_digits))
+    return steps
+
+
+class BoundsFeatures(NamedTuple):
+    """Everything the bbox overlap matching needs from bounds of lines, computed once per line
+    and reusable against any number of other networks"""
+    bounds: np.ndarray
+    directions: np.ndarray
+    rounded: Dict[int, np.ndarray]
+
+    def take(self, positions: np.ndarray) -> 'BoundsFeatures':
+        """Features of lines at positions, e.g. of one segment"""
+        return BoundsFeatures(self.bounds[positions], self.directions[positions],
+                              {round_digits: rounded[positions]
+                               for round_digits, rounded in self.rounded.items()})
+
+
+def bounds_features(bounds: np.ndarray) -> BoundsFeatures:
+    """Precompute rounded bounds for every rounding of relaxation_steps() and diagonal directions
+    Args:
+        bounds (np.ndarray): bounds of lines, shape (n, 4) or (4,)
+    Returns:
+        BoundsFeatures: features of lines in order of bounds"""
+    bounds = np.reshape(bounds, (-1, 4))
+    return BoundsFeatures(bounds, bbox_directions(bounds),
+                          {round_digits: round_coordinates(bounds, round_digits)
+                           for round_digits in {step[1] for step in relaxation_steps()}})
+
+
+def match_bounds_features(line_features: BoundsFeatures,
+                          other_features: BoundsFeatures) -> np.ndarray:
+    """Finds best match for every line among other lines based on overlap of bounding boxes.
+    Overlaps and angles are computed once for all pairs, every relaxation step only selects.
+    Args:
+        line_features (BoundsFeatures): features of base lines
+        other_features (BoundsFeatures): features of lines with possible matches
+    Returns:
+        np.ndarray: position of best match in other lines for every line, -1 if not found"""
+    matches = np.full(len(line_features.directions), -1)
+    steps = relaxation_steps()
+    # step in which every line was matched, kept only for the instrumentation
+    match_steps = np.full(len(matches), -1) if instrumentation.enabled() else None
+    if len(line_features.directions) == 0 or len(other_features.directions) == 0:
+        if match_steps is not None:
+            instrumentation.record_relaxation(match_steps, steps, NDIGITS)
+        return matches
+
+    angles = _direction_angles(line_features.directions, other_features.directions)
+    overlaps = {round_digits: _rounded_overlaps(rounded, other_features.rounded[round_digits])
+                for round_digits, rounded in line_features.rounded.items()}
+    for step, (max_accepted_angle, round_digits) in enumerate(steps):
+        pending = np.flatnonzero(matches < 0)
+        if len(pending) == 0:
+            break
+        # progressively bigger allowed angle and highest overlap, first line wins on equality
+        overlap = overlaps[round_digits][pending]
+        accepted = (angles[pending] < max_accepted_angle) & (overlap > 0)
+        best = np.where(accepted, overlap, -1).argmax(axis=1)
+        found = accepted[np.arange(len(pending)), best]
+        matches[pending[found]] = best[found]
+        if match_steps is not None:
+            match_steps[pending[found]] = step
+    if match_steps is not None:
+        instrumentation.record_relaxation(match_steps, steps, NDIGITS)
+    return matches
+
+
+def match_bounds_by_bbox_overlap(line_bounds: np.ndarray,
+                                 other_bounds: np.ndarray) -> np.ndarray:
+    """Finds best match for every line among other lines based on overlap of bounding boxes,
+    see match_bounds_features()
+    Args:
+        line_bounds (np.ndarray): bounds of base lines, shape (n, 4) or (4,)
+        other_bounds (np.ndarray): bounds of lines with possible matches, shape (m, 4)
+    Returns:
+        np.ndarray: position of best match in other_bounds for every line, -1 if not found"""
+    return match_bounds_features(bounds_features(line_bounds), bounds_features(other_bounds))
+
+
+def match_features_to_networks(line_features: BoundsFeatures,
+                               networks_features: List[BoundsFeatures]) -> List[np.ndarray]:
+    """Finds best match for every line in each of other networks from precomputed features
+    Args:
+        line_features (BoundsFeatures): features of base lines
+        networks_features (List[BoundsFeatures]): features of lines of every other network
+    Returns:
+        List[np.ndarray]: positions of best matches in every network, -1 if not found"""
+    return [match_bounds_features(line_features, other_features)
+            for other_features in networks_features]
 
 
 def match_lines_by_bbox_overlap(line: shp.MultiLineString,
@@ -127,32 +481,80 @@ def match_lines_by_bbox_overlap(line: shp.MultiLineString,
         other_lines (gpd.GeoSeries): series of other lines with possible matches
     Returns:
         shp.MultiLineString | None: best match from other_lines or None if nothing was found"""
-    max_accepted_angle = ANGLE_OFFSET_LIMIT
-    round_digits = NDIGITS
-    best_match = (0, 0, 0)  # overlap[0-1], angle[degrees], index of the line
-    while best_match == (0, 0, 0):
-        max_accepted_angle = max_accepted_angle + ANGLE_STEP
-        # allow bigger offset if nothing was found up to 45 degrees and try one last iteration
-        if max_accepted_angle >= 45:
-            round_digits = round_digits - 1
-        # iterate all lines from other set and save best match
-        for index, other_line in enumerate(other_lines):
-            angle = angle_between(line, other_line)
-            polygon = shp.box(*[round(coord, round_digits) for coord in line.bounds])
-            other_polygon = shp.box(*[round(coord, round_digits) for coord in other_line.bounds])
-            try:  # calculate overlap of bounding boxes of streets in <0-1> interval
-                bbox_overlap = polygon.intersection(other_polygon).area /         \
-                    polygon.union(other_polygon).area
-            except ZeroDivisionError:  # union can be empty, skip the street
-                continue
-            # progressively bigger allowed angle and highest overlap
-            if angle < max_accepted_angle and bbox_overlap > best_match[0]:
-                best_match = (bbox_overlap, angle, index)
-        # if last iteration didn't succeed, return no match
-        if max_accepted_angle >= 45 and best_match == (0, 0, 0):
-            return None
-
-    return other_lines.iloc[int(best_match[2])]
+    if other_lines.empty:
+        return None
+    best_match = match_bounds_by_bbox_overlap(np.array(line.bounds),
+                                              other_lines.bounds.to_numpy())[0]
+    if best_match < 0:
+        return None
+    return other_lines.iloc[int(best_match)]
+
+
+class StreetIndex(NamedTuple):
+    """Spatial index of street geometries, built once per basemap and shared by point matching"""
+    tree: STRtree
+    geometries: List[shp.base.BaseGeometry]
+    street_ids: np.ndarray
+
+
+def build_street_index(streets: gpd.GeoDataFrame, id_column: str = 'id') -> StreetIndex:
+    """Build STRtree over street geometries for nearest street queries
+    Args:
+        streets (gpd.GeoDataFrame): street network, usually the OSM basemap
+        id_column (str, optional): exact name of column with unique street IDs, defaults to 'id'
+    Returns:
+        StreetIndex: tree with geometries and street IDs in the order of the dataset"""
+    geometries = list(streets['geometry'])
+    return StreetIndex(STRtree(geometries), geometries, streets[id_column].to_numpy())
+
+
+def nearest_streets(street_index: StreetIndex,
+                    points: Iterable[shp.base.BaseGeometry],
+                    max_distance: float | None = None) -> List[int]:
+    """Find nearest street for every point using the spatial index
+    Args:
+        street_index (StreetIndex): index created by build_street_index()
+        points (Iterable[shp.base.BaseGeometry]): points to be matched
+        max_distance (float | None, optional): points further from any street are left unmatched,
+        in units of the dataset CRS. Defaults to None (no limit).
+    Returns:
+        List[int]: position of the nearest street in the indexed dataset or -1 if not matched,
+        on equal distances the street positioned first in the dataset wins"""
+    positions = []
+    for point in points:
+        nearest = street_index.tree.nearest_item(point) if not point.is_empty else None
+        if nearest is None:
+            positions.append(-1)
+            continue
+        distance = street_index.geometries[nearest].distance(point)
+        if max_distance is not None and distance > max_distance:
+            positions.append(-1)
+            continue
+        # tree returns any of equally distant streets, resolve ties the same way as full scan
+        minx, miny, maxx, maxy = point.bounds
+        window = shp.box(minx - distance, miny - distance, maxx + distance, maxy + distance)
+        positions.append(min(index for index in street_index.tree.query_items(window)
+                             if street_index.geometries[index].distance(point) == distance))
+    return positions
+
+
+def map_points_to_streets(street_index: StreetIndex,
+                          point_ids: Iterable[Any],
+                          points: Iterable[shp.base.BaseGeometry],
+                          max_distance: float | None = None) -> Dict[Any, Any]:
+    """Create map of {street id : point id} by minimal distance between them
+    Args:
+        street_index (StreetIndex): index created by build_street_index()
+        point_ids (Iterable[Any]): unique IDs of the points
+        points (Iterable[shp.base.BaseGeometry]): point geometries in the order of point_ids
+        max_distance (float | None, optional): maximal accepted distance, defaults to None
+    Returns:
+        Dict[Any, Any]: street id to point id, later point wins if more share one street"""
+    point_way_map = {}
+    for point_id, position in zip(point_ids, nearest_streets(street_index, points, max_distance)):
+        if position >= 0:
+            point_way_map[street_index.street_ids[position]] = point_id
+    return point_way_map
 
 
 if __name__ == '__main__':
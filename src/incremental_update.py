@@ -0,0 +1,197 @@
+"""
+Incremental update of the model from a newer version of a dataset. New version is compared
+with a stored fingerprint (ID and geometry hash) of the previous one, only added, modified and
+removed features are processed and only segments affected by them are matched again.
+The new fingerprint is stored by commit_fingerprint() only after the updated model is saved,
+so a failed save leaves the previous version to be diffed again.
+"""
+import hashlib
+import os
+from typing import Tuple, List, Any, NamedTuple
+os.environ['USE_PYGEOS'] = '0'
+
+# pylint: disable=wrong-import-position
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+
+from geometry_utils import build_street_index, map_points_to_streets, StreetIndex
+from location_matching import load_foreign_network, match_stores, ids_at_positions
+from street_store import StreetStore, build_street_store
+
+
+FINGERPRINT_COLUMNS = ['id', 'geometry_hash']
+
+
+class ChangeReport(NamedTuple):
+    """Summary of an incremental update, with fingerprint of the new version to commit"""
+    added: List[Any]
+    modified: List[Any]
+    removed: List[Any]
+    segments: List[int]
+    updated_rows: int
+    fingerprint: pd.DataFrame
+    fingerprint_path: str
+
+
+def default_fingerprint_path(filepath: str) -> str:
+    """Fingerprint is stored next to the dataset, e.g. 'bkom_scitanie_fingerprint.parquet'"""
+    return os.path.splitext(filepath)[0] + '_fingerprint.parquet'
+
+
+def dataset_fingerprint(dataset: gpd.GeoDataFrame, id_column: str) -> pd.DataFrame:
+    """Create fingerprint of the dataset, hash of geometry WKB for every ID
+    Args:
+        dataset (gpd.GeoDataFrame): dataset with unique IDs and 'geometry' column
+        id_column (str): exact name of column with unique IDs of the dataset
+    Returns:
+        pd.DataFrame: dataframe with FINGERPRINT_COLUMNS"""
+    hashes = [hashlib.sha1(geometry.wkb).hexdigest() if geometry is not None else ''
+              for geometry in dataset['geometry']]
+    return pd.DataFrame({FINGERPRINT_COLUMNS[0]: dataset[id_column].to_numpy(),
+                         FINGERPRINT_COLUMNS[1]: hashes})
+
+
+def load_fingerprint(fingerprint_path: str) -> pd.DataFrame:
+    """Load stored fingerprint, empty one if the dataset wasn't fingerprinted yet"""
+    if not os.path.exists(fingerprint_path):
+        return pd.DataFrame(columns=FINGERPRINT_COLUMNS)
+    return pd.read_parquet(fingerprint_path)
+
+
+def commit_fingerprint(report: ChangeReport):
+    """Store fingerprint of the updated version, call after the updated model is saved
+    Args:
+        report (ChangeReport): report of the incremental update of the model"""
+    tmp_path = report.fingerprint_path + '.tmp'
+    report.fingerprint.to_parquet(tmp_path)
+    os.replace(tmp_path, report.fingerprint_path)
+
+
+def diff_fingerprints(previous: pd.DataFrame,
+                      current: pd.DataFrame) -> Tuple[List[Any], List[Any], List[Any]]:
+    """Sort features into added, modified and removed by comparing fingerprints
+    Args:
+        previous (pd.DataFrame): fingerprint of the previous version of dataset
+        current (pd.DataFrame): fingerprint of the new version of dataset
+    Returns:
+        Tuple[List[Any], List[Any], List[Any]]: IDs of added, modified and removed features"""
+    id_column, hash_column = FINGERPRINT_COLUMNS
+    both = previous.merge(current, on=id_column, how='outer',
+                          suffixes=('_previous', '_current'), indicator=True)
+    added = both[both['_merge'] == 'right_only'][id_column]
+    removed = both[both['_merge'] == 'left_only'][id_column]
+    kept = both[both['_merge'] == 'both']
+    modified = kept[kept[f'{hash_column}_previous'] != kept[f'{hash_column}_current']][id_column]
+    return added.to_list(), modified.to_list(), removed.to_list()
+
+
+def _read_changes(filepath: str, original_id_column: str, model_id_column: str,
+                  fingerprint_path: str) -> Tuple[gpd.GeoDataFrame, pd.DataFrame, Tuple]:
+    """Read new version of dataset and diff it against the stored fingerprint"""
+    dataset = load_foreign_network(filepath, original_id_column, model_id_column)
+    fingerprint = dataset_fingerprint(dataset, model_id_column)
+    return dataset, fingerprint, diff_fingerprints(load_fingerprint(fingerprint_path),
+                                                   fingerprint)
+
+
+# pylint: disable=too-many-arguments
+def update_street_network_incremental(model: gpd.GeoDataFrame,
+                                      filepath: str,
+                                      original_id_column: str,
+                                      segment_matrix: List[Tuple[float, float, float, float]],
+                                      model_id_column: str,
+                                      fingerprint_path: str | None = None,
+                                      workers: int = 1,
+                                      model_store: StreetStore | None = None) \
+                                      -> Tuple[gpd.GeoDataFrame, ChangeReport]:
+    """Update ids from matched foreign network with changes in new version of the dataset.
+    Matches of modified and removed streets are cleared and all segments with changed streets
+    are matched again, the same way as match_street_network_to_osm() matches them.
+    Without stored fingerprint all streets are added and all their segments matched.
+    Args:
+        model (gpd.GeoDataFrame): basemap from OSM with already assigned segments
+        and column with ids matched from foreign network, updated in place
+        filepath (str): path to dataset with different street network basemap, must have geometry
+        original_id_column (str): exact name of column with unique IDs of the dataset
+        segment_matrix (List[Tuple[float, float, float, float]]): list of segments, must be same
+        as segments assigned to model
+        model_id_column (str): name of column with datasets ids in model
+        fingerprint_path (str | None, optional): fingerprint of the previously matched version,
+        next to the dataset if empty, replaced by the new one in commit_fingerprint()
+        workers (int, optional): number of processes matching the segments in parallel
+        model_store (StreetStore | None, optional): compact store of model streets to reuse
+    Returns:
+        Tuple[gpd.GeoDataFrame, ChangeReport]: updated model and report of the changes"""
+    fingerprint_path = fingerprint_path or default_fingerprint_path(filepath)
+    foreign_network, fingerprint, (added, modified, removed) = _read_changes(
+        filepath, original_id_column, model_id_column, fingerprint_path)
+    if model_store is None:
+        model_store = build_street_store(model, model_id_column)
+    foreign_store = build_street_store(foreign_network, model_id_column, segment_matrix)
+    column = model.columns.get_loc(model_id_column)
+
+    # clear matches of changed streets, their segments have to be matched again
+    stale_rows = np.flatnonzero(model[model_id_column].isin(modified + removed).to_numpy())
+    model.iloc[stale_rows, column] = np.nan
+    changed_streets = np.isin(foreign_store.ids, added + modified)
+    segments = np.union1d(model_store.segment_ids[stale_rows],
+                          foreign_store.segment_ids[changed_streets])
+    segments = segments[(segments >= 0) & (segments < len(segment_matrix))].tolist()
+
+    model_rows, matched_rows = match_stores(model_store, foreign_store, segments,
+                                            segment_matrix, workers)
+    previous_ids = model[model_id_column].to_numpy()[model_rows]
+    new_ids = ids_at_positions(foreign_store.ids, matched_rows)
+    model.iloc[model_rows, column] = new_ids
+    updated = ~(pd.isna(previous_ids) & pd.isna(new_ids)) & (previous_ids != new_ids)
+    updated_rows = len(np.union1d(stale_rows, model_rows[updated]))
+
+    return model, ChangeReport(added, modified, removed, segments, updated_rows, fingerprint,
+                               fingerprint_path)
+
+
+# pylint: disable=too-many-arguments
+def update_point_system_incremental(model: gpd.GeoDataFrame,
+                                    filepath: str,
+                                    original_id_column: str,
+                                    model_id_column: str,
+                                    fingerprint_path: str | None = None,
+                                    max_distance: float | None = None,
+                                    street_index: StreetIndex | None = None) \
+                                    -> Tuple[gpd.GeoDataFrame, ChangeReport]:
+    """Update ids in model with changes in new version of point system dataset.
+    Matches of modified and removed points are cleared, added and modified points are matched.
+    Args:
+        model (gpd.GeoDataFrame): basemap from OSM with existing column with point ids,
+        updated in place
+        filepath (str): path to any points dataset with coordinates
+        original_id_column (str): exact name of column with unique IDs of the dataset
+        model_id_column (str): name of column with datasets ids in model
+        fingerprint_path (str | None, optional): fingerprint of the previously matched version,
+        next to the dataset if empty, replaced by the new one in commit_fingerprint()
+        max_distance (float | None, optional): points further from every street stay unmatched
+        street_index (StreetIndex | None, optional): index of model streets to reuse
+    Returns:
+        Tuple[gpd.GeoDataFrame, ChangeReport]: updated model and report of the changes"""
+    fingerprint_path = fingerprint_path or default_fingerprint_path(filepath)
+    points, fingerprint, (added, modified, removed) = _read_changes(
+        filepath, original_id_column, model_id_column, fingerprint_path)
+    column = model.columns.get_loc(model_id_column)
+
+    stale_rows = np.flatnonzero(model[model_id_column].isin(modified + removed).to_numpy())
+    model.iloc[stale_rows, column] = np.nan
+    changed_points = points[points[model_id_column].isin(added + modified)]
+    if street_index is None:
+        street_index = build_street_index(model)
+    point_way_map = map_points_to_streets(street_index,
+                                          changed_points[model_id_column],
+                                          changed_points['geometry'],
+                                          max_distance)
+    new_matches = model['id'].map(point_way_map)
+    matched_rows = np.flatnonzero(new_matches.notna().to_numpy())
+    model.iloc[matched_rows, column] = new_matches.to_numpy()[matched_rows]
+
+    return model, ChangeReport(added, modified, removed, [],
+                               len(np.union1d(stale_rows, matched_rows)), fingerprint,
+                               fingerprint_path)
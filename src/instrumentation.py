@@ -0,0 +1,152 @@
+"""
+Opt-in instrumentation of the matching. When enabled, stages record their wall time and memory,
+matching records candidates of every segment and how many relaxation steps lines needed.
+When disabled, every hook is a single check of a module global.
+"""
+import json
+import sys
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+class Recorder:
+    """Stages, counters and segment statistics of one instrumented run"""
+
+    def __init__(self, trace_memory: bool = False):
+        """
+        Args:
+            trace_memory (bool, optional): trace peak of Python allocations of every stage,
+            slows allocations down, only peak RSS of the process is recorded otherwise"""
+        self.trace_memory = trace_memory
+        self.stages: List[Dict[str, Any]] = []
+        self.counters: Counter = Counter()
+        self.segments: List[Dict[str, Any]] = []
+
+    def report(self) -> Dict[str, Any]:
+        """Structured report of the run"""
+        return {'stages': self.stages, 'counters': dict(self.counters),
+                'segments': self.segments}
+
+    def write_report(self, filepath: str):
+        """Save report as JSON"""
+        with open(filepath, 'w', encoding='utf-8') as file:
+            json.dump(self.report(), file, indent=2)
+
+
+_RECORDER: Recorder | None = None
+
+
+def enable(trace_memory: bool = False) -> Recorder:
+    """Start recording, hooks of the matching record to the returned recorder"""
+    global _RECORDER  # pylint: disable=global-statement
+    _RECORDER = Recorder(trace_memory)
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    return _RECORDER
+
+
+def disable() -> Recorder | None:
+    """Stop recording, recorder of the finished run is returned"""
+    global _RECORDER  # pylint: disable=global-statement
+    recorder, _RECORDER = _RECORDER, None
+    if recorder is not None and recorder.trace_memory:
+        tracemalloc.stop()
+    return recorder
+
+
+def enabled() -> bool:
+    """Whether hooks record, check it before computing anything only for the recorder"""
+    return _RECORDER is not None
+
+
+def _max_rss_mb() -> float | None:
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    return max_rss / 2**20 if sys.platform == 'darwin' else max_rss / 2**10
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Record wall time and memory of the enclosed stage"""
+    recorder = _RECORDER
+    if recorder is None:
+        yield
+        return
+    if recorder.trace_memory:
+        tracemalloc.reset_peak()
+    start = time.perf_counter()
+    yield
+    record = {'name': name, 'seconds': round(time.perf_counter() - start, 4),
+              'max_rss_mb': _max_rss_mb()}
+    if recorder.trace_memory:
+        record['peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 2**20, 2)
+    recorder.stages.append(record)
+
+
+def count(name: str, value: int = 1):
+    """Add value to counter"""
+    if _RECORDER is not None:
+        _RECORDER.counters[name] += value
+
+
+def merge_counters(counters: Dict[str, int]):
+    """Add counters collected elsewhere, e.g. in worker processes"""
+    if _RECORDER is not None:
+        _RECORDER.counters.update(counters)
+
+
+@contextmanager
+def collecting_counters() -> Iterator[Counter]:
+    """Collect counters of the enclosed code separately, used in worker processes
+    which send them back to be merged with merge_counters()"""
+    global _RECORDER  # pylint: disable=global-statement
+    previous, _RECORDER = _RECORDER, Recorder()
+    try:
+        yield _RECORDER.counters
+    finally:
+        _RECORDER = previous
+
+
+def record_segment(segment_id: int, lines: int, candidates: List[int]):
+    """Record number of lines and candidates of every network in segment"""
+    if _RECORDER is not None:
+        _RECORDER.segments.append({'segment': int(segment_id), 'lines': int(lines),
+                                   'candidates': [int(number) for number in candidates]})
+
+
+def record_relaxation(match_steps: np.ndarray, steps: List[tuple], full_digits: int):
+    """Count lines by relaxation step in which they were matched. Unmatched lines went through
+    all steps, they count all of them as relaxation iterations and count as drops of round
+    digits if any step drops them. Lines without candidates are counted the same way.
+    Args:
+        match_steps (np.ndarray): index of step of every line, -1 for unmatched
+        steps (List[tuple]): (max accepted angle, round digits) of every step
+        full_digits (int): round digits of the first steps, lower ones are counted as drops"""
+    if _RECORDER is None:
+        return
+    counters = _RECORDER.counters
+    counters['lines'] += len(match_steps)
+    unmatched = int((match_steps < 0).sum())
+    counters['lines_unmatched'] += unmatched
+    counters['relaxation_iterations'] += unmatched * len(steps)
+    if any(round_digits < full_digits for _, round_digits in steps):
+        counters['round_digits_drops'] += unmatched
+    for index, number in enumerate(np.bincount(match_steps[match_steps >= 0],
+                                               minlength=len(steps))):
+        max_angle, round_digits = steps[index]
+        counters[f'matched_at_angle_{max_angle}'] += int(number)
+        counters['relaxation_iterations'] += int(number) * (index + 1)
+        if round_digits < full_digits:
+            counters['round_digits_drops'] += int(number)
@@ -0,0 +1,135 @@
+"""
+Unified table of cycling intensities of every street. Attribute tables of all datasets are loaded
+in bulk, aggregated by year and direction and joined to the model through the matched IDs,
+so consumers read numbers of a street from one table instead of querying every dataset.
+"""
+import os
+from typing import List
+os.environ['USE_PYGEOS'] = '0'
+
+# pylint: disable=wrong-import-position
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from model_io import read_model, MODEL_PATH
+from pipeline import read_pipeline_config
+from strava_store import StravaStore, load_strava_store, COUNT_COLUMNS
+
+
+INTENSITY_PATH = '../datasets/street_intensity.parquet'
+STRAVA_CSV_PATH = '../datasets/strava_daily_2022_may_aug.csv'
+MODEL_ID_COLUMNS = ['id', 'counters_id', 'biketowork_id', 'city_census_id']
+BIKETOWORK_COLUMNS = {'data_2019': 'biketowork_2019', 'data_2020': 'biketowork_2020',
+                      'data_2021': 'biketowork_2021', 'dpnk_22': 'biketowork_2022'}
+CENSUS_COLUMNS = {'prac_2018': 'census_workday_2018', 'vik_2018': 'census_weekend_2018',
+                  'prac_2020': 'census_workday_2020', 'vik_2020': 'census_weekend_2020',
+                  'prac_2022': 'census_workday_2022', 'vik_2022': 'census_weekend_2022'}
+COUNTERS_COLUMNS = {'FirstDirection_Cyclists': 'counters_first',
+                    'SecondDirection_Cyclists': 'counters_second'}
+STRAVA_COLUMNS = {'ride_count': 'strava_rides', 'forward_trip_count': 'strava_forward',
+                  'reverse_trip_count': 'strava_reverse'}
+# streets of one row group are read together, table is sorted by street id
+ROW_GROUP_SIZE = 2048
+
+
+def load_attribute_table(filepath: str, columns: List[str]) -> pd.DataFrame:
+    """Read only attribute columns of dataset, without geometry"""
+    return pd.DataFrame(gpd.read_file(filepath, ignore_geometry=True)[columns])
+
+
+def biketowork_intensity(biketowork: pd.DataFrame) -> pd.DataFrame:
+    """Yearly biketowork numbers indexed by road ID"""
+    return biketowork.groupby('GID_ROAD')[list(BIKETOWORK_COLUMNS)].first() \
+        .rename(columns=BIKETOWORK_COLUMNS)
+
+
+def census_intensity(census: pd.DataFrame) -> pd.DataFrame:
+    """Workday and weekend census numbers by year indexed by road ID"""
+    return census.groupby('id')[list(CENSUS_COLUMNS)].first().rename(columns=CENSUS_COLUMNS)
+
+
+def _yearly_columns(sums: pd.DataFrame) -> pd.DataFrame:
+    """Pivot (id, year) rows to '<column>_<year>' columns"""
+    wide = sums.unstack('year')
+    wide.columns = [f'{column}_{year}' for column, year in wide.columns]
+    return wide
+
+
+def counters_intensity(counters: pd.DataFrame) -> pd.DataFrame:
+    """Yearly sums of counted cyclists in both directions indexed by location ID"""
+    dates = counters['datum']
+    # ArcGIS GeoJSON stores dates as milliseconds since epoch
+    dates = pd.to_datetime(dates, unit='ms') if pd.api.types.is_numeric_dtype(dates) \
+        else pd.to_datetime(dates)
+    sums = counters.assign(year=dates.dt.year) \
+        .groupby(['LocationId', 'year'])[list(COUNTERS_COLUMNS)].sum() \
+        .rename(columns=COUNTERS_COLUMNS)
+    return _yearly_columns(sums)
+
+
+def strava_intensity(store: StravaStore) -> pd.DataFrame:
+    """Yearly sums of Strava daily counts indexed by OSM ID"""
+    days = pd.DataFrame(np.asarray(store.counts), columns=COUNT_COLUMNS)
+    days['id'] = np.repeat(np.asarray(store.osm_ids), np.diff(store.offsets))
+    days['year'] = np.asarray(store.dates).astype('datetime64[Y]').astype(int) + 1970
+    sums = days.groupby(['id', 'year'])[COUNT_COLUMNS].sum().rename(columns=STRAVA_COLUMNS)
+    return _yearly_columns(sums)
+
+
+def build_intensity_table(model: pd.DataFrame, biketowork: pd.DataFrame, census: pd.DataFrame,
+                          counters: pd.DataFrame, store: StravaStore) -> pd.DataFrame:
+    """Join intensities of all datasets to model streets by matched IDs
+    Args:
+        model (pd.DataFrame): model with MODEL_ID_COLUMNS
+        biketowork (pd.DataFrame): biketowork attribute table
+        census (pd.DataFrame): census attribute table
+        counters (pd.DataFrame): daily counters attribute table
+        store (StravaStore): Strava daily counts
+    Returns:
+        pd.DataFrame: one row per street ordered by 'id', NaN where street has no data"""
+    table = pd.DataFrame(model[MODEL_ID_COLUMNS]).drop_duplicates('id')
+    table = table.merge(counters_intensity(counters), how='left',
+                        left_on='counters_id', right_index=True)
+    table = table.merge(biketowork_intensity(biketowork), how='left',
+                        left_on='biketowork_id', right_index=True)
+    table = table.merge(census_intensity(census), how='left',
+                        left_on='city_census_id', right_index=True)
+    table = table.merge(strava_intensity(store), how='left', left_on='id', right_index=True)
+    return table.sort_values('id').reset_index(drop=True)
+
+
+def write_intensity_table(table: pd.DataFrame, filepath: str = INTENSITY_PATH):
+    """Write table as Parquet, row groups of sorted streets allow reads of few streets"""
+    table.to_parquet(filepath + '.tmp', index=False, row_group_size=ROW_GROUP_SIZE)
+    os.replace(filepath + '.tmp', filepath)
+
+
+def read_street_intensity(osm_ids: List[int], filepath: str = INTENSITY_PATH,
+                          columns: List[str] | None = None) -> pd.DataFrame:
+    """Read intensities of streets, only row groups containing the streets are read
+    Args:
+        osm_ids (List[int]): OSM IDs of streets
+        filepath (str, optional): path to the intensity table
+        columns (List[str] | None, optional): columns to read, all if empty
+    Returns:
+        pd.DataFrame: rows of the found streets"""
+    if columns is not None and 'id' not in columns:
+        columns = ['id'] + list(columns)
+    return pq.read_table(filepath, columns=columns,
+                         filters=[('id', 'in', list(osm_ids))]).to_pandas()
+
+
+if __name__ == '__main__':
+    datasets = {dataset.name: dataset for dataset in read_pipeline_config().datasets}
+    intensity_table = build_intensity_table(
+        read_model(MODEL_PATH, columns=MODEL_ID_COLUMNS),
+        load_attribute_table(datasets['biketowork'].filepath,
+                             ['GID_ROAD'] + list(BIKETOWORK_COLUMNS)),
+        load_attribute_table(datasets['census'].filepath, ['id'] + list(CENSUS_COLUMNS)),
+        load_attribute_table(datasets['counters'].filepath,
+                             ['LocationId', 'datum'] + list(COUNTERS_COLUMNS)),
+        load_strava_store(STRAVA_CSV_PATH))
+    write_intensity_table(intensity_table)
+    print(intensity_table.head())
@@ -3,82 +3,257 @@ Module loads basemap from OpenStreetMap network and matches other
 networks and locations to it. The final model is a map of IDs to all
 corresponding dataset from the Brno Cycling traffic intensity study
 """
+import multiprocessing
 import os
-from typing import Tuple, List
+from concurrent.futures import ProcessPoolExecutor
+from math import ceil
+from typing import Dict, Tuple, List, Iterable
 os.environ['USE_PYGEOS'] = '0'
 
 # pylint: disable=wrong-import-position
 import geopandas as gpd
 import pandas as pd
-import pyrosm
-from numpy import NaN
+import numpy as np
 
-from geometry_utils import match_lines_by_bbox_overlap
-from segmentation_utils import generate_segments, assign_segments_to_dataset
+import instrumentation
+# basemap loading is part of the matching API
+from osm_basemap import (  # pylint: disable=unused-import
+    load_osm_basemap, load_cached_basemap, DEFAULT_BBOX, DEFAULT_NUM_SEGMENTS)
+from geometry_utils import match_features_to_networks, build_street_index, \
+    map_points_to_streets, relaxation_steps, BoundsFeatures, StreetIndex, NDIGITS
+from segmentation_utils import group_segments, segment_candidates
+from street_store import StreetStore, build_street_store
 
 
-DEFAULT_BBOX = (16.4855, 49.1538, 16.7550, 49.2507)
-DEFAULT_NUM_SEGMENTS = 32
-
-
-def load_osm_basemap(filepath: str,
-                     bounding_box: Tuple[float, float, float, float] | None = None) \
-                     -> gpd.GeoDataFrame:
-    """Read OpenStreetMap .osm.pbf file and create a street network dataset for Brno
-    Args:
-        filepath (str): Path to the '.osm.pbf' file from OpenstreetMap
-        bounding_box (typing.List, optional): List of coordinates [minx, miny, maxx, maxy]
-        to trim the full dataset to  required location. Defaults to None.
-    Returns:
-        gpd.GeoDataFrame: Brno basemap dataframe"""
-    if not bounding_box:
-        bounding_box = DEFAULT_BBOX  # default values for Brno borders
-    pbf_reader = pyrosm.OSM(filepath, bounding_box=bounding_box)
-    basemap_df = pd.concat([pbf_reader.get_network('cycling'), pbf_reader.get_network('driving')])
-    basemap_df = basemap_df.drop_duplicates(subset='id')
-    return basemap_df
+_NO_ROWS = np.empty(0, dtype=int)
+# workers are not forked, threads of the caller (e.g. reading point datasets in the pipeline)
+# may hold locks a forked worker would inherit and never see released
+_POOL_CONTEXT = multiprocessing.get_context(
+    'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
 
 
+# pylint: disable=too-many-arguments
 def match_points_to_osm(basemap: gpd.GeoDataFrame,
                           filepath: str,
                           id_column: str,
-                          new_id_column: str) -> gpd.GeoDataFrame:
+                          new_id_column: str,
+                          max_distance: float | None = None,
+                          street_index: StreetIndex | None = None) -> gpd.GeoDataFrame:
     """Matches locations of any points of interest to OSM basemap. Geometry must be Points.
     Args:
         basemap (gpd.GeoDataFrame): osm basemap of Brno
         counters_path (str): path to any points dataset with coordinates
         id_column (str): exact name of column with unique IDs of the dataset
+        max_distance (float | None, optional): points further from every street stay unmatched
+        street_index (StreetIndex | None, optional): index of basemap streets to reuse,
+        built from basemap if not provided
     Returns:
         gpd.GeoDataFrame: original basemap with new column of matched counters"""
-    points_df = gpd.read_file(filepath)
-    unique_points = points_df.drop_duplicates(subset=id_column)
-    counter_ids = unique_points[id_column].to_list()
-    counters_geometries = unique_points['geometry'].to_list()
-
-    # load distances between streets and points
-    distances_df = pd.DataFrame()
-    for i, item in enumerate(counters_geometries):
-        # pylint: disable=cell-var-from-loop
-        distances_df[f'distance{i}'] = basemap['geometry'].apply(lambda x: x.distance(item))
+    unique_points = load_foreign_network(filepath, id_column)
+    if street_index is None:
+        street_index = build_street_index(basemap)
 
     # create map of [osm street id : point id] by minimal distance between them
-    point_way_map = {}
-    for i in range(len(unique_points)):
-        min_dist = basemap[distances_df[f"distance{i}"]==distances_df[f"distance{i}"].min()]
-        point_way_map[min_dist['id'].unique()[0]] = counter_ids[i]
+    point_way_map = map_points_to_streets(street_index,
+                                          unique_points[id_column],
+                                          unique_points['geometry'],
+                                          max_distance)
 
     # append point ids to basemap
     basemap[new_id_column] = basemap['id'].map(point_way_map)
     return basemap
 
 
+def _segment_to_dataset_positions(matches: np.ndarray, segment_rows: np.ndarray) -> np.ndarray:
+    """Translate positions of matches inside segment to positions in the whole dataset
+    Args:
+        matches (np.ndarray): positions of matched lines in segment, -1 for no match
+        segment_rows (np.ndarray): positions of the segment lines in the dataset
+    Returns:
+        np.ndarray: positions of matched lines in the dataset, -1 for no match"""
+    positions = np.full(len(matches), -1)
+    matched = matches >= 0
+    positions[matched] = segment_rows[matches[matched]]
+    return positions
+
+
+def ids_at_positions(ids: np.ndarray, positions: np.ndarray) -> np.ndarray:
+    """Select IDs by position, NaN for negative positions (no match)
+    Args:
+        ids (np.ndarray): IDs of the dataset
+        positions (np.ndarray): positions of rows in the dataset, -1 for no match
+    Returns:
+        np.ndarray: IDs in order of positions"""
+    return pd.Series(ids).reindex(positions).to_numpy()
+
+
+def _match_segment_batch(batch: List[Tuple[BoundsFeatures, List[BoundsFeatures]]]) \
+        -> List[List[np.ndarray]]:
+    """Match lines of every segment in batch to all networks, runs in worker processes
+    Args:
+        batch (List[Tuple[BoundsFeatures, List[BoundsFeatures]]]): pairs of (features of lines,
+        features of other lines of every network)
+    Returns:
+        List[List[np.ndarray]]: positions of matches in other lines of every network
+        for every segment, -1 if not found"""
+    return [match_features_to_networks(line_features, networks_features)
+            for line_features, networks_features in batch]
+
+
+def _match_traced_segment_batch(batch: List[Tuple[BoundsFeatures, List[BoundsFeatures]]]) \
+        -> Tuple[List[List[np.ndarray]], Dict[str, int]]:
+    """Match batch like _match_segment_batch() and return counters of the instrumentation
+    collected in the worker process too"""
+    with instrumentation.collecting_counters() as counters:
+        matched = _match_segment_batch(batch)
+    return matched, dict(counters)
+
+
+def match_segments_to_networks(segments: List[Tuple[BoundsFeatures, List[BoundsFeatures]]],
+                               workers: int = 1) -> List[List[np.ndarray]]:
+    """Match lines of independent segments to any number of networks in a single pass,
+    optionally in a pool of processes. Workers receive only precomputed features of lines
+    of the segments, results keep order of segments and networks.
+    Args:
+        segments (List[Tuple[BoundsFeatures, List[BoundsFeatures]]]): pairs of (features
+        of lines, features of other lines of every network), see StreetStore.features
+        workers (int, optional): number of processes, segments are matched in this process
+        if 1 or less. Defaults to 1.
+    Returns:
+        List[List[np.ndarray]]: positions of matches in other lines of every network
+        for every segment, -1 if not found"""
+    results = [[np.full(len(line_features.bounds), -1) for _ in networks_features]
+               for line_features, networks_features in segments]
+    # segments with nothing to compare are not worth sending to workers
+    to_match = [index for index, (line_features, networks_features) in enumerate(segments)
+                if len(line_features.bounds) > 0
+                and any(len(other_features.bounds) > 0 for other_features in networks_features)]
+    if instrumentation.enabled():
+        instrumentation.count('segments_skipped', len(segments) - len(to_match))
+        # lines of skipped segments are counted as lines without candidates in matching
+        for index in set(range(len(segments))).difference(to_match):
+            line_features, networks_features = segments[index]
+            for _ in networks_features:
+                instrumentation.record_relaxation(np.full(len(line_features.bounds), -1),
+                                                  relaxation_steps(), NDIGITS)
+    if workers <= 1 or len(to_match) < 2:
+        matched = _match_segment_batch([segments[index] for index in to_match])
+    else:
+        # few batches per worker balance uneven segments without much transfer overhead
+        batch_size = ceil(len(to_match) / (workers * 4))
+        batches = [[segments[index] for index in to_match[start:start + batch_size]]
+                   for start in range(0, len(to_match), batch_size)]
+        with ProcessPoolExecutor(max_workers=workers, mp_context=_POOL_CONTEXT) as executor:
+            if instrumentation.enabled():
+                matched = []
+                for batch, counters in executor.map(_match_traced_segment_batch, batches):
+                    matched.extend(batch)
+                    instrumentation.merge_counters(counters)
+            else:
+                matched = [matches for batch in executor.map(_match_segment_batch, batches)
+                           for matches in batch]
+    for index, matches in zip(to_match, matched):
+        results[index] = matches
+    return results
+
+
 # pylint: disable=too-many-arguments
+def match_store_to_networks(line_store: StreetStore,
+                            other_stores: List[StreetStore],
+                            segment_ids: Iterable[int],
+                            segment_matrix: List[Tuple[float, float, float, float]],
+                            workers: int = 1,
+                            halo: float | None = None) -> Tuple[np.ndarray, List[np.ndarray]]:
+    """Match lines from one store to all other stores in one walk over the segments,
+    lines of every segment are grouped and prepared only once for all the stores
+    Args:
+        line_store (StreetStore): lines to find matches for, grouped by their segment IDs
+        other_stores (List[StreetStore]): networks with possible matches
+        segment_ids (Iterable[int]): segments to process
+        segment_matrix (List[Tuple[float, float, float, float]]): list of segments
+        workers (int, optional): number of processes matching the segments in parallel
+        halo (float | None, optional): other lines reaching segment extended by halo are its
+        candidates too, only lines with the same segment ID if None (default)
+    Returns:
+        Tuple[np.ndarray, List[np.ndarray]]: positions of processed lines in line_store ordered
+        by segments and positions of their matches in every other store, -1 for no match"""
+    segment_ids = list(segment_ids)
+    # group all networks by segments once
+    line_groups = group_segments(line_store.segment_ids)
+    other_groups = [group_segments(other_store.segment_ids) if halo is None
+                    else segment_candidates(other_store.bounds, segment_matrix, halo)
+                    for other_store in other_stores]
+
+    line_rows = [line_groups.get(segment_id, _NO_ROWS) for segment_id in segment_ids]
+    other_rows = [[groups.get(segment_id, _NO_ROWS) for groups in other_groups]
+                  for segment_id in segment_ids]
+    if instrumentation.enabled():
+        for segment_id, line_segm, other_segm in zip(segment_ids, line_rows, other_rows):
+            instrumentation.record_segment(segment_id, len(line_segm),
+                                           [len(rows) for rows in other_segm])
+    segment_matches = match_segments_to_networks(
+        [(line_store.features.take(line_segm),
+          [other_store.features.take(rows)
+           for other_store, rows in zip(other_stores, other_segm)])
+         for line_segm, other_segm in zip(line_rows, other_rows)], workers)
+    matched_rows = [np.concatenate([_NO_ROWS] + [
+        _segment_to_dataset_positions(matches[network], other_segm[network])
+        for matches, other_segm in zip(segment_matches, other_rows)])
+                    for network in range(len(other_stores))]
+    return np.concatenate([_NO_ROWS, *line_rows]), matched_rows
+
+
+# pylint: disable=too-many-arguments
+def match_stores(line_store: StreetStore,
+                 other_store: StreetStore,
+                 segment_ids: Iterable[int],
+                 segment_matrix: List[Tuple[float, float, float, float]],
+                 workers: int = 1,
+                 halo: float | None = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Match lines from one store to the other segment by segment
+    Args:
+        line_store (StreetStore): lines to find matches for, grouped by their segment IDs
+        other_store (StreetStore): lines with possible matches
+        segment_ids (Iterable[int]): segments to process
+        segment_matrix (List[Tuple[float, float, float, float]]): list of segments
+        workers (int, optional): number of processes matching the segments in parallel
+        halo (float | None, optional): other lines reaching segment extended by halo are its
+        candidates too, only lines with the same segment ID if None (default)
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: positions of processed lines in line_store ordered by
+        segments and positions of their matches in other_store, -1 for no match"""
+    line_rows, (matched_rows,) = match_store_to_networks(line_store, [other_store], segment_ids,
+                                                         segment_matrix, workers, halo)
+    return line_rows, matched_rows
+
+
+def load_foreign_network(filepath: str, id_column: str,
+                         new_id_column: str | None = None) -> gpd.GeoDataFrame:
+    """Read dataset with any street network or points, keep unique IDs and geometry only
+    Args:
+        filepath (str): path to dataset, must have geometry
+        id_column (str): exact name of column with unique IDs of the dataset
+        new_id_column (str | None, optional): optional rename of the ID column
+    Returns:
+        gpd.GeoDataFrame: dataset with ID and 'geometry' columns"""
+    foreign_network = gpd.read_file(filepath)
+    if new_id_column:
+        foreign_network = foreign_network.rename(columns={id_column: new_id_column})
+    else:
+        new_id_column = id_column
+    foreign_network = foreign_network.drop_duplicates(subset=new_id_column)
+    return foreign_network[[new_id_column, 'geometry']]
+
+
 def match_street_network_to_osm(basemap: gpd.GeoDataFrame,
                                 filepath: str,
                                 id_column: str,
                                 segment_matrix: List[Tuple[float, float, float, float]],
                                 new_id_column: str | None = None,
-                                segment_ids: List[int] | None = None) -> gpd.GeoDataFrame:
+                                segment_ids: List[int] | None = None,
+                                workers: int = 1,
+                                halo: float | None = None,
+                                basemap_store: StreetStore | None = None) -> gpd.GeoDataFrame:
     """Matches streets from any network to osm basemap,
     using algorithm based on street bounding box overlap and angle.
     Args:
@@ -89,37 +264,33 @@ def match_street_network_to_osm(basemap: gpd.GeoDataFrame,
         segment_matrix (List[Tuple[float, float, float, float]]): list of segments used in basemap
         of the osm basemap used, must be same as one used in load_osm_basemap() function
         segment_ids (List[int] | None, optional): list of segment ids to process, all if empty
+        workers (int, optional): number of processes matching the segments in parallel
+        halo (float | None, optional): foreign streets reaching segment extended by halo
+        are its candidates too, only streets starting in the segment if None (default)
+        basemap_store (StreetStore | None, optional): compact store of basemap to reuse
+        between datasets, built from basemap with its 'segment_id' column if not provided
     Returns:
         gpd.GeoDataFrame: basemap with appended column with matched foreign network streets"""
-    final_model = gpd.GeoDataFrame()
     # prepare dataset to be processed
-    foreign_network = gpd.read_file(filepath)
-    if new_id_column:
-        foreign_network = foreign_network.rename(columns={id_column: new_id_column})
-    else:
-        new_id_column = id_column
-    foreign_network = foreign_network.drop_duplicates(subset=new_id_column)
-    foreign_network = foreign_network[[new_id_column, 'geometry']]
-    foreign_network = assign_segments_to_dataset(foreign_network, segment_matrix, new_id_column)
+    new_id_column = new_id_column or id_column
+    with instrumentation.stage('load_datasets'):
+        foreign_network = load_foreign_network(filepath, id_column, new_id_column)
+    # matching works with compact stores of networks and positions of streets
+    with instrumentation.stage('segment'):
+        if basemap_store is None:
+            basemap_store = build_street_store(basemap, 'id')
+        foreign_store = build_street_store(foreign_network, new_id_column,
+                                           segment_matrix if halo is None else None)
+
     # compare corresponding segments
     segment_ids = range(len(segment_matrix)) if not segment_ids else segment_ids
-    for segment_id in segment_ids:
-        basemap_segm = basemap[basemap['segment_id'] == segment_id].copy()
-        foreign_segm = foreign_network[foreign_network['segment_id'] == segment_id].copy()
-
-        matched_lines = []
-        for basemap_line in basemap_segm['geometry']:
-            new_match = match_lines_by_bbox_overlap(basemap_line, foreign_segm['geometry'])
-            if new_match:  # query street id by geometry found by the algorithm
-                new_match = foreign_segm[foreign_segm['geometry']
-                                         == new_match][new_id_column].array[0]
-            else:  # no matches found, NaN to match column length
-                new_match = NaN
-            matched_lines.append(new_match)
-
-        basemap_segm[new_id_column] = matched_lines
-        final_model = pd.concat([final_model, basemap_segm])
+    with instrumentation.stage('match'):
+        basemap_rows, matched_rows = match_stores(basemap_store, foreign_store, segment_ids,
+                                                  segment_matrix, workers, halo)
 
+    # join results back to the full basemap, street ids by position, NaN for no match
+    final_model = basemap.iloc[basemap_rows].copy()
+    final_model[new_id_column] = ids_at_positions(foreign_store.ids, matched_rows)
     return final_model
 
 
@@ -127,7 +298,10 @@ def update_street_network(model: gpd.GeoDataFrame,
                           filepath: str,
                           original_id_column: str,
                           segment_matrix: List[Tuple[float, float, float, float]],
-                          model_id_column: str) -> gpd.GeoDataFrame:
+                          model_id_column: str,
+                          workers: int = 1,
+                          halo: float | None = None,
+                          model_store: StreetStore | None = None) -> gpd.GeoDataFrame:
     """Updates ids from matched foreign network with new version of the dataset
     Args:
         model (gpd.GeoDataFrame): basemap from OSM with already assigned segments
@@ -138,107 +312,71 @@ def update_street_network(model: gpd.GeoDataFrame,
         as segments assigned to model
         model_id_column (str): name of column with datasets ids in model
         (could be different after rename)
+        workers (int, optional): number of processes matching the segments in parallel
+        halo (float | None, optional): model streets reaching segment extended by halo
+        are its candidates too, only streets of the segment if None (default)
+        model_store (StreetStore | None, optional): compact store of model streets to reuse,
+        built from model with its 'segment_id' column if not provided
     Returns:
         gpd.GeoDataFrame: model with updated column with foreign network streets ids"""
-    foreign_network = gpd.read_file(filepath)
-    foreign_network = foreign_network.rename(columns={original_id_column: model_id_column})
-    foreign_network = foreign_network.drop_duplicates(subset=model_id_column)
-    foreign_network = foreign_network[[model_id_column, 'geometry']]
+    foreign_network = load_foreign_network(filepath, original_id_column, model_id_column)
 
     # load not already assigned streets from foreign network
     new_streets = foreign_network[
         ~foreign_network[model_id_column].isin(model[model_id_column])]
-    new_streets = assign_segments_to_dataset(new_streets, segment_matrix, model_id_column)
-
+    new_streets_store = build_street_store(new_streets, model_id_column, segment_matrix)
+    if model_store is None:
+        model_store = build_street_store(model, model_id_column)
+    # match new line from foreign to segment of basemodel (other way around)
+    new_street_rows, model_rows = match_stores(new_streets_store, model_store,
+                                               range(len(segment_matrix)), segment_matrix,
+                                               workers, halo)
+    matched = model_rows >= 0
+    model_rows, new_street_rows = model_rows[matched], new_street_rows[matched]
+
+    # update found matches in model, later new street wins if more match one model street
+    _, last_occurrence = np.unique(model_rows[::-1], return_index=True)
+    last_occurrence = len(model_rows) - 1 - last_occurrence
     final_model = model.copy()
-    segment_ids = range(len(segment_matrix))
-    for segment_id in segment_ids:
-        model_segm = model[model['segment_id'] == segment_id].copy()
-        new_streets_segm = new_streets[new_streets['segment_id'] == segment_id].copy()
-
-        # match new line from foreign to segment of basemodel (other way around)
-        for new_line in new_streets_segm['geometry']:
-            new_match = match_lines_by_bbox_overlap(new_line, model_segm['geometry'])
-            if new_match:  # query street ID by geometry found by the algorithm
-                new_line = new_streets_segm[new_streets_segm['geometry']
-                                            == new_line][model_id_column].array[0]
-                # update found match in model
-                final_model.loc[final_model['geometry'] == new_match, model_id_column] = new_line
-
+    final_model.iloc[model_rows[last_occurrence], final_model.columns.get_loc(model_id_column)] = \
+        new_streets_store.ids[new_street_rows[last_occurrence]]
     return final_model
 
 
+# pylint: disable=too-many-arguments
 def update_point_system(model: gpd.GeoDataFrame,
                         filepath: str,
                         original_id_column: str,
-                        model_id_column: str) -> gpd.GeoDataFrame:
+                        model_id_column: str,
+                        max_distance: float | None = None,
+                        street_index: StreetIndex | None = None) -> gpd.GeoDataFrame:
     """Update ids in model from newer version of point system dataset
     Args:
         model (gpd.GeoDataFrame): basemap from OSM with existing column with point ids
         filepath (str): path to any points dataset with coordinates
         original_id_column (str): exact name of column with unique IDs of the dataset
         model_id_column (str): name of column with datasets ids in model
+        max_distance (float | None, optional): points further from every street stay unmatched
+        street_index (StreetIndex | None, optional): index of model streets to reuse,
+        e.g. the one used by match_points_to_osm(), built from model if not provided
     Returns:
         gpd.GeoDataFrame: model with updated column with point system ids
     """
-    points_df = gpd.read_file(filepath)
-    points_df = points_df.rename(columns={original_id_column: model_id_column})
-    unique_points = points_df.drop_duplicates(subset=model_id_column)
+    unique_points = load_foreign_network(filepath, original_id_column, model_id_column)
     # load not already assigned points from dataset
     new_points = unique_points[
         ~unique_points[model_id_column].isin(model[model_id_column])]
-    counter_ids = new_points[model_id_column].to_list()
-    counters_geometries = new_points['geometry'].to_list()
-
-    # load distances between streets and points
-    distances_df = pd.DataFrame()
-    for i, item in enumerate(counters_geometries):
-        # pylint: disable=cell-var-from-loop
-        distances_df[f'distance{i}'] = model['geometry'].apply(lambda x: x.distance(item))
+    if street_index is None:
+        street_index = build_street_index(model)
 
     # create map of {osm street id : point id} by minimal distance between them
-    point_way_map = {}
-    for i in range(len(new_points)):
-        min_dist = model[distances_df[f"distance{i}"]==distances_df[f"distance{i}"].min()]
-        point_way_map[min_dist['id'].unique()[0]] = counter_ids[i]
+    point_way_map = map_points_to_streets(street_index,
+                                          new_points[model_id_column],
+                                          new_points['geometry'],
+                                          max_distance)
 
     # assign newly found point matches
-    for model_id, point_id in point_way_map.items():
-        model.loc[model['id'] == model_id, model_id_column] = point_id
+    new_matches = model['id'].map(point_way_map)
+    matched_rows = new_matches.notna().to_numpy()
+    model.loc[matched_rows, model_id_column] = new_matches[matched_rows].to_numpy()
     return model
-
-
-if __name__ == '__main__':
-    # read osm street network
-    if not os.path.exists('../datasets/basemap.pkl'):
-        model = load_osm_basemap("../datasets/czech_republic-latest.osm.pbf")
-        print(model.head())
-        model.to_pickle("../datasets/basemap.pkl")
-    else:
-        model = pd.read_pickle("../datasets/basemap.pkl")
-    # match counter unit locations to basemap
-    model = match_points_to_osm(model,
-                                '../datasets/cyklodetektory.geojson',
-                                'LocationId',
-                                'counters_id')
-    print(model.head())
-
-    # match biketowork street network to basemap
-    segments = generate_segments(DEFAULT_BBOX, DEFAULT_NUM_SEGMENTS)
-    model = assign_segments_to_dataset(model, segments, 'id')
-    model = match_street_network_to_osm(model,
-                                        "../datasets/do_prace_na_kole.geojson",
-                                        "GID_ROAD",
-                                        segments,
-                                        'biketowork_id')
-    print(model.head())
-
-    # match bkom street network to basemap
-    model = match_street_network_to_osm(model,
-                                        "../datasets/bkom_scitanie.geojson",
-                                        "id",
-                                        segments,
-                                        'city_census_id')
-    print(model.head())
-
-    gpd.GeoDataFrame(model).to_file('../datasets/full_model.geojson', driver="GeoJSON")
@@ -0,0 +1,285 @@
+"""
+Long-running local matching service. Segmented basemap, its street store, spatial index and
+bounds features of every segment are kept in memory, so single points and lines are matched
+without loading anything. Basemap is reloaded in the background when its source or cache changes.
+Endpoints (JSON responses):
+    GET  /match_point?x=<x>&y=<y>[&max_distance=<d>]
+    POST /match_line with GeoJSON geometry of (Multi)LineString in body {"geometry": {...}}
+    GET  /lookup_osm_id?id=<osm id>
+    GET  /status
+    POST /reload
+"""
+import json
+import logging
+import os
+import threading
+import time
+from argparse import ArgumentParser
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, NamedTuple, Tuple
+from urllib.parse import parse_qs, urlparse
+os.environ['USE_PYGEOS'] = '0'
+
+# pylint: disable=wrong-import-position
+import geopandas as gpd
+import numpy as np
+from shapely import geometry as shp
+
+from geometry_utils import bounds_features, match_bounds_features, build_street_index, \
+    nearest_streets, BoundsFeatures, StreetIndex
+from osm_basemap import load_cached_basemap, basemap_cache_files, DEFAULT_CACHE_DIR
+from pipeline import read_pipeline_config, DEFAULT_CONFIG_PATH
+from segmentation_utils import generate_segments, group_segments, segments_of_points, \
+    OUTSIDE_SEGMENT
+from street_store import StreetStore, build_street_store
+
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+DEFAULT_RELOAD_INTERVAL = 5.0
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class WarmBasemap(NamedTuple):
+    """Basemap with everything the queries need, built once per load"""
+    basemap: gpd.GeoDataFrame
+    segment_matrix: List[Tuple[float, float, float, float]]
+    store: StreetStore
+    street_index: StreetIndex
+    segment_rows: Dict[int, np.ndarray]
+    segment_features: Dict[int, BoundsFeatures]
+    positions: Dict[Any, int]
+
+
+def warm_basemap(basemap: gpd.GeoDataFrame,
+                 segment_matrix: List[Tuple[float, float, float, float]]) -> WarmBasemap:
+    """Build store, spatial index and features of every segment of basemap
+    Args:
+        basemap (gpd.GeoDataFrame): basemap with 'id' column, its 'segment_id' column is used
+        if present, streets are assigned to segment_matrix otherwise
+        segment_matrix (List[Tuple[float, float, float, float]]): list of segments
+    Returns:
+        WarmBasemap: basemap prepared for queries"""
+    basemap = gpd.GeoDataFrame(basemap).reset_index(drop=True)
+    store = build_street_store(basemap, 'id',
+                               None if 'segment_id' in basemap.columns else segment_matrix)
+    segment_rows = group_segments(store.segment_ids)
+    segment_rows.pop(OUTSIDE_SEGMENT, None)
+    return WarmBasemap(basemap, segment_matrix, store, build_street_index(basemap),
+                       segment_rows,
+                       {segment_id: store.features.take(rows)
+                        for segment_id, rows in segment_rows.items()},
+                       {street_id: position for position, street_id in enumerate(store.ids)})
+
+
+class MatchingService:
+    """Queries against the warm basemap, safe to call from many threads. Reload builds the new
+    basemap aside and swaps it in, queries running meanwhile finish with the previous one."""
+
+    def __init__(self, load_basemap: Callable[[], gpd.GeoDataFrame],
+                 source_stamp: Callable[[], Any],
+                 segment_matrix: List[Tuple[float, float, float, float]]):
+        """
+        Args:
+            load_basemap (Callable[[], gpd.GeoDataFrame]): loads the current basemap
+            source_stamp (Callable[[], Any]): anything that changes with the basemap source,
+            e.g. modification times of the files
+            segment_matrix (List[Tuple[float, float, float, float]]): segments of the basemap"""
+        self._load = lambda: warm_basemap(load_basemap(), segment_matrix)
+        self.source_stamp = source_stamp
+        self.warm: WarmBasemap | None = None
+        self.stamp = None
+        self.loaded_at = 0.0
+        self._reload_lock = threading.Lock()
+        self._stop = threading.Event()
+        self.reload()
+
+    def reload(self):
+        """Load the basemap and swap it in"""
+        with self._reload_lock:
+            warm = self._load()
+            # stamp after loading, loading itself may create the cache
+            self.warm, self.stamp, self.loaded_at = warm, self.source_stamp(), time.time()
+
+    def reload_if_changed(self) -> bool:
+        """Reload basemap if its source changed since the last load"""
+        if self.source_stamp() == self.stamp:
+            return False
+        self.reload()
+        return True
+
+    def watch(self, interval: float = DEFAULT_RELOAD_INTERVAL) -> threading.Thread:
+        """Check the source every interval seconds in a background thread until stop(),
+        failed reload is logged and the previous basemap stays warm until the next check"""
+        def check():
+            while not self._stop.wait(interval):
+                try:
+                    self.reload_if_changed()
+                except Exception:  # pylint: disable=broad-exception-caught
+                    _LOGGER.exception('Reload of the basemap failed, keeping the previous one')
+        thread = threading.Thread(target=check, daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        """Stop the background reloading"""
+        self._stop.set()
+
+    def match_point(self, x: float, y: float,
+                    max_distance: float | None = None) -> Dict[str, Any]:
+        """Nearest street of point, the same as matching of point systems
+        Returns:
+            Dict[str, Any]: 'osm_id' of the street or None and its 'distance'"""
+        warm = self.warm
+        point = shp.Point(x, y)
+        position = nearest_streets(warm.street_index, [point], max_distance)[0]
+        if position < 0:
+            return {'osm_id': None, 'distance': None}
+        return {'osm_id': warm.store.ids[position].item(),
+                'distance': warm.street_index.geometries[position].distance(point)}
+
+    def match_line(self, line: shp.base.BaseGeometry) -> Dict[str, Any]:
+        """Match line to streets of its segment with the bbox overlap matching
+        Returns:
+            Dict[str, Any]: 'segment_id' of line, 'osm_ids' of streets which would be matched
+            to the line if it was their only candidate and 'best_osm_id', best match of line
+            among the streets or None"""
+        warm = self.warm
+        # empty geometry has no bounds
+        if line.is_empty:
+            return {'segment_id': OUTSIDE_SEGMENT, 'osm_ids': [], 'best_osm_id': None}
+        bounds = np.reshape(line.bounds, (1, 4))
+        segment_id = int(segments_of_points(bounds[:, 0], bounds[:, 1],
+                                            warm.segment_matrix)[0])
+        if segment_id not in warm.segment_rows:
+            return {'segment_id': segment_id, 'osm_ids': [], 'best_osm_id': None}
+        street_ids = warm.store.ids[warm.segment_rows[segment_id]]
+        features = warm.segment_features[segment_id]
+        line_features = bounds_features(bounds)
+        accepting = match_bounds_features(features, line_features) == 0
+        best = match_bounds_features(line_features, features)[0]
+        return {'segment_id': segment_id, 'osm_ids': street_ids[accepting].tolist(),
+                'best_osm_id': street_ids[best].item() if best >= 0 else None}
+
+    def lookup_osm_id(self, osm_id: int) -> Dict[str, Any] | None:
+        """Attributes of street and its geometry as GeoJSON, None for unknown street"""
+        warm = self.warm
+        position = warm.positions.get(osm_id)
+        if position is None:
+            return None
+        street = warm.basemap.iloc[[position]]
+        attributes = json.loads(street.drop(columns='geometry').to_json(orient='records'))[0]
+        attributes['geometry'] = shp.mapping(street['geometry'].iloc[0])
+        return attributes
+
+    def status(self) -> Dict[str, Any]:
+        """Size and age of the loaded basemap"""
+        return {'streets': len(self.warm.store.ids), 'segments': len(self.warm.segment_rows),
+                'loaded_at': self.loaded_at}
+
+
+class MatchingRequestHandler(BaseHTTPRequestHandler):
+    """JSON API of MatchingService set as 'service' attribute of the server"""
+    # keep-alive connections, clients don't pay for a new connection per query
+    protocol_version = 'HTTP/1.1'
+
+    def _respond(self, status: int, body: Any):
+        content = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _handle(self, handler: Callable[[], Any] | None):
+        if handler is None:
+            self._respond(404, {'error': f'unknown endpoint {self.path}'})
+            return
+        try:
+            result = handler()
+        except (KeyError, ValueError, TypeError, AttributeError) as error:
+            self._respond(400, {'error': f'invalid request: {error!r}'})
+            return
+        if result is None:
+            self._respond(404, {'error': 'not found'})
+        else:
+            self._respond(200, result)
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Queries of points and streets and status"""
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        service = self.server.service
+        handlers = {
+            '/match_point': lambda: service.match_point(
+                float(query['x']), float(query['y']),
+                float(query['max_distance']) if 'max_distance' in query else None),
+            '/lookup_osm_id': lambda: service.lookup_osm_id(int(query['id'])),
+            '/status': service.status}
+        self._handle(handlers.get(url.path))
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """Matching of lines and reload"""
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        service = self.server.service
+
+        def reload():
+            service.reload()
+            return service.status()
+        handlers = {
+            '/match_line': lambda: service.match_line(shp.shape(json.loads(body)['geometry'])),
+            '/reload': reload}
+        self._handle(handlers.get(urlparse(self.path).path))
+
+
+def create_server(service: MatchingService, host: str = DEFAULT_HOST,
+                  port: int = DEFAULT_PORT) -> ThreadingHTTPServer:
+    """HTTP server of service, requests are handled in threads, port 0 picks a free one"""
+    server = ThreadingHTTPServer((host, port), MatchingRequestHandler)
+    server.service = service
+    return server
+
+
+def _basemap_source_stamp(filepath: str, cache_dir: str) -> Tuple:
+    """Modification times of the '.osm.pbf' file and of its cached basemaps"""
+    stat = os.stat(filepath)
+    return (stat.st_size, stat.st_mtime_ns,
+            tuple((path, os.stat(path).st_mtime_ns)
+                  for path in basemap_cache_files(filepath, cache_dir)))
+
+
+def service_from_config(config_path: str = DEFAULT_CONFIG_PATH,
+                        cache_dir: str = DEFAULT_CACHE_DIR) -> MatchingService:
+    """Service of the cached basemap of the pipeline config, see pipeline.py"""
+    config = read_pipeline_config(config_path)
+    segments = generate_segments(config.bounding_box, config.num_segments)
+    return MatchingService(
+        partial(load_cached_basemap, config.basemap_path, config.bounding_box, segments,
+                cache_dir),
+        partial(_basemap_source_stamp, config.basemap_path, cache_dir), segments)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Serve matching queries against the warm OSM basemap')
+    parser.add_argument('config', nargs='?', default=DEFAULT_CONFIG_PATH)
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--reload-interval', type=float, default=DEFAULT_RELOAD_INTERVAL,
+                        help='seconds between checks of the basemap source')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    matching_service = service_from_config(args.config)
+    matching_service.watch(args.reload_interval)
+    http_server = create_server(matching_service, args.host, args.port)
+    print(f'Serving {matching_service.status()["streets"]} streets on '
+          f'http://{args.host}:{http_server.server_port}')
+    try:
+        http_server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        matching_service.stop()
+        http_server.server_close()
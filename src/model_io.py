@@ -0,0 +1,108 @@
+"""
+Reading and writing of the final model. Columnar GeoParquet (default) and FlatGeobuf with
+spatial index allow reading only selected columns and streets in a bounding box,
+GeoJSON is kept as an optional export for tools which need it.
+"""
+import os
+from typing import Tuple, List
+os.environ['USE_PYGEOS'] = '0'
+
+# pylint: disable=wrong-import-position
+import fiona
+import geopandas as gpd
+import pyarrow.parquet as pq
+from shapely import geometry as shp
+
+from segmentation_utils import BOUNDS_COLUMNS
+
+
+MODEL_PATH = '../datasets/full_model.parquet'
+MODEL_DRIVERS = {'.parquet': 'GeoParquet', '.fgb': 'FlatGeobuf', '.geojson': 'GeoJSON'}
+# rows ordered by segments keep every row group spatially compact for bbox reads
+ROW_GROUP_SIZE = 4096
+
+
+def model_driver(filepath: str) -> str:
+    """Format of the model file from its extension, one of MODEL_DRIVERS"""
+    extension = os.path.splitext(filepath)[1].lower()
+    if extension not in MODEL_DRIVERS:
+        raise ValueError(f'Unsupported model format {extension}, '
+                         f'expected one of {list(MODEL_DRIVERS)}')
+    return MODEL_DRIVERS[extension]
+
+
+def parquet_compatible(dataset: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+    """Convert object columns with mixed values (e.g. OSM tags) to strings, keep missing"""
+    dataset = dataset.copy()
+    for column in dataset.columns:
+        if column != 'geometry' and dataset[column].dtype == object:
+            values = dataset[column]
+            dataset[column] = values.where(values.isna(), values.astype(str))
+    return dataset
+
+
+def write_model(model: gpd.GeoDataFrame, filepath: str = MODEL_PATH):
+    """Write model in format given by extension of filepath (.parquet, .fgb or .geojson),
+    file is replaced only once it is completely written
+    Args:
+        model (gpd.GeoDataFrame): model or any other geodataframe
+        filepath (str, optional): path to the output file"""
+    driver = model_driver(filepath)
+    model = gpd.GeoDataFrame(model)
+    # GDAL drivers recognize the file by extension, keep it for the temporary file
+    root, extension = os.path.splitext(filepath)
+    tmp_path = root + '.tmp' + extension
+    if driver == 'GeoParquet':
+        parquet_compatible(model).to_parquet(tmp_path, index=False,
+                                             row_group_size=ROW_GROUP_SIZE)
+    elif driver == 'FlatGeobuf':
+        model.to_file(tmp_path, driver=driver, SPATIAL_INDEX='YES')
+    else:
+        model.to_file(tmp_path, driver=driver)
+    os.replace(tmp_path, filepath)
+
+
+def _bbox_filters(bounding_box: Tuple[float, float, float, float]) -> List[Tuple]:
+    """Parquet filters selecting rows with bounds intersecting bounding box"""
+    min_x, min_y, max_x, max_y = bounding_box
+    return [(BOUNDS_COLUMNS[2], '>=', min_x), (BOUNDS_COLUMNS[3], '>=', min_y),
+            (BOUNDS_COLUMNS[0], '<=', max_x), (BOUNDS_COLUMNS[1], '<=', max_y)]
+
+
+def read_model(filepath: str = MODEL_PATH,
+               columns: List[str] | None = None,
+               bounding_box: Tuple[float, float, float, float] | None = None) \
+               -> gpd.GeoDataFrame:
+    """Read model, only selected columns and streets intersecting bounding box.
+    GeoParquet skips row groups outside of bounding box using bounds columns statistics,
+    FlatGeobuf uses its spatial index, GeoJSON is always parsed completely.
+    Args:
+        filepath (str, optional): path to the model file
+        columns (List[str] | None, optional): columns to read, geometry is always included,
+        all columns if empty
+        bounding_box (Tuple[float, float, float, float] | None, optional): (min_x, min_y,
+        max_x, max_y) of streets to read, whole model if empty
+    Returns:
+        gpd.GeoDataFrame: selected part of model"""
+    driver = model_driver(filepath)
+    if columns is not None and 'geometry' not in columns:
+        columns = list(columns) + ['geometry']
+    if driver == 'FlatGeobuf':
+        ignore_fields = None
+        if columns is not None:
+            with fiona.open(filepath) as collection:
+                ignore_fields = [field for field in collection.schema['properties']
+                                 if field not in columns]
+        return gpd.read_file(filepath, bbox=bounding_box, ignore_fields=ignore_fields)
+    if driver == 'GeoJSON':
+        model = gpd.read_file(filepath, bbox=bounding_box)
+        return model if columns is None else model[columns]
+
+    if bounding_box is not None and set(BOUNDS_COLUMNS).issubset(pq.read_schema(filepath).names):
+        model = gpd.read_parquet(filepath, columns=columns, filters=_bbox_filters(bounding_box))
+    else:
+        model = gpd.read_parquet(filepath, columns=columns)
+    if bounding_box is not None:
+        # bounds only preselect, same streets as the OGR bbox filter of the other formats
+        model = model[model.intersects(shp.box(*bounding_box))]
+    return model.reset_index(drop=True)
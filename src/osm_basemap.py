@@ -0,0 +1,208 @@
+"""
+Loading of the OSM basemap and its persistent cache. Prepared basemap is stored with
+precomputed bounds and segment IDs as GeoParquet, under a key derived from content of the
+'.osm.pbf' file, bounding box, segments and columns, so any change of the inputs creates a new
+entry. Entries of different bounding boxes, segments or columns are kept side by side.
+"""
+import glob
+import hashlib
+import json
+import os
+from typing import Tuple, List
+os.environ['USE_PYGEOS'] = '0'
+
+# pylint: disable=wrong-import-position
+import geopandas as gpd
+import pandas as pd
+
+from model_io import parquet_compatible
+from segmentation_utils import generate_segments, assign_segments_to_dataset, BOUNDS_COLUMNS
+
+
+DEFAULT_BBOX = (16.4855, 49.1538, 16.7550, 49.2507)
+DEFAULT_NUM_SEGMENTS = 32
+# OSM networks combined into basemap, first network wins for streets in both
+NETWORK_TYPES = ('cycling', 'driving')
+# columns needed for matching, other OSM tags can be dropped when loading
+MATCHING_COLUMNS = ['id', 'geometry']
+DEFAULT_CACHE_DIR = '../datasets/cache'
+# bump when content of the cached basemap changes to invalidate older entries
+CACHE_VERSION = 1
+_DIGESTS_FILE = 'digests.json'
+_PBF_SUFFIX = '.osm.pbf'
+_KEY_LENGTH = 16
+_CHUNK_SIZE = 1 << 20
+
+
+def load_osm_basemap(filepath: str,
+                     bounding_box: Tuple[float, float, float, float] | None = None,
+                     columns: List[str] | None = None) -> gpd.GeoDataFrame:
+    """Read OpenStreetMap .osm.pbf file and create a street network dataset for Brno.
+    Networks are read one by one, pruned to columns and deduplicated while going, so only
+    the kept columns of one network are held besides the result.
+    Args:
+        filepath (str): Path to the '.osm.pbf' file from OpenstreetMap
+        bounding_box (typing.List, optional): List of coordinates [minx, miny, maxx, maxy]
+        to trim the full dataset to  required location. Defaults to None.
+        columns (List[str] | None, optional): columns to keep, e.g. MATCHING_COLUMNS,
+        all pyrosm columns if empty
+    Returns:
+        gpd.GeoDataFrame: Brno basemap dataframe"""
+    # pyrosm is slow to import and needed only when the cache is built
+    import pyrosm  # pylint: disable=import-outside-toplevel
+    if not bounding_box:
+        bounding_box = DEFAULT_BBOX  # default values for Brno borders
+    pbf_reader = pyrosm.OSM(filepath, bounding_box=list(bounding_box))
+    basemap_parts = []
+    loaded_ids = set()
+    for network_type in NETWORK_TYPES:
+        network = pbf_reader.get_network(network_type)
+        if network is None:  # nothing in the bounding box
+            continue
+        if columns:
+            network = network[[column for column in columns if column in network.columns]]
+        # streets in both networks are kept only once
+        network = network[~network['id'].isin(loaded_ids)].drop_duplicates(subset='id')
+        loaded_ids.update(network['id'])
+        basemap_parts.append(network)
+    basemap_df = pd.concat(basemap_parts, ignore_index=True) if basemap_parts \
+        else gpd.GeoDataFrame(columns=columns or ['id', 'geometry'])
+    return gpd.GeoDataFrame(basemap_df)
+
+
+def file_digest(filepath: str, cache_dir: str = DEFAULT_CACHE_DIR) -> str:
+    """Calculate SHA-256 digest of file content. Digests are remembered in cache_dir
+    together with size and modification time of the file, unchanged file isn't read again.
+    Args:
+        filepath (str): path to the file
+        cache_dir (str, optional): directory for remembered digests
+    Returns:
+        str: hex digest of the file content"""
+    stat = os.stat(filepath)
+    digests_path = os.path.join(cache_dir, _DIGESTS_FILE)
+    digests = {}
+    if os.path.exists(digests_path):
+        with open(digests_path, 'r', encoding='utf-8') as file:
+            digests = json.load(file)
+    file_key = os.path.abspath(filepath)
+    known = digests.get(file_key)
+    if known and known['size'] == stat.st_size and known['mtime_ns'] == stat.st_mtime_ns:
+        return known['digest']
+
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as file:
+        while chunk := file.read(_CHUNK_SIZE):
+            digest.update(chunk)
+    digests[file_key] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                         'digest': digest.hexdigest()}
+    os.makedirs(cache_dir, exist_ok=True)
+    # replaced at once, readers never see half-written digests
+    temporary_path = f'{digests_path}.{os.getpid()}.tmp'
+    with open(temporary_path, 'w', encoding='utf-8') as file:
+        json.dump(digests, file)
+    os.replace(temporary_path, digests_path)
+    return digest.hexdigest()
+
+
+# pylint: disable=too-many-arguments
+def basemap_cache_path(filepath: str,
+                       bounding_box: Tuple[float, float, float, float],
+                       segment_matrix: List[Tuple[float, float, float, float]],
+                       cache_dir: str = DEFAULT_CACHE_DIR,
+                       columns: List[str] | None = None) -> str:
+    """Path of cached basemap for given inputs
+    Args:
+        filepath (str): Path to the '.osm.pbf' file from OpenstreetMap
+        bounding_box (Tuple[float, float, float, float]): [minx, miny, maxx, maxy] of basemap
+        segment_matrix (List[Tuple[float, float, float, float]]): segments assigned to basemap
+        cache_dir (str, optional): directory with cached basemaps
+        columns (List[str] | None, optional): columns kept from OSM, all if empty
+    Returns:
+        str: path to the GeoParquet file, named by the '.osm.pbf' file, key of the inputs
+        and key of the file content"""
+    inputs_key = _inputs_key(bounding_box, segment_matrix, columns)
+    content_key = _key([CACHE_VERSION, file_digest(filepath, cache_dir)])
+    return os.path.join(cache_dir, f"{_cache_prefix(filepath)}{inputs_key}_{content_key}.parquet")
+
+
+def _key(values: List) -> str:
+    return hashlib.sha256(json.dumps(values).encode()).hexdigest()[:_KEY_LENGTH]
+
+
+def _inputs_key(bounding_box: Tuple[float, float, float, float],
+                segment_matrix: List[Tuple[float, float, float, float]],
+                columns: List[str] | None) -> str:
+    """Key of everything but the '.osm.pbf' file the cached basemap is made of"""
+    return _key([list(bounding_box), [list(segment) for segment in segment_matrix], columns])
+
+
+def _cache_prefix(filepath: str) -> str:
+    """Prefix of all cached basemaps created from the same '.osm.pbf' file, whole name
+    of the file without the extension"""
+    name = os.path.basename(filepath)
+    name = name[:-len(_PBF_SUFFIX)] if name.endswith(_PBF_SUFFIX) else os.path.splitext(name)[0]
+    return name + '_'
+
+
+def basemap_cache_files(filepath: str, cache_dir: str = DEFAULT_CACHE_DIR,
+                        inputs_key: str | None = None) -> List[str]:
+    """Paths of all cached basemaps created from the '.osm.pbf' file
+    Args:
+        filepath (str): Path to the '.osm.pbf' file from OpenstreetMap
+        cache_dir (str, optional): directory with cached basemaps
+        inputs_key (str | None, optional): only entries of these inputs, e.g. older versions
+        of the file with the same bounding box, segments and columns, all if empty
+    Returns:
+        List[str]: sorted paths of the entries"""
+    hex_key = '[0-9a-f]' * _KEY_LENGTH
+    pattern = f"{glob.escape(_cache_prefix(filepath))}{inputs_key or hex_key}_{hex_key}.parquet"
+    return sorted(glob.glob(os.path.join(glob.escape(cache_dir), pattern)))
+
+
+def prepare_basemap(basemap: gpd.GeoDataFrame,
+                    segment_matrix: List[Tuple[float, float, float, float]]) -> gpd.GeoDataFrame:
+    """Append precomputed bounds and segment IDs to basemap
+    Args:
+        basemap (gpd.GeoDataFrame): basemap dataframe from OSM
+        segment_matrix (List[Tuple[float, float, float, float]]): list of segments
+    Returns:
+        gpd.GeoDataFrame: copy of basemap with BOUNDS_COLUMNS and 'segment_id' columns"""
+    basemap = gpd.GeoDataFrame(basemap).reset_index(drop=True)
+    basemap[BOUNDS_COLUMNS] = basemap['geometry'].bounds.to_numpy()
+    return assign_segments_to_dataset(basemap, segment_matrix, 'id')
+
+
+# pylint: disable=too-many-arguments
+def load_cached_basemap(filepath: str,
+                        bounding_box: Tuple[float, float, float, float] | None = None,
+                        segment_matrix: List[Tuple[float, float, float, float]] | None = None,
+                        cache_dir: str = DEFAULT_CACHE_DIR,
+                        columns: List[str] | None = None) -> gpd.GeoDataFrame:
+    """Load basemap prepared for matching from cache, create and cache it if missing.
+    Entries created from older content of the same '.osm.pbf' file with the same bounding box,
+    segments and columns are removed when a new one is created.
+    Args:
+        filepath (str): Path to the '.osm.pbf' file from OpenstreetMap
+        bounding_box (Tuple[float, float, float, float] | None, optional): [minx, miny, maxx,
+        maxy] to trim the full dataset to required location. Defaults to DEFAULT_BBOX.
+        segment_matrix (List[Tuple[float, float, float, float]] | None, optional): segments
+        assigned to basemap, default grid of DEFAULT_NUM_SEGMENTS over bounding box if empty
+        cache_dir (str, optional): directory with cached basemaps
+        columns (List[str] | None, optional): columns kept from OSM, all if empty
+    Returns:
+        gpd.GeoDataFrame: basemap with BOUNDS_COLUMNS and 'segment_id' columns"""
+    bounding_box = bounding_box or DEFAULT_BBOX
+    segment_matrix = segment_matrix or generate_segments(bounding_box, DEFAULT_NUM_SEGMENTS)
+    cache_path = basemap_cache_path(filepath, bounding_box, segment_matrix, cache_dir, columns)
+    if os.path.exists(cache_path):
+        return gpd.read_parquet(cache_path)
+
+    basemap = prepare_basemap(load_osm_basemap(filepath, bounding_box, columns), segment_matrix)
+    # entries of the same inputs from older content of the file won't be used again
+    for stale_path in basemap_cache_files(
+            filepath, cache_dir, _inputs_key(bounding_box, segment_matrix, columns)):
+        os.remove(stale_path)
+    # write to temporary file first, interrupted run must not leave broken cache entry
+    parquet_compatible(basemap).to_parquet(cache_path + '.tmp')
+    os.replace(cache_path + '.tmp', cache_path)
+    return basemap
@@ -0,0 +1,155 @@
+"""
+Matching pipeline of all datasets to the OSM basemap, driven by a config file (pipeline.conf).
+Basemap is loaded and segmented once, all street networks are matched in a single walk over
+the segments and point systems are matched concurrently with them.
+"""
+import os
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from configparser import ConfigParser
+from typing import Tuple, List, Dict, Any, NamedTuple
+os.environ['USE_PYGEOS'] = '0'
+
+# pylint: disable=wrong-import-position
+import geopandas as gpd
+
+import instrumentation
+from geometry_utils import build_street_index, map_points_to_streets, StreetIndex
+from location_matching import load_foreign_network, match_store_to_networks, ids_at_positions
+from model_io import write_model
+from osm_basemap import load_cached_basemap, DEFAULT_BBOX, DEFAULT_NUM_SEGMENTS
+from segmentation_utils import generate_segments, generate_adaptive_segments, \
+    assign_segments_to_dataset, street_bounds
+from street_store import build_street_store
+
+
+DEFAULT_CONFIG_PATH = '../pipeline.conf'
+BASEMAP_SECTION = 'basemap'
+GEOMETRY_TYPES = ('line', 'point')
+
+
+class DatasetConfig(NamedTuple):
+    """One dataset matched to the basemap"""
+    name: str
+    filepath: str
+    id_column: str
+    target_column: str
+    geometry: str
+
+
+class PipelineConfig(NamedTuple):
+    """Basemap and all datasets matched to it"""
+    basemap_path: str
+    bounding_box: Tuple[float, float, float, float]
+    num_segments: int
+    output: str | None
+    geojson_export: str | None
+    datasets: List[DatasetConfig]
+    # quadtree segments with at most that many basemap streets instead of the regular grid
+    max_streets_per_segment: int | None = None
+
+
+def read_pipeline_config(config_path: str = DEFAULT_CONFIG_PATH) -> PipelineConfig:
+    """Read pipeline config, [basemap] section and a section for every dataset
+    Args:
+        config_path (str, optional): path to INI config file
+    Returns:
+        PipelineConfig: parsed config, datasets in order of sections"""
+    cparser = ConfigParser()
+    if not cparser.read(config_path):
+        raise FileNotFoundError(f'Pipeline config {config_path} not found')
+    basemap = cparser[BASEMAP_SECTION]
+    bounding_box = tuple(float(coord) for coord in basemap['bbox'].split(',')) \
+        if 'bbox' in basemap else DEFAULT_BBOX
+    datasets = []
+    for name in cparser.sections():
+        if name == BASEMAP_SECTION:
+            continue
+        section = cparser[name]
+        geometry = section.get('geometry', 'line')
+        if geometry not in GEOMETRY_TYPES:
+            raise ValueError(f'Dataset {name} has unknown geometry {geometry}, '
+                             f'expected one of {GEOMETRY_TYPES}')
+        datasets.append(DatasetConfig(name, section['filepath'], section['id_column'],
+                                      section.get('target_column', section['id_column']),
+                                      geometry))
+    return PipelineConfig(basemap['filepath'], bounding_box,
+                          basemap.getint('num_segments', DEFAULT_NUM_SEGMENTS),
+                          basemap.get('output'), basemap.get('geojson_export'), datasets,
+                          basemap.getint('max_streets_per_segment'))
+
+
+def _point_way_map(street_index: StreetIndex, dataset: DatasetConfig) -> Dict[Any, Any]:
+    """Read point dataset and map its points to nearest streets, runs in threads"""
+    points = load_foreign_network(dataset.filepath, dataset.id_column, dataset.target_column)
+    return map_points_to_streets(street_index, points[dataset.target_column], points['geometry'])
+
+
+def run_pipeline(config: PipelineConfig, workers: int = 1) -> gpd.GeoDataFrame:
+    """Match all datasets of config to the basemap
+    Args:
+        config (PipelineConfig): basemap and datasets to match
+        workers (int, optional): number of processes matching the segments in parallel
+    Returns:
+        gpd.GeoDataFrame: basemap streets of all segments with column for every dataset"""
+    with instrumentation.stage('load'):
+        segments = generate_segments(config.bounding_box, config.num_segments)
+        model = load_cached_basemap(config.basemap_path, config.bounding_box, segments)
+        if config.max_streets_per_segment:
+            # dense parts of the city are split into smaller segments than the grid
+            segments = generate_adaptive_segments(config.bounding_box, street_bounds(model),
+                                                  config.max_streets_per_segment)
+            model = assign_segments_to_dataset(model, segments, 'id')
+    point_datasets = [dataset for dataset in config.datasets if dataset.geometry == 'point']
+    line_datasets = [dataset for dataset in config.datasets if dataset.geometry == 'line']
+
+    with ThreadPoolExecutor(max_workers=max(len(config.datasets), 1)) as executor:
+        # point systems only need the street index, they run while streets are matched
+        street_index = build_street_index(model) if point_datasets else None
+        point_maps = [executor.submit(_point_way_map, street_index, dataset)
+                      for dataset in point_datasets]
+        with instrumentation.stage('load_datasets'):
+            networks = list(executor.map(lambda dataset: load_foreign_network(
+                dataset.filepath, dataset.id_column, dataset.target_column), line_datasets))
+        with instrumentation.stage('segment'):
+            basemap_store = build_street_store(model, 'id')
+            stores = [build_street_store(network, dataset.target_column, segments)
+                      for network, dataset in zip(networks, line_datasets)]
+
+        with instrumentation.stage('match'):
+            basemap_rows, matched_rows = match_store_to_networks(
+                basemap_store, stores, range(len(segments)), segments, workers)
+            for dataset, point_map in zip(point_datasets, point_maps):
+                model[dataset.target_column] = model['id'].map(point_map.result())
+
+    # join results back to the basemap, street ids by position, NaN for no match, streets
+    # outside of all segments are dropped also when there are only point datasets
+    with instrumentation.stage('join'):
+        final_model = model.iloc[basemap_rows].copy()
+        for dataset, store, rows in zip(line_datasets, stores, matched_rows):
+            final_model[dataset.target_column] = ids_at_positions(store.ids, rows)
+    return final_model
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Match all datasets of config to the OSM basemap')
+    parser.add_argument('config', nargs='?', default=DEFAULT_CONFIG_PATH)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--trace', metavar='REPORT',
+                        help='save JSON report of stage times, memory and matching counters')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='trace peak Python allocations of every stage, slower')
+    args = parser.parse_args()
+
+    if args.trace:
+        instrumentation.enable(args.trace_memory)
+    pipeline_config = read_pipeline_config(args.config)
+    model = run_pipeline(pipeline_config, args.workers)
+    print(model.head())
+    with instrumentation.stage('write'):
+        if pipeline_config.output:
+            write_model(model, pipeline_config.output)
+        if pipeline_config.geojson_export:
+            write_model(model, pipeline_config.geojson_export)
+    if args.trace:
+        instrumentation.disable().write_report(args.trace)
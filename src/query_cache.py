@@ -0,0 +1,89 @@
+"""
+Local cache of query results, in-memory LRU in front of a pickle store on disk. Entries of both
+levels expire after the same time to live, disk entries survive restarts of the application.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Tuple
+
+import pandas as pd
+
+
+# found next to the sources, not relative to the working directory
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'datasets',
+                                 'cache', 'queries')
+DEFAULT_TTL = 24 * 3600
+DEFAULT_MAX_ENTRIES = 4096
+
+
+class QueryCache:
+    """Cache of query results keyed by tuple of strings, e.g. (layer url, fields, where)"""
+
+    def __init__(self, cache_dir: str | None = DEFAULT_CACHE_DIR, ttl: float = DEFAULT_TTL,
+                 max_entries: int = DEFAULT_MAX_ENTRIES):
+        """
+        Args:
+            cache_dir (str | None, optional): directory of the disk store, memory only if None
+            ttl (float, optional): seconds after which entries are queried again
+            max_entries (int, optional): entries kept in memory, least recently used are
+            dropped first"""
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, Tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key_digest(key: Tuple[str, ...]) -> str:
+        """Stable digest of the key, name of the disk entry"""
+        return hashlib.sha256(json.dumps(key).encode('utf-8')).hexdigest()
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.cache_dir, f'{digest}.pkl')
+
+    def get(self, key: Tuple[str, ...]) -> Any | None:
+        """Cached value of the key, None if missing or expired"""
+        digest = self.key_digest(key)
+        now = time.time()
+        with self._lock:
+            if digest in self._entries:
+                created, value = self._entries[digest]
+                if now - created < self.ttl:
+                    self._entries.move_to_end(digest)
+                    return value
+                del self._entries[digest]
+        if self.cache_dir is None or not os.path.exists(self._path(digest)):
+            return None
+        created = os.path.getmtime(self._path(digest))
+        if now - created >= self.ttl:
+            # expired entries are not read again, they would only pile up on disk
+            try:
+                os.remove(self._path(digest))
+            except FileNotFoundError:  # removed by concurrent reader
+                pass
+            return None
+        value = pd.read_pickle(self._path(digest))
+        self._remember(digest, created, value)
+        return value
+
+    def put(self, key: Tuple[str, ...], value: Any):
+        """Store value in memory and on disk"""
+        digest = self.key_digest(key)
+        self._remember(digest, time.time(), value)
+        if self.cache_dir is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # unique temporary file, concurrent writers of the same key don't collide
+            tmp_path = f'{self._path(digest)}.{threading.get_ident()}.tmp'
+            pd.to_pickle(value, tmp_path)
+            os.replace(tmp_path, self._path(digest))
+
+    def _remember(self, digest: str, created: float, value: Any):
+        with self._lock:
+            self._entries[digest] = (created, value)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
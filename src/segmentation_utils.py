@@ -1,16 +1,40 @@
 """Utils responsible for segmenting window of a basemap to speed up processing and comparing"""
 import os
-from typing import Tuple, List
+import warnings
+from typing import Tuple, List, Dict
 from itertools import pairwise
+from math import isqrt
 os.environ['USE_PYGEOS'] = '0'
 
-import geopandas as gpd  # pylint: disable=wrong-import-position
+# pylint: disable=wrong-import-position
+import geopandas as gpd
+import numpy as np
 
 
 MIN_X = 0
 MIN_Y = 1
 MAX_X = 2
 MAX_Y = 3
+# segment ID of streets starting outside of all segments
+OUTSIDE_SEGMENT = -1
+# adaptive segmentation limits, segments are split until they hold at most that many streets
+DEFAULT_MAX_STREETS_PER_SEGMENT = 64
+DEFAULT_MAX_DEPTH = 10
+# cells of the lookup table of segments which don't form a regular grid, e.g. quadtree
+_MAX_LOOKUP_CELLS = 1 << 22
+# optional columns with precomputed bounds of geometries, e.g. in cached basemap
+BOUNDS_COLUMNS = ['minx', 'miny', 'maxx', 'maxy']
+
+
+def street_bounds(dataset: gpd.GeoDataFrame) -> np.ndarray:
+    """Bounds of all geometries, read from precomputed BOUNDS_COLUMNS when dataset has them
+    Args:
+        dataset (gpd.GeoDataFrame): any geodataframe with 'geometry' column
+    Returns:
+        np.ndarray: bounds of geometries, shape (n, 4)"""
+    if all(column in dataset.columns for column in BOUNDS_COLUMNS):
+        return dataset[BOUNDS_COLUMNS].to_numpy(dtype=float)
+    return dataset['geometry'].bounds.to_numpy()
 
 
 def generate_segments(bounding_box: Tuple[float, float, float, float],
@@ -43,6 +67,48 @@ def generate_segments(bounding_box: Tuple[float, float, float, float],
     return segment_matrix
 
 
+def generate_adaptive_segments(bounding_box: Tuple[float, float, float, float],
+                               street_bounds: np.ndarray,
+                               max_streets: int = DEFAULT_MAX_STREETS_PER_SEGMENT,
+                               max_depth: int = DEFAULT_MAX_DEPTH) \
+                               -> List[Tuple[float, float, float, float]]:
+    """Split window into quadtree of segments, dense parts are split into smaller segments.
+    Streets are counted by start of their bounds, same as in assign_segments_to_dataset().
+    Args:
+        bounding_box (Tuple[float, float, float, float]): [minx, miny, maxx, maxy] of basemap
+        street_bounds (np.ndarray): bounds of streets, shape (n, 4), can stack bounds of all
+        networks to be matched to cap candidates from every one of them
+        max_streets (int, optional): segment with more streets is split into 4 quarters
+        max_depth (int, optional): maximal number of splits, stops splitting identical streets
+    Returns:
+        List[Tuple[float, float, float, float]]: List of non-overlapping segments covering window,
+        usable wherever segments from generate_segments() are"""
+    street_bounds = np.reshape(np.asarray(street_bounds, dtype=float), (-1, 4))
+    x_coords, y_coords = street_bounds[:, MIN_X], street_bounds[:, MIN_Y]
+    segment_matrix = []
+    # stack of (segment, depth, positions of streets starting in it)
+    to_split = [(tuple(bounding_box), 0, np.flatnonzero(
+        (x_coords >= bounding_box[MIN_X]) & (x_coords <= bounding_box[MAX_X])
+        & (y_coords >= bounding_box[MIN_Y]) & (y_coords <= bounding_box[MAX_Y])))]
+    while to_split:
+        segment, depth, streets = to_split.pop()
+        if len(streets) <= max_streets or depth >= max_depth:
+            segment_matrix.append(segment)
+            continue
+        mid_x = (segment[MIN_X] + segment[MAX_X]) / 2
+        mid_y = (segment[MIN_Y] + segment[MAX_Y]) / 2
+        # upper halves take the middle line, segments include their lower edges
+        right, top = x_coords[streets] >= mid_x, y_coords[streets] >= mid_y
+        # pushed in reverse so quarters come out bottom-left, bottom-right, top-left, top-right
+        to_split.extend([
+            ((mid_x, mid_y, segment[MAX_X], segment[MAX_Y]), depth + 1, streets[right & top]),
+            ((segment[MIN_X], mid_y, mid_x, segment[MAX_Y]), depth + 1, streets[~right & top]),
+            ((mid_x, segment[MIN_Y], segment[MAX_X], mid_y), depth + 1, streets[right & ~top]),
+            ((segment[MIN_X], segment[MIN_Y], mid_x, mid_y), depth + 1, streets[~right & ~top]),
+        ])
+    return segment_matrix
+
+
 def is_in_segment(street_bounds: Tuple[float, float, float, float],
                   segment_bounds: Tuple[float, float, float, float]) -> bool:
     """Checks if start of street lays in segment
@@ -57,28 +123,249 @@ def is_in_segment(street_bounds: Tuple[float, float, float, float],
            (street_bounds[MIN_Y] < segment_bounds[MAX_Y])
 
 
+def _regular_grid_edges(segment_matrix: List[Tuple[float, float, float, float]]) \
+        -> Tuple[np.ndarray, np.ndarray] | None:
+    """Detect segment matrix created by generate_segments() and return its grid lines
+    Args:
+        segment_matrix (List[Tuple[float, float, float, float]]): list of segments
+    Returns:
+        Tuple[np.ndarray, np.ndarray] | None: X and Y edges of the grid, None if not regular"""
+    num_of_segments = isqrt(len(segment_matrix))
+    if num_of_segments == 0 or num_of_segments ** 2 != len(segment_matrix):
+        return None
+    x_edges = [segment[MIN_X] for segment in segment_matrix[:num_of_segments]] \
+        + [segment_matrix[num_of_segments - 1][MAX_X]]
+    y_edges = [segment[MIN_Y] for segment in segment_matrix[::num_of_segments]] \
+        + [segment_matrix[-1][MAX_Y]]
+    for index, segment in enumerate(segment_matrix):
+        row, column = divmod(index, num_of_segments)
+        if tuple(segment) != (x_edges[column], y_edges[row],
+                              x_edges[column + 1], y_edges[row + 1]):
+            return None
+    return np.array(x_edges), np.array(y_edges)
+
+
+def _grid_cells(coordinates: np.ndarray, edges: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Compute cell of every coordinate on one axis of regular grid by floor division.
+    Cells include their lower edge, the last cell includes also the upper edge of the grid.
+    Args:
+        coordinates (np.ndarray): coordinates on the axis
+        edges (np.ndarray): sorted grid lines on the axis
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: cell indices and mask of coordinates inside the grid"""
+    num_of_cells = len(edges) - 1
+    inside = (coordinates >= edges[0]) & (coordinates <= edges[-1])
+    with np.errstate(invalid='ignore'):
+        cells = np.floor((coordinates - edges[0]) / ((edges[-1] - edges[0]) / num_of_cells))
+    cells = np.clip(np.nan_to_num(cells), 0, num_of_cells - 1).astype(int)
+    # division may be off by one next to the edge, compare with the edges themselves
+    cells -= (coordinates < edges[cells]) & (cells > 0)
+    cells += (coordinates >= edges[cells + 1]) & (cells < num_of_cells - 1)
+    return cells, inside
+
+
+def segments_of_points(x_coords: np.ndarray, y_coords: np.ndarray,
+                       segment_matrix: List[Tuple[float, float, float, float]]) -> np.ndarray:
+    """Find segment of every point, first containing segment wins
+    Args:
+        x_coords (np.ndarray): X coordinates of points
+        y_coords (np.ndarray): Y coordinates of points
+        segment_matrix (List[Tuple[float, float, float, float]]): list of segments
+    Returns:
+        np.ndarray: segment IDs of points, OUTSIDE_SEGMENT if not in any segment"""
+    x_coords, y_coords = np.asarray(x_coords, dtype=float), np.asarray(y_coords, dtype=float)
+    grid_edges = _regular_grid_edges(segment_matrix)
+    if grid_edges:  # regular grid, cell computed directly from coordinates
+        columns, inside_x = _grid_cells(x_coords, grid_edges[0])
+        rows, inside_y = _grid_cells(y_coords, grid_edges[1])
+        return np.where(inside_x & inside_y, rows * (len(grid_edges[0]) - 1) + columns,
+                        OUTSIDE_SEGMENT)
+
+    segments = np.array(segment_matrix, dtype=float).reshape(-1, 4)
+    lookup = _segment_lookup(segments)
+    if lookup is not None:  # e.g. quadtree, cell of the lookup table found by bisection
+        x_edges, y_edges, table = lookup
+        columns, rows = _lookup_cells(x_coords, x_edges), _lookup_cells(y_coords, y_edges)
+        return np.where((columns >= 0) & (rows >= 0),
+                        table[np.maximum(rows, 0), np.maximum(columns, 0)], OUTSIDE_SEGMENT)
+    return _first_containing_segments(x_coords, y_coords, segments)
+
+
+def _first_containing_segments(x_coords: np.ndarray, y_coords: np.ndarray,
+                               segments: np.ndarray) -> np.ndarray:
+    """Segments of points by one vectorized pass per segment, works for any segments"""
+    segment_ids = np.full(len(x_coords), OUTSIDE_SEGMENT)
+    max_x = segments[:, MAX_X].max(initial=-np.inf)
+    max_y = segments[:, MAX_Y].max(initial=-np.inf)
+    for index, segment in enumerate(segments):
+        in_segment = (segment_ids == OUTSIDE_SEGMENT) \
+            & (x_coords >= segment[MIN_X]) & (y_coords >= segment[MIN_Y]) \
+            & ((x_coords < segment[MAX_X]) | ((x_coords == max_x) & (segment[MAX_X] == max_x))) \
+            & ((y_coords < segment[MAX_Y]) | ((y_coords == max_y) & (segment[MAX_Y] == max_y)))
+        segment_ids[in_segment] = index
+    return segment_ids
+
+
+def _segment_lookup(segments: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray] | None:
+    """Split area of segments by all their edges into cells, so every cell lies whole in each
+    segment touching it, and find the first segment containing every cell
+    Args:
+        segments (np.ndarray): segments (s, 4) with positive width and height
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray] | None: X and Y edges of cells and table
+        of segment IDs of cells (rows by Y), None if segments are empty, degenerate
+        or split the area into more than _MAX_LOOKUP_CELLS cells"""
+    if len(segments) == 0 or not np.all((segments[:, MAX_X] > segments[:, MIN_X])
+                                        & (segments[:, MAX_Y] > segments[:, MIN_Y])):
+        return None
+    x_edges = np.unique(segments[:, [MIN_X, MAX_X]])
+    y_edges = np.unique(segments[:, [MIN_Y, MAX_Y]])
+    if (len(x_edges) - 1) * (len(y_edges) - 1) > _MAX_LOOKUP_CELLS:
+        return None
+    columns = np.searchsorted(x_edges, segments[:, [MIN_X, MAX_X]])
+    rows = np.searchsorted(y_edges, segments[:, [MIN_Y, MAX_Y]])
+    table = np.full((len(y_edges) - 1, len(x_edges) - 1), OUTSIDE_SEGMENT)
+    # filled backwards, the first segment containing a cell wins
+    for index in range(len(segments) - 1, -1, -1):
+        table[rows[index, 0]:rows[index, 1], columns[index, 0]:columns[index, 1]] = index
+    return x_edges, y_edges, table
+
+
+def _lookup_cells(coordinates: np.ndarray, edges: np.ndarray) -> np.ndarray:
+    """Cell of every coordinate on one axis of the lookup table, -1 outside of the edges.
+    Cells include their lower edge, the last cell includes also the upper edge."""
+    cells = np.searchsorted(edges, coordinates, side='right') - 1
+    cells[coordinates == edges[-1]] = len(edges) - 2
+    cells[cells >= len(edges) - 1] = -1
+    return cells
+
+
 def assign_segments_to_dataset(dataset: gpd.GeoDataFrame,
                                segment_matrix: List[Tuple[float, float, float, float]],
                                id_column: str) -> gpd.GeoDataFrame:
     """Append column with assigned segment IDs. Dataset must have 'geometry' column.
+    Street belongs to the segment containing the start of its bounds, segments include their
+    lower edges. Streets outside of all segments get OUTSIDE_SEGMENT and a warning is issued.
     Args:
-        dataset (gpd.GeoDataFrame): any geodataframe with 'geometry' column
+        dataset (gpd.GeoDataFrame): any geodataframe with 'geometry' column, 'segment_id'
+        column is set in place
         segment_matrix (List[Tuple[float, float, float, float]]): list generated by generate fnc
         id_column (str): name of column with unique IDs of the dataset
     Returns:
-        gpd.GeoDataFrame: copy of dataset with segments column"""
-    segment_ids = []
-    street_ids = []
-    for _, row in dataset.iterrows():
-        street_bounds = row['geometry'].bounds
-        # check every segment
-        for index, segment in enumerate(segment_matrix):
-            # save found segment and street ID
-            if is_in_segment(street_bounds, segment):
-                segment_ids.append(index)
-                street_ids.append(row[id_column])
-                break
-
-    # append dataset with matched segment IDs
-    street_to_segment_df = gpd.GeoDataFrame({id_column: street_ids, 'segment_id': segment_ids})
-    return gpd.GeoDataFrame(dataset.merge(street_to_segment_df, on=id_column))
+        gpd.GeoDataFrame: the same dataset with segments column"""
+    dataset['segment_id'] = assign_segments(street_bounds(dataset), segment_matrix,
+                                            dataset[id_column].to_numpy(), id_column)
+    return dataset
+
+
+def assign_segments(bounds: np.ndarray,
+                    segment_matrix: List[Tuple[float, float, float, float]],
+                    street_ids: np.ndarray,
+                    id_column: str = 'id') -> np.ndarray:
+    """Segment IDs for streets given by bounds, see assign_segments_to_dataset()
+    Args:
+        bounds (np.ndarray): bounds of streets, shape (n, 4)
+        segment_matrix (List[Tuple[float, float, float, float]]): list of segments
+        street_ids (np.ndarray): IDs of streets, used in warning about streets outside
+        id_column (str, optional): name of the IDs in the warning, defaults to 'id'
+    Returns:
+        np.ndarray: segment ID of every street, OUTSIDE_SEGMENT if not in any segment"""
+    bounds = np.reshape(bounds, (-1, 4))
+    segment_ids = segments_of_points(bounds[:, MIN_X], bounds[:, MIN_Y], segment_matrix)
+    outside = segment_ids == OUTSIDE_SEGMENT
+    if outside.any():
+        warnings.warn(f"{outside.sum()} streets start outside of segments and won't be matched, "
+                      f"e.g. {id_column} {list(street_ids[outside][:5])}")
+    return segment_ids
+
+
+def group_segments(segment_ids: np.ndarray) -> Dict[int, np.ndarray]:
+    """Group positions by segment ID in a single pass
+    Args:
+        segment_ids (np.ndarray): segment ID of every street
+    Returns:
+        Dict[int, np.ndarray]: segment ID to positions of its streets in ascending order"""
+    segment_ids = np.asarray(segment_ids)
+    order = np.argsort(segment_ids, kind='stable')
+    unique_ids, starts = np.unique(segment_ids[order], return_index=True)
+    return dict(zip(unique_ids.tolist(), np.split(order, starts[1:])))
+
+
+def segment_groups(dataset: gpd.GeoDataFrame) -> Dict[int, np.ndarray]:
+    """Group rows of dataset by assigned segment in a single pass
+    Args:
+        dataset (gpd.GeoDataFrame): dataset with 'segment_id' column
+    Returns:
+        Dict[int, np.ndarray]: segment ID to positional indices of its rows in dataset order"""
+    return group_segments(dataset['segment_id'].to_numpy())
+
+
+def segment_candidates(bounds: np.ndarray,
+                       segment_matrix: List[Tuple[float, float, float, float]],
+                       halo: float = 0.0) -> Dict[int, np.ndarray]:
+    """Group rows by every segment their bounding box reaches, each segment extended by halo.
+    Unlike assign_segments_to_dataset(), street crossing segment boundary is a candidate in all
+    segments it touches, so lines from neighbouring segments can still be compared.
+    Segments are closed, street touching segment edge is its candidate too.
+    Halo equal to the segment size makes whole neighbouring segments candidates.
+    Args:
+        bounds (np.ndarray): bounds of streets, shape (n, 4)
+        segment_matrix (List[Tuple[float, float, float, float]]): list of segments
+        halo (float, optional): distance extending every segment in CRS units, defaults to 0
+    Returns:
+        Dict[int, np.ndarray]: segment ID to positional indices of candidate rows in order"""
+    bounds = np.reshape(np.asarray(bounds, dtype=float), (-1, 4))
+    # streets are extended by halo instead of segments, both paths compare with the same edges
+    reach = np.column_stack([bounds[:, MIN_X] - halo, bounds[:, MIN_Y] - halo,
+                             bounds[:, MAX_X] + halo, bounds[:, MAX_Y] + halo])
+    grid_edges = _regular_grid_edges(segment_matrix)
+    if not grid_edges:
+        return _matrix_candidates(reach, segment_matrix)
+    return _grid_candidates(reach, *grid_edges)
+
+
+def _matrix_candidates(reach: np.ndarray,
+                       segment_matrix: List[Tuple[float, float, float, float]]) \
+        -> Dict[int, np.ndarray]:
+    """Candidates of any segments, one vectorized pass per segment, see segment_candidates()"""
+    candidates = {}
+    for index, segment in enumerate(segment_matrix):
+        rows = np.flatnonzero((reach[:, MAX_X] >= segment[MIN_X])
+                              & (reach[:, MIN_X] <= segment[MAX_X])
+                              & (reach[:, MAX_Y] >= segment[MIN_Y])
+                              & (reach[:, MIN_Y] <= segment[MAX_Y]))
+        if len(rows) > 0:
+            candidates[index] = rows
+    return candidates
+
+
+def _first_touched_cells(coordinates: np.ndarray, edges: np.ndarray) -> np.ndarray:
+    """Lowest cell reached by coordinate on one axis of regular grid, coordinate lying on
+    a grid line touches also the cell below it"""
+    cells, _ = _grid_cells(coordinates, edges)
+    return cells - ((coordinates == edges[cells]) & (cells > 0))
+
+
+def _grid_candidates(reach: np.ndarray, x_edges: np.ndarray,
+                     y_edges: np.ndarray) -> Dict[int, np.ndarray]:
+    """Candidates of regular grid, range of reached cells on both axes computed directly,
+    see segment_candidates()"""
+    first_columns = _first_touched_cells(reach[:, MIN_X], x_edges)
+    last_columns, _ = _grid_cells(reach[:, MAX_X], x_edges)
+    first_rows = _first_touched_cells(reach[:, MIN_Y], y_edges)
+    last_rows, _ = _grid_cells(reach[:, MAX_Y], y_edges)
+    reaches_grid = (reach[:, MAX_X] >= x_edges[0]) & (reach[:, MIN_X] <= x_edges[-1]) \
+        & (reach[:, MAX_Y] >= y_edges[0]) & (reach[:, MIN_Y] <= y_edges[-1])
+    num_of_columns = len(x_edges) - 1
+    span_columns = last_columns - first_columns + 1
+    cells_count = np.where(reaches_grid, span_columns * (last_rows - first_rows + 1), 0)
+    # expand every street to all of its cells
+    street_rows = np.repeat(np.arange(len(reach)), cells_count)
+    cell_offsets = np.arange(len(street_rows)) \
+        - np.repeat(np.cumsum(cells_count) - cells_count, cells_count)
+    row_offsets, column_offsets = np.divmod(cell_offsets, span_columns[street_rows])
+    cells = (first_rows[street_rows] + row_offsets) * num_of_columns \
+        + first_columns[street_rows] + column_offsets
+    # stable grouping keeps dataset order inside every segment
+    return {segment_id: street_rows[positions]
+            for segment_id, positions in group_segments(cells).items()}
@@ -0,0 +1,105 @@
+"""
+HTML reports of Strava data for single streets and batches of streets. Data of all streets of
+a batch are queried and summed in one pass, plots are rendered in a pool of processes
+and every street gets its own plot and report file.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from math import ceil
+from typing import Dict, Iterable, List, Tuple
+
+import pandas as pd
+
+from model_io import read_model, MODEL_PATH
+from strava_store import load_strava_store, street_counts, ID_COLUMN, COUNT_COLUMNS
+
+
+REPORTS_DIR = '../reports'
+MATCHED_ID_COLUMNS = ['counters_id', 'biketowork_id', 'city_census_id']
+
+
+def street_sums(strava_df: pd.DataFrame) -> pd.DataFrame:
+    """Total counts of every street in strava_df"""
+    return strava_df.groupby([ID_COLUMN])[COUNT_COLUMNS].sum().reset_index()
+
+
+def render_report(strava_df: pd.DataFrame, sums: pd.DataFrame, plot_path: str,
+                  report_path: str):
+    """Render plot of daily rides and html report with the daily data and sums
+    Args:
+        strava_df (pd.DataFrame): daily data of the street from get_strava_data()
+        sums (pd.DataFrame): total counts of the street
+        plot_path (str): path of the png plot
+        report_path (str): path of the html report, plot is linked relative to it"""
+    # plotting libraries are slow to import, modules using only the queries don't need them
+    # pylint: disable=import-outside-toplevel
+    import matplotlib.dates as mdates
+    from matplotlib.figure import Figure
+    from seaborn import lineplot
+    # figure without pyplot keeps no global state, renders in any thread or process
+    fig = Figure(figsize=(10, 8))
+    axis = fig.gca()
+    lineplot(x=strava_df['date'], y=strava_df['ride_count'], ax=axis)
+    if axis.lines:
+        x_axis = axis.lines[0].get_xydata()[:, 0]
+        y_axis = axis.lines[0].get_xydata()[:, 1]
+        axis.fill_between(x_axis, y_axis, color="blue", alpha=0.6)
+    axis.xaxis.set_major_formatter(mdates.DateFormatter('%b-%d'))
+    fig.savefig(plot_path)
+    plot_src = os.path.relpath(plot_path, os.path.dirname(os.path.abspath(report_path)))
+    with open(report_path, 'w', encoding='utf-8') as file:
+        file.write(strava_df.to_html() +
+                   f'<img src="{plot_src}" alt="text">' +
+                   sums.to_html())
+
+
+def _render_batch(batch: List[Tuple[pd.DataFrame, pd.DataFrame, str, str]]):
+    """Render reports of streets in batch, runs in worker processes"""
+    for strava_df, sums, plot_path, report_path in batch:
+        render_report(strava_df, sums, plot_path, report_path)
+
+
+def matched_street_ids(model_path: str = MODEL_PATH) -> List[int]:
+    """OSM IDs of model streets matched to any of the datasets"""
+    model = read_model(model_path, columns=['id'] + MATCHED_ID_COLUMNS)
+    matched = model[MATCHED_ID_COLUMNS].notna().any(axis=1)
+    return model.loc[matched, 'id'].drop_duplicates().astype(int).to_list()
+
+
+# pylint: disable=too-many-arguments
+def generate_strava_reports(osm_ids: Iterable[int] | None, date_start: str, date_end: str,
+                            csv_path: str, output_dir: str = REPORTS_DIR,
+                            workers: int = 1) -> Dict[int, str]:
+    """Generate report of every street, see render_report(), streets without Strava data
+    in the time frame are skipped
+    Args:
+        osm_ids (Iterable[int] | None): OSM IDs of streets, all matched streets of the model
+        if None
+        date_start (str): first day in format 'YYYY-MM-DD'
+        date_end (str): day after the last day in format 'YYYY-MM-DD'
+        csv_path (str): daily Strava export, see strava_store.py
+        output_dir (str, optional): directory of 'strava_<id>.png' and 'report_<id>.html' files
+        workers (int, optional): number of processes rendering the reports
+    Returns:
+        Dict[int, str]: path of report of every reported street"""
+    # repeated IDs would repeat rows of the street in its report and sums
+    osm_ids = matched_street_ids() if osm_ids is None else list(dict.fromkeys(osm_ids))
+    strava_df = street_counts(load_strava_store(csv_path), osm_ids, date_start, date_end)
+    sums = street_sums(strava_df)
+    os.makedirs(output_dir, exist_ok=True)
+
+    reports = {}
+    tasks = []
+    for (osm_id, street_df), (_, street_sum) in zip(strava_df.groupby(ID_COLUMN, sort=True),
+                                                    sums.groupby(ID_COLUMN, sort=True)):
+        reports[osm_id] = os.path.join(output_dir, f'report_{osm_id}.html')
+        tasks.append((street_df.reset_index(drop=True), street_sum.reset_index(drop=True),
+                      os.path.join(output_dir, f'strava_{osm_id}.png'), reports[osm_id]))
+    if workers <= 1 or len(tasks) < 2:
+        _render_batch(tasks)
+    else:
+        batch_size = ceil(len(tasks) / (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(_render_batch, [tasks[start:start + batch_size]
+                                              for start in range(0, len(tasks), batch_size)]))
+    return reports
@@ -0,0 +1,145 @@
+"""
+Indexed store of Strava daily counts. The exported CSV is ingested once into NumPy arrays sorted
+by OSM street ID and date, time series of one street is then found by binary search on
+memory-mapped arrays without reading the rest of the data.
+"""
+import json
+import os
+import threading
+from functools import lru_cache
+from typing import List, NamedTuple
+
+import numpy as np
+import pandas as pd
+
+
+ID_COLUMN = 'osm_reference_id'
+DATE_COLUMN = 'date'
+COUNT_COLUMNS = ['ride_count', 'forward_trip_count', 'reverse_trip_count']
+CHUNK_SIZE = 1_000_000
+STORE_VERSION = 1
+# first lookups of concurrent threads (e.g. asyncio.to_thread) ingest the CSV only once
+_INGEST_LOCK = threading.Lock()
+
+
+class StravaStore(NamedTuple):
+    """Daily counts of all streets, rows of street osm_ids[i] are
+    offsets[i]:offsets[i + 1] of dates and counts, ordered by date"""
+    osm_ids: np.ndarray
+    offsets: np.ndarray
+    dates: np.ndarray
+    counts: np.ndarray
+
+    def street_rows(self, osm_id: int) -> slice:
+        """Rows of street, empty slice for unknown street"""
+        position = np.searchsorted(self.osm_ids, osm_id)
+        if position == len(self.osm_ids) or self.osm_ids[position] != osm_id:
+            return slice(0, 0)
+        return slice(self.offsets[position], self.offsets[position + 1])
+
+
+def default_store_dir(csv_path: str) -> str:
+    """Store is kept next to the CSV, e.g. 'strava_daily_2022_may_aug_store'"""
+    return os.path.splitext(csv_path)[0] + '_store'
+
+
+def _source_stamp(csv_path: str) -> dict:
+    stat = os.stat(csv_path)
+    return {'version': STORE_VERSION, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def ingest_strava_csv(csv_path: str, store_dir: str | None = None) -> str:
+    """Convert Strava CSV to the indexed store, rows of the same street and day are averaged
+    Args:
+        csv_path (str): daily Strava export with osm_reference_id, date and count columns
+        store_dir (str | None, optional): directory of the store, next to CSV if empty
+    Returns:
+        str: directory of the store"""
+    store_dir = store_dir or default_store_dir(csv_path)
+    # CSV is read in chunks, only sums and numbers of rows per street and day are kept
+    sums = []
+    for chunk in pd.read_csv(csv_path, usecols=[ID_COLUMN, DATE_COLUMN] + COUNT_COLUMNS,
+                             chunksize=CHUNK_SIZE):
+        dates = pd.to_datetime(chunk[DATE_COLUMN])
+        # days are taken in the time zone of the export
+        chunk[DATE_COLUMN] = (dates.dt.tz_localize(None) if dates.dt.tz else dates).dt.floor('D')
+        grouped = chunk.groupby([ID_COLUMN, DATE_COLUMN])[COUNT_COLUMNS]
+        sums.append(grouped.sum().join(grouped.size().rename('rows')))
+    daily = pd.concat(sums).groupby(level=[0, 1]).sum().sort_index()
+
+    osm_ids = daily.index.get_level_values(0).to_numpy()
+    street_ids, street_starts = np.unique(osm_ids, return_index=True)
+    arrays = {'osm_ids': street_ids,
+              'offsets': np.append(street_starts, len(osm_ids)),
+              'dates': daily.index.get_level_values(1).to_numpy().astype('datetime64[D]'),
+              'counts': daily[COUNT_COLUMNS].to_numpy(dtype=float)
+                        / daily['rows'].to_numpy()[:, np.newaxis]}
+    os.makedirs(store_dir, exist_ok=True)
+    # unique temporary files, concurrent ingests of the same store don't collide
+    tmp_suffix = f'.{os.getpid()}.{threading.get_ident()}.tmp'
+    for name, array in arrays.items():
+        # replaced, not overwritten, arrays of the previous version may still be mapped
+        array_path = os.path.join(store_dir, f'{name}.npy')
+        np.save(array_path + tmp_suffix + '.npy', array)
+        os.replace(array_path + tmp_suffix + '.npy', array_path)
+    # stamp is written last, incomplete store is never considered valid
+    stamp_path = os.path.join(store_dir, 'source.json')
+    with open(stamp_path + tmp_suffix, 'w', encoding='utf-8') as file:
+        json.dump(_source_stamp(csv_path), file)
+    os.replace(stamp_path + tmp_suffix, stamp_path)
+    return store_dir
+
+
+def _store_is_current(csv_path: str, store_dir: str) -> bool:
+    stamp_path = os.path.join(store_dir, 'source.json')
+    if not os.path.exists(stamp_path):
+        return False
+    with open(stamp_path, encoding='utf-8') as file:
+        return json.load(file) == _source_stamp(csv_path)
+
+
+@lru_cache(maxsize=8)
+def _open_store(store_dir: str, _stamp: str) -> StravaStore:
+    """Memory-mapped arrays of the store, reopened only when the store changes"""
+    return StravaStore(*(np.load(os.path.join(store_dir, f'{name}.npy'), mmap_mode='r')
+                         for name in StravaStore._fields))
+
+
+def load_strava_store(csv_path: str, store_dir: str | None = None) -> StravaStore:
+    """Open store of the CSV, ingested first if missing or older than the CSV
+    Args:
+        csv_path (str): daily Strava export
+        store_dir (str | None, optional): directory of the store, next to CSV if empty
+    Returns:
+        StravaStore: memory-mapped store"""
+    store_dir = store_dir or default_store_dir(csv_path)
+    with _INGEST_LOCK:
+        if not _store_is_current(csv_path, store_dir):
+            ingest_strava_csv(csv_path, store_dir)
+    return _open_store(store_dir, json.dumps(_source_stamp(csv_path)))
+
+
+def street_counts(store: StravaStore, osm_ids: List[int], date_start: str,
+                  date_end: str) -> pd.DataFrame:
+    """Daily counts of streets in time interval [date_start, date_end)
+    Args:
+        store (StravaStore): store of Strava data
+        osm_ids (List[int]): OSM IDs of streets
+        date_start (str): first day in format 'YYYY-MM-DD'
+        date_end (str): day after the last day in format 'YYYY-MM-DD'
+    Returns:
+        pd.DataFrame: osm_reference_id, date and count columns ordered by street and date"""
+    start, end = np.datetime64(date_start, 'D'), np.datetime64(date_end, 'D')
+    frames = []
+    for osm_id in osm_ids:
+        rows = store.street_rows(osm_id)
+        dates = store.dates[rows]
+        # dates of the street are sorted, interval is found by binary search too
+        first, last = np.searchsorted(dates, start), np.searchsorted(dates, end)
+        frame = pd.DataFrame(np.asarray(store.counts[rows][first:last]), columns=COUNT_COLUMNS)
+        frame.insert(0, DATE_COLUMN, pd.to_datetime(np.asarray(dates[first:last])))
+        frame.insert(0, ID_COLUMN, osm_id)
+        frames.append(frame)
+    if not frames:
+        return pd.DataFrame(columns=[ID_COLUMN, DATE_COLUMN] + COUNT_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
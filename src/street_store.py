@@ -0,0 +1,61 @@
+"""
+Compact array representation of street networks for the matching hot paths. Store keeps
+only IDs, bounds, segments and flattened coordinates of a network in contiguous NumPy arrays,
+GeoDataFrame with all the tags is joined back by position only with the final results.
+"""
+import os
+from typing import Tuple, List, NamedTuple
+os.environ['USE_PYGEOS'] = '0'
+
+# pylint: disable=wrong-import-position
+import geopandas as gpd
+import numpy as np
+
+from geometry_utils import bounds_features, coordinate_overlap_features, flatten_coordinates, \
+    bounds_from_coordinates, BoundsFeatures, OverlapFeatures
+from segmentation_utils import assign_segments, BOUNDS_COLUMNS, OUTSIDE_SEGMENT
+
+
+class StreetStore(NamedTuple):
+    """Arrays describing all streets of one network, street is referenced by its position.
+    Coordinates of part p are coords[part_offsets[p]:part_offsets[p + 1]] and parts of street i
+    are part_offsets[line_offsets[i]:line_offsets[i + 1]], LineString has a single part.
+    Features of the bbox overlap matching and of the segment overlap matching (see
+    match_line_to_set()) are computed with the store, once per dataset load."""
+    ids: np.ndarray
+    bounds: np.ndarray
+    segment_ids: np.ndarray
+    coords: np.ndarray
+    part_offsets: np.ndarray
+    line_offsets: np.ndarray
+    features: BoundsFeatures
+    overlap: OverlapFeatures
+
+
+def build_street_store(dataset: gpd.GeoDataFrame,
+                       id_column: str,
+                       segment_matrix: List[Tuple[float, float, float, float]] | None = None) \
+                       -> StreetStore:
+    """Build compact store of the network, run once per dataset load
+    Args:
+        dataset (gpd.GeoDataFrame): any geodataframe with 'geometry' column
+        id_column (str): exact name of column with unique IDs of the dataset
+        segment_matrix (List[Tuple[float, float, float, float]] | None, optional): segments
+        assigned to streets, existing 'segment_id' column is used if empty
+    Returns:
+        StreetStore: arrays in order of dataset rows"""
+    coords, part_offsets, line_offsets = flatten_coordinates(list(dataset['geometry']))
+    if all(column in dataset.columns for column in BOUNDS_COLUMNS):
+        bounds = dataset[BOUNDS_COLUMNS].to_numpy(dtype=float)
+    else:
+        bounds = bounds_from_coordinates(coords, part_offsets, line_offsets)
+    ids = dataset[id_column].to_numpy()
+    if segment_matrix is not None:
+        segment_ids = assign_segments(bounds, segment_matrix, ids, id_column)
+    elif 'segment_id' in dataset.columns:
+        segment_ids = dataset['segment_id'].to_numpy()
+    else:
+        segment_ids = np.full(len(dataset), OUTSIDE_SEGMENT)
+    return StreetStore(ids, bounds, segment_ids, coords, part_offsets, line_offsets,
+                       bounds_features(bounds),
+                       coordinate_overlap_features(coords, part_offsets, line_offsets, bounds))
@@ -3,6 +3,9 @@ import pandas as pd
 
 from location_matching import match_street_network_to_osm, update_street_network, \
     match_points_to_osm, update_point_system
+from geometry_utils import build_street_index
+from incremental_update import update_street_network_incremental, commit_fingerprint
+from model_io import write_model
 from segmentation_utils import generate_segments, assign_segments_to_dataset
 
 
@@ -26,18 +29,35 @@ def update_census_example():
 def update_counters_example():
     """Step by step example of updating point-based COUNTERS dataset mapping"""
     model = pd.read_pickle("basemap.pkl")
+    street_index = build_street_index(model)  # shared by initial matching and the update
     model = match_points_to_osm(model,
                                 '../datasets/shortened_counters.geojson',
                                 'LocationId',
-                                'counters_id')
+                                'counters_id',
+                                street_index=street_index)
     print(model['counters_id'].unique())
 
     model = update_point_system(model,
                                 '../datasets/cyklodetektory.geojson',
                                 'LocationId',
-                                'counters_id')
+                                'counters_id',
+                                street_index=street_index)
     print(model['counters_id'].unique())
 
 
+def update_census_incremental_example():
+    """Example of incremental update, fingerprint is committed only after the model is saved"""
+    model = pd.read_pickle("basemap.pkl")
+    segment_matrix = generate_segments((16.4855, 49.1538, 16.7550, 49.2507), 32)
+    model = assign_segments_to_dataset(model, segment_matrix, 'id')
+    model['census_id'] = None
+
+    model, report = update_street_network_incremental(model, '../datasets/bkom_scitanie.geojson',
+                                                      'id', segment_matrix, 'census_id')
+    print(len(report.added), len(report.modified), len(report.removed), report.updated_rows)
+    write_model(model)
+    commit_fingerprint(report)
+
+
 if __name__ == '__main__':
     update_counters_example()
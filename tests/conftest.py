@@ -0,0 +1,153 @@
+"""
+Shared setup of the tests. Modules in src/ import each other as scripts, so the folder
+is put on the path the same way running them from src/ does.
+"""
+import calendar
+import json
+import os
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+os.environ['USE_PYGEOS'] = '0'
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+OBJECT_ID = 'OBJECTID'
+
+
+def _date_ms(date: str) -> int:
+    return calendar.timegm(time.strptime(date, '%Y-%m-%d')) * 1000
+
+
+def _condition(attributes: Dict[str, Any], condition: str) -> bool:
+    """Evaluate the few where conditions the sources send"""
+    if condition == '1=1':
+        return True
+    if match := re.fullmatch(r'(\w+) IN \((.*)\)', condition):
+        return attributes[match[1]] in [float(value) for value in match[2].split(',')]
+    if match := re.fullmatch(r"(\w+) ([<>]) DATE '([\d-]+)'", condition):
+        difference = attributes[match[1]] - _date_ms(match[3])
+        return difference > 0 if match[2] == '>' else difference < 0
+    if match := re.fullmatch(r'(\w+)=(.+)', condition):
+        return attributes[match[1]] == float(match[2])
+    raise ValueError(f'unsupported condition {condition}')
+
+
+class ArcgisStub:  # pylint: disable=too-many-instance-attributes
+    """FeatureServer layers served on a local port, requests are recorded"""
+
+    def __init__(self, layers: Dict[str, List[Dict[str, Any]]], max_record_count: int = 3):
+        """
+        Args:
+            layers (Dict[str, List[Dict[str, Any]]]): attributes of features of every layer,
+            'x' and 'y' attributes are the point geometry, 'datum' is a date in milliseconds
+            max_record_count (int, optional): most features returned by one query"""
+        self.layers = {name: [{OBJECT_ID: position + 1, **attributes}
+                              for position, attributes in enumerate(features)]
+                       for name, features in layers.items()}
+        self.max_record_count = max_record_count
+        self.delay = 0.0
+        self.failing_offsets = set()
+        self.queries: List[Dict[str, str]] = []
+        self.active = self.max_active = 0
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+
+    def url(self, layer: str) -> str:
+        """Url of FeatureLayer"""
+        return f'http://127.0.0.1:{self.server.server_port}/{layer}/FeatureServer/0'
+
+    def respond(self, path: str, query: Dict[str, str]) -> Dict[str, Any]:
+        """ArcGIS REST response of layer description or of query"""
+        name, *_, endpoint = path.strip('/').split('/')
+        features = self.layers[name]
+        if endpoint != 'query':
+            return {'maxRecordCount': self.max_record_count, 'objectIdField': OBJECT_ID}
+        selected = [attributes for attributes in features
+                    if all(_condition(attributes, condition.strip())
+                           for condition in query['where'].split(' AND '))]
+        if query.get('returnCountOnly') == 'true':
+            return {'count': len(selected)}
+        offset = int(query.get('resultOffset', 0))
+        if offset in self.failing_offsets:
+            return {'error': {'code': 500, 'message': f'page {offset} failed'}}
+        order_by = query.get('orderByFields', OBJECT_ID)
+        selected = sorted(selected, key=lambda attributes: attributes[order_by])
+        count = min(int(query.get('resultRecordCount', self.max_record_count)),
+                    self.max_record_count)
+        page, exceeded = selected[offset:offset + count], offset + count < len(selected)
+        fields = [name for name in features[0] if name not in ('x', 'y')] \
+            if query.get('outFields', '*') == '*' else query['outFields'].split(',')
+        if query['f'] == 'geojson':
+            return {'type': 'FeatureCollection', 'properties': {'exceededTransferLimit': exceeded},
+                    'features': [{'type': 'Feature',
+                                  'geometry': {'type': 'Point',
+                                               'coordinates': [feature['x'], feature['y']]},
+                                  'properties': {field: feature[field] for field in fields}}
+                                 for feature in page]}
+        return {'fields': [{'name': field, 'type': 'esriFieldTypeDate' if field == 'datum'
+                            else 'esriFieldTypeDouble'} for field in fields],
+                'features': [{'attributes': {field: feature[field] for field in fields}}
+                             for feature in page],
+                'exceededTransferLimit': exceeded}
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """Answers GET requests of the stub"""
+
+            def do_GET(self):  # pylint: disable=invalid-name
+                """Layer description or query"""
+                url = urlparse(self.path)
+                query = {key: values[0] for key, values in parse_qs(url.query).items()}
+                with stub._lock:  # pylint: disable=protected-access
+                    stub.queries.append(query)
+                    stub.active += 1
+                    stub.max_active = max(stub.max_active, stub.active)
+                try:
+                    time.sleep(stub.delay)
+                    content = json.dumps(stub.respond(url.path, query)).encode()
+                finally:
+                    with stub._lock:  # pylint: disable=protected-access
+                        stub.active -= 1
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, *args):  # pylint: disable=arguments-differ
+                """Keep test output clean"""
+        return Handler
+
+
+@pytest.fixture(name='arcgis_stub')
+def fixture_arcgis_stub():
+    """Stub of the Brno layers with few features, served while the test runs"""
+    day = 24 * 3600 * 1000
+    layers = {
+        'counters': [{'LocationId': location, 'datum': _date_ms('2022-05-01') + day * offset,
+                      'FirstDirection_Cyclists': offset, 'SecondDirection_Cyclists': location,
+                      'x': 16.6, 'y': 49.2}
+                     for location in (1, 2) for offset in range(7)],
+        'biketowork': [{'GID_ROAD': road, 'data_2019': road * 10, 'data_2020': road * 20,
+                        'data_2021': road * 30, 'dpnk_22': road * 40,
+                        'x': 16.5 + road / 100, 'y': 49.1}
+                       for road in range(1, 12)],
+        'census': [{'id': road, 'prac_2018': road, 'vik_2018': road, 'prac_2020': road,
+                    'vik_2020': road, 'prac_2022': road, 'vik_2022': road,
+                    'x': 16.7, 'y': 49.2 + road / 100}
+                   for road in range(1, 5)]}
+    stub = ArcgisStub(layers)
+    thread = threading.Thread(target=stub.server.serve_forever, daemon=True)
+    thread.start()
+    yield stub
+    stub.server.shutdown()
+    stub.server.server_close()
@@ -0,0 +1,69 @@
+"""Paged download of a layer from a local stand-in of the ArcGIS FeatureServer"""
+import json
+import os
+
+import geopandas as gpd
+import pytest
+import requests
+
+from arcgis_download import download_layer
+
+
+def _page_offsets(stub, since=0):
+    return sorted(int(query['resultOffset']) for query in stub.queries[since:]
+                  if 'resultOffset' in query)
+
+
+def test_download_all_pages(arcgis_stub, tmp_path):
+    """All features are downloaded in pages of maxRecordCount and joined in order"""
+    savepath = str(tmp_path / 'biketowork.geojson')
+    assert download_layer(arcgis_stub.url('biketowork'), savepath, workers=3) == 11
+    assert _page_offsets(arcgis_stub) == [0, 3, 6, 9]
+    assert {query['resultRecordCount'] for query in arcgis_stub.queries
+            if 'resultOffset' in query} == {'3'}
+    layer = gpd.read_file(savepath)
+    assert layer['OBJECTID'].tolist() == list(range(1, 12))
+    assert layer['data_2019'].tolist() == [road * 10 for road in range(1, 12)]
+    assert layer.geometry.x.tolist() == pytest.approx([16.5 + road / 100 for road in range(1, 12)])
+    assert not os.path.exists(savepath + '.parts')
+
+
+def test_download_where(arcgis_stub, tmp_path):
+    """Only features matching the where clause are downloaded"""
+    savepath = str(tmp_path / 'roads.geojson')
+    assert download_layer(arcgis_stub.url('biketowork'), savepath, 'GID_ROAD IN (2, 5, 9, 11)',
+                          'GID_ROAD,dpnk_22') == 4
+    with open(savepath, encoding='utf-8') as file:
+        features = json.load(file)['features']
+    assert [feature['properties'] for feature in features] == \
+        [{'GID_ROAD': road, 'dpnk_22': road * 40} for road in (2, 5, 9, 11)]
+
+
+def test_download_resumes_missing_pages(arcgis_stub, tmp_path):
+    """Failed download keeps finished pages, the next call fetches the missing page only"""
+    savepath = str(tmp_path / 'biketowork.geojson')
+    arcgis_stub.failing_offsets = {6}
+    with pytest.raises(requests.HTTPError):
+        download_layer(arcgis_stub.url('biketowork'), savepath)
+    assert sorted(os.listdir(savepath + '.parts')) == \
+        ['0000000000.json', '0000000003.json', '0000000009.json', 'checkpoint.json']
+    assert not os.path.exists(savepath)
+
+    arcgis_stub.failing_offsets = set()
+    queried = len(arcgis_stub.queries)
+    assert download_layer(arcgis_stub.url('biketowork'), savepath) == 11
+    assert _page_offsets(arcgis_stub, queried) == [6]
+    assert gpd.read_file(savepath)['OBJECTID'].tolist() == list(range(1, 12))
+
+
+def test_download_of_other_query_starts_over(arcgis_stub, tmp_path):
+    """Pages left by a different query are not mixed into the download"""
+    savepath = str(tmp_path / 'biketowork.geojson')
+    arcgis_stub.failing_offsets = {3}
+    with pytest.raises(requests.HTTPError):
+        download_layer(arcgis_stub.url('biketowork'), savepath, 'GID_ROAD IN (1, 2, 3, 4, 5)')
+
+    arcgis_stub.failing_offsets = set()
+    queried = len(arcgis_stub.queries)
+    assert download_layer(arcgis_stub.url('biketowork'), savepath) == 11
+    assert _page_offsets(arcgis_stub, queried) == [0, 3, 6, 9]
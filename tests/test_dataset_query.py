@@ -0,0 +1,115 @@
+"""Async street queries against a local stand-in of the ArcGIS layers"""
+import asyncio
+import threading
+
+import pandas as pd
+import pytest
+
+import dataset_query
+from arcgis_download import pooled_session, query_attributes
+from dataset_query import get_street_data, get_street_data_async, shared_session, \
+    _id_cache_key, BIKETOWORK_COLUMNS, CENSUS_COLUMNS
+from query_cache import QueryCache
+
+HOST_CONCURRENCY = 2
+
+
+@pytest.fixture(name='sources')
+def fixture_sources(arcgis_stub, monkeypatch):
+    """Queries go to the stub, with empty memory-only cache and fresh shared limits"""
+    monkeypatch.setattr(dataset_query, 'data_urls',
+                        lambda: {name: arcgis_stub.url(name) for name in arcgis_stub.layers})
+    monkeypatch.setattr(dataset_query, 'query_cache', QueryCache(None))
+    monkeypatch.setattr(dataset_query, 'HOST_CONCURRENCY', HOST_CONCURRENCY)
+    monkeypatch.setattr(dataset_query, '_HOST_LIMITS', {})
+    shared_session.cache_clear()
+    yield arcgis_stub
+    shared_session().close()
+    shared_session.cache_clear()
+
+
+def _expected(street):
+    """Frames of street computed from the stub data, as the layers should return them"""
+    road, census_id = street
+    return (pd.DataFrame({'SecondDirection_Cyclists': [1.0, 1.0],
+                          'FirstDirection_Cyclists': [2.0, 3.0]}),
+            pd.DataFrame({column: [road * factor]
+                          for column, factor in zip(BIKETOWORK_COLUMNS, (10, 20, 30, 40))}),
+            pd.DataFrame({column: [census_id] for column in CENSUS_COLUMNS}))
+
+
+def _street_data(street):
+    return get_street_data(street[0], 1, street[0], street[1], '2022-05-02', '2022-05-05', None)
+
+
+def _assert_street(data, street):
+    for frame, expected in zip((data.counters, data.biketowork, data.census), _expected(street)):
+        pd.testing.assert_frame_equal(frame.reset_index(drop=True), expected, check_dtype=False)
+
+
+def test_query_attributes_pages_and_dates(sources):
+    """All pages are queried while the layer exceeds its transfer limit, dates are datetimes"""
+    with pooled_session() as session:
+        frame = query_attributes(session, sources.url('counters'), 'LocationId=2')
+    assert len(sources.queries) == 3
+    assert frame['OBJECTID'].tolist() == list(range(8, 15))
+    assert frame['datum'].tolist() == list(pd.date_range('2022-05-01', periods=7))
+
+
+def test_street_data(sources):
+    """Every source returns rows of the street, unmatched sources are None"""
+    _assert_street(_street_data((3, 2)), (3, 2))
+    data = get_street_data(3, None, 3, None, '2022-05-02', '2022-05-05', None)
+    assert data.counters is None and data.census is None and data.strava is None
+    assert data.biketowork['data_2019'].tolist() == [30]
+    assert set(sources.queries[-1]) >= {'resultOffset', 'resultRecordCount'}
+
+
+def test_calls_share_limits_session_and_cache(sources, monkeypatch):
+    """Concurrent calls in threads and in one event loop share the host slots, the session
+    and the cache"""
+    sessions = []
+    monkeypatch.setattr(dataset_query, 'pooled_session',
+                        lambda workers: sessions.append(pooled_session(workers)) or sessions[-1])
+    sources.delay = 0.05
+    streets = [(road, road % 4 + 1) for road in range(1, 9)]
+    threads = [threading.Thread(target=_street_data, args=(street,)) for street in streets[:4]]
+    for thread in threads:
+        thread.start()
+
+    async def in_one_loop():
+        return await asyncio.gather(*[get_street_data_async(
+            street[0], 1, street[0], street[1], '2022-05-02', '2022-05-05', None)
+            for street in streets[4:]])
+    results = asyncio.run(in_one_loop())
+    for thread in threads:
+        thread.join()
+    assert sources.max_active == HOST_CONCURRENCY
+    assert len(sessions) == 1
+
+    queried = len(sources.queries)
+    for street, data in zip(streets, [_street_data(street) for street in streets[:4]] + results):
+        _assert_street(data, street)
+    assert len(sources.queries) == queried
+
+
+def test_frames_of_query_by_ids_are_not_served(sources):
+    """Async lookups don't read frames cached by the batch queries, those have geometry"""
+    url = sources.url('biketowork')
+    out_fields = ','.join(['GID_ROAD'] + BIKETOWORK_COLUMNS)
+    dataset_query.query_cache.put(_id_cache_key(url, out_fields, 'GID_ROAD', 5),
+                                  pd.DataFrame({'GID_ROAD': [5], 'SHAPE': [None],
+                                                **{column: [-1] for column in BIKETOWORK_COLUMNS}}))
+    data = get_street_data(5, None, 5, None, '2022-05-02', '2022-05-05', None)
+    assert data.biketowork['data_2019'].tolist() == [50]
+    assert list(data.biketowork.columns) == BIKETOWORK_COLUMNS
+    assert len(sources.queries) == 1
+
+
+def test_expired_disk_entries_are_removed(tmp_path):
+    """Fresh disk entries survive restart, expired ones are missing and their file is removed"""
+    key = ('url', '*', 'GID_ROAD=5')
+    QueryCache(str(tmp_path)).put(key, pd.DataFrame({'GID_ROAD': [5]}))
+    assert QueryCache(str(tmp_path)).get(key)['GID_ROAD'].tolist() == [5]
+    assert QueryCache(str(tmp_path), ttl=0).get(key) is None
+    assert not list(tmp_path.iterdir())
@@ -0,0 +1,209 @@
+"""Vectorized matching kernels compared with the per-pair shapely loops they replaced"""
+import geopandas as gpd
+import numpy as np
+import pytest
+from shapely import geometry as shp
+
+from benchmarks import synthetic_basemap, synthetic_foreign_network
+from geometry_utils import match_lines_by_bbox_overlap, match_bounds_by_bbox_overlap, \
+    lines_overlap, match_line_to_set, ANGLE_OFFSET_LIMIT, ANGLE_STEP, NDIGITS
+from segmentation_utils import generate_segments, assign_segments_to_dataset, segment_groups
+from street_store import build_street_store
+
+
+def _reference_angle(line_1, line_2):
+    """angle_between() of the loop implementation"""
+    line_1, line_2 = line_1.bounds, line_2.bounds
+    vector1 = [(line_1[0] - line_1[2]), (line_1[1] - line_1[3])]
+    vector2 = [(line_2[0] - line_2[2]), (line_2[1] - line_2[3])]
+    with np.errstate(invalid='ignore'):
+        v1_unit = vector1 / np.linalg.norm(vector1)
+        v2_unit = vector2 / np.linalg.norm(vector2)
+    angle_radians = np.arccos(np.clip(np.dot(v1_unit, v2_unit), -1.0, 1.0))
+    return np.degrees(angle_radians) % 90
+
+
+def _reference_bbox_match(line, other_lines):
+    """Position of match of the loop implementation of match_lines_by_bbox_overlap()"""
+    max_accepted_angle = ANGLE_OFFSET_LIMIT
+    round_digits = NDIGITS
+    best_match = (0, 0, 0)
+    while best_match == (0, 0, 0):
+        max_accepted_angle = max_accepted_angle + ANGLE_STEP
+        if max_accepted_angle >= 45:
+            round_digits = round_digits - 1
+        for index, other_line in enumerate(other_lines):
+            angle = _reference_angle(line, other_line)
+            polygon = shp.box(*[round(coord, round_digits) for coord in line.bounds])
+            other_polygon = shp.box(*[round(coord, round_digits) for coord in other_line.bounds])
+            try:
+                bbox_overlap = polygon.intersection(other_polygon).area / \
+                    polygon.union(other_polygon).area
+            except ZeroDivisionError:
+                continue
+            if angle < max_accepted_angle and bbox_overlap > best_match[0]:
+                best_match = (bbox_overlap, angle, index)
+        if max_accepted_angle >= 45 and best_match == (0, 0, 0):
+            return None
+    return best_match[2]
+
+
+def _reference_part_overlap(line1, line2, round_digits):
+    """_lines_overlap() of the shapely implementation, first segments of rounded parts"""
+    line1 = shp.LineString([(round(x, round_digits), round(y, round_digits))
+                            for x, y in line1.coords[:2]])
+    line2 = shp.LineString([(round(x, round_digits), round(y, round_digits))
+                            for x, y in line2.coords[:2]])
+    return line1.overlaps(line2) or line2.overlaps(line1)
+
+
+def _parts(line):
+    return list(line.geoms) if isinstance(line, shp.MultiLineString) else [line]
+
+
+def _reference_lines_overlap(line1, line2, round_digits):
+    """lines_overlap() of the shapely implementation, any pair of parts overlaps"""
+    return any(_reference_part_overlap(part1, part2, round_digits)
+               for part1 in _parts(line1) for part2 in _parts(line2))
+
+
+def _reference_line_match(line, other_lines):
+    """Position of match of the loop implementation of match_line_to_set()"""
+    candidate_lines = {}
+    for round_digits in range(7, 2, -1):
+        for index, other_line in enumerate(other_lines):
+            angle = _reference_angle(line, other_line)
+            if _reference_lines_overlap(line, other_line, round_digits) \
+                    and angle < ANGLE_OFFSET_LIMIT:
+                candidate_lines[index] = angle
+    return min(candidate_lines, key=candidate_lines.get) if candidate_lines else None
+
+
+@pytest.fixture(name='segmented', scope='module')
+def fixture_segmented():
+    """Lines of basemap and foreign network grouped by segment"""
+    basemap = synthetic_basemap(300, seed=5)
+    foreign = synthetic_foreign_network(basemap, seed=6)
+    # segments cover both networks, every street has its segment
+    both = np.vstack([basemap.total_bounds, foreign.total_bounds])
+    segments = generate_segments((*both[:, :2].min(axis=0), *both[:, 2:].max(axis=0)), 5)
+    basemap = assign_segments_to_dataset(basemap, segments, 'id')
+    foreign = assign_segments_to_dataset(foreign, segments, 'GID')
+    foreign_groups = segment_groups(foreign)
+    return [(basemap.geometry.iloc[rows], foreign.geometry.iloc[foreign_groups[segment]])
+            for segment, rows in segment_groups(basemap).items() if segment in foreign_groups]
+
+
+def _edge_case_lines():
+    """Horizontal, vertical, identical, zero length and touching lines"""
+    return gpd.GeoSeries([
+        shp.LineString([(16.5, 49.2), (16.51, 49.2)]),
+        shp.LineString([(16.5, 49.2), (16.5, 49.21)]),
+        shp.LineString([(16.5, 49.2), (16.51, 49.21)]),
+        shp.LineString([(16.5, 49.2), (16.51, 49.21)]),
+        shp.LineString([(16.5, 49.2), (16.5, 49.2)]),
+        shp.LineString([(16.51, 49.21), (16.52, 49.215)]),
+        shp.MultiLineString([[(16.5, 49.2), (16.505, 49.2)], [(16.506, 49.2), (16.51, 49.2)]]),
+        shp.LineString([(16.5000004, 49.2), (16.5100004, 49.2000004)])])
+
+
+def test_bbox_match_equals_loop(segmented):
+    """Matches of every line equal the loop implementation"""
+    compared = found = 0
+    for lines, others in segmented:
+        for line in lines.iloc[:30]:
+            expected = _reference_bbox_match(line, others)
+            match = match_lines_by_bbox_overlap(line, others)
+            assert (match is None) == (expected is None)
+            if match is not None:
+                assert match is others.iloc[expected]
+            compared += 1
+            found += expected is not None
+    assert compared > 150 and found > compared // 2
+
+
+def test_batched_bbox_match_equals_loop(segmented):
+    """Matching all lines of segment at once equals matching them one by one"""
+    for lines, others in segmented:
+        matches = match_bounds_by_bbox_overlap(lines.bounds.to_numpy(), others.bounds.to_numpy())
+        expected = [_reference_bbox_match(line, others) for line in lines]
+        assert matches.tolist() == [-1 if position is None else position
+                                    for position in expected]
+
+
+def test_bbox_match_edge_cases_equal_loop():
+    """Degenerate boxes and angles are treated as the loop treats them"""
+    lines = _edge_case_lines()
+    for position, line in enumerate(lines):
+        others = lines.drop(index=position)
+        expected = _reference_bbox_match(line, others)
+        match = match_bounds_by_bbox_overlap(np.array(line.bounds), others.bounds.to_numpy())[0]
+        assert match == (-1 if expected is None else expected)
+
+
+def _collinear_pairs():
+    """Pairs of first segments on one line, overlapping, touching, contained, identical,
+    reversed and shifted below the rounding, horizontal, vertical and diagonal"""
+    start = np.array([16.5, 49.2])
+    pairs = []
+    for direction in ([0.003, 0], [0, 0.002], [0.003, 0.001]):
+        for begin1, end1, begin2, end2 in [(0, 1, 0.5, 1.5), (0, 1, 1, 2), (0, 2, 0.5, 1),
+                                           (0, 1, 0, 1), (0, 1, 1.5, 0.5), (1, 0, 0.2, 0.8),
+                                           (0, 1, 2, 3), (0, 1, -0.5, 0.5)]:
+            line1 = shp.LineString([start + begin1 * np.array(direction),
+                                    start + end1 * np.array(direction), (16.6, 49.3)])
+            line2 = np.array([start + begin2 * np.array(direction),
+                              start + end2 * np.array(direction)])
+            pairs += [(line1, shp.LineString(line2)),
+                      (line1, shp.LineString(line2 + 3e-6)),
+                      (line1, shp.LineString(line2 + [0, 2e-4]))]
+    return pairs
+
+
+def _axis_aligned_networks(size=120, seed=7):
+    """Horizontal and vertical streets and their copies shifted along the street, so the
+    rounded first segments overlap partially, with unrelated streets in between"""
+    rng = np.random.default_rng(seed)
+    starts = rng.uniform([16.5, 49.2], [16.6, 49.25], (size, 2))
+    steps = np.where(rng.random((size, 1)) < 0.5, [1, 0], [0, 1]) \
+        * rng.uniform(0.001, 0.003, (size, 1))
+    lines = [shp.LineString([start, start + step, start + 2 * step + [1e-4, 1e-4]])
+             for start, step in zip(starts, steps)]
+    shifted = [shp.LineString([start + 0.4 * step + rng.normal(0, 1e-7, 2),
+                               start + 1.4 * step])
+               for start, step in zip(starts, steps)]
+    others = gpd.GeoSeries(shifted + list(synthetic_basemap(size // 2, seed=seed).geometry))
+    return gpd.GeoSeries(lines), others.sample(frac=1, random_state=seed).reset_index(drop=True)
+
+
+def test_lines_overlap_equals_shapely(segmented):
+    """Overlap of lines and their parts equals the shapely predicate at every rounding"""
+    pairs = _collinear_pairs() + [(line, other) for lines, others in segmented[:4]
+                                  for line in lines.iloc[:10] for other in others.iloc[:10]]
+    multi = shp.MultiLineString([pairs[0][1], pairs[27][1]])
+    pairs += [(multi, line) for line, _ in pairs[:72]] + [(line, multi) for line, _ in pairs[:72]]
+    overlapping = 0
+    for line1, line2 in pairs:
+        for round_digits in range(7, 1, -1):
+            expected = _reference_lines_overlap(line1, line2, round_digits)
+            assert lines_overlap(line1, line2, round_digits) == expected
+            overlapping += expected
+    assert overlapping > 100
+
+
+def test_line_match_equals_loop(segmented):
+    """Overlap matching of lines equals the loop, also with features taken from the store"""
+    found = 0
+    for lines, others in segmented[:3] + [_axis_aligned_networks()]:
+        store = build_street_store(gpd.GeoDataFrame({'GID': np.arange(len(others)),
+                                                     'geometry': others.to_numpy()}), 'GID')
+        rows = np.arange(len(others))
+        for line in lines.iloc[:15]:
+            expected = _reference_line_match(line, others)
+            match = match_line_to_set(line, others)
+            assert (match is None) == (expected is None)
+            if match is not None:
+                assert match is others.iloc[expected]
+            assert match_line_to_set(line, others, store.overlap.take(rows)) is match
+            found += expected is not None
+    assert found > 10
@@ -0,0 +1,71 @@
+"""Incremental update compared with matching the new version of the dataset from scratch"""
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks import synthetic_basemap, synthetic_foreign_network, changed_version
+from incremental_update import update_street_network_incremental, commit_fingerprint, \
+    load_fingerprint
+from location_matching import match_street_network_to_osm
+from segmentation_utils import generate_segments, assign_segments_to_dataset
+
+NUM_SEGMENTS = 8
+
+
+@pytest.fixture(name='versions')
+def fixture_versions(tmp_path):
+    """Segmented basemap and paths of two versions of a foreign network"""
+    basemap = synthetic_basemap(600)
+    foreign = synthetic_foreign_network(basemap)
+    # jittered foreign streets may start slightly outside of the basemap
+    segments = generate_segments(tuple(basemap.total_bounds + [-0.01, -0.01, 0.01, 0.01]),
+                                 NUM_SEGMENTS)
+    model = assign_segments_to_dataset(basemap, segments, 'id')
+    paths = {'first': str(tmp_path / 'foreign.geojson'),
+             'second': str(tmp_path / 'foreign_v2.geojson')}
+    foreign.to_file(paths['first'], driver='GeoJSON')
+    changed_version(foreign, 'GID').to_file(paths['second'], driver='GeoJSON')
+    return model, segments, paths
+
+
+def _full_match(model, path, segments):
+    matched = match_street_network_to_osm(model, path, 'GID', segments, 'foreign_id')
+    return model.join(matched['foreign_id'])
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_incremental_equals_full_match(versions, tmp_path, workers):
+    """Updating matches of the first version equals matching the second version"""
+    model, segments, paths = versions
+    fingerprint_path = str(tmp_path / 'fingerprint.parquet')
+    first, report = update_street_network_incremental(
+        model.copy().assign(foreign_id=np.nan), paths['first'], 'GID', segments, 'foreign_id',
+        fingerprint_path, workers)
+    commit_fingerprint(report)
+    pd.testing.assert_series_equal(first['foreign_id'],
+                                   _full_match(model, paths['first'], segments)['foreign_id'],
+                                   check_dtype=False)
+
+    updated, report = update_street_network_incremental(first, paths['second'], 'GID',
+                                                        segments, 'foreign_id',
+                                                        fingerprint_path, workers)
+    assert report.modified and report.removed
+    assert len(report.segments) < len(segments)
+    assert updated['foreign_id'].notna().sum() > len(model) // 2
+    pd.testing.assert_series_equal(updated['foreign_id'],
+                                   _full_match(model, paths['second'], segments)['foreign_id'],
+                                   check_dtype=False)
+
+
+def test_fingerprint_written_on_commit(versions, tmp_path):
+    """Update leaves the stored fingerprint alone until it is committed"""
+    model, segments, paths = versions
+    fingerprint_path = str(tmp_path / 'fingerprint.parquet')
+    _, report = update_street_network_incremental(
+        model.copy().assign(foreign_id=np.nan), paths['first'], 'GID', segments, 'foreign_id',
+        fingerprint_path)
+    assert not os.path.exists(fingerprint_path)
+    commit_fingerprint(report)
+    pd.testing.assert_frame_equal(load_fingerprint(fingerprint_path), report.fingerprint)
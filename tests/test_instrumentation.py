@@ -0,0 +1,37 @@
+"""Counters of the instrumented matching on lines with known relaxation steps"""
+import numpy as np
+import pytest
+
+import instrumentation
+from geometry_utils import bounds_features
+from location_matching import match_segments_to_networks
+
+# matched in the first step twice, unmatched, matched in the last step with coarser rounding
+LINES = bounds_features(np.array([[0, 0, 1, 1], [0, 0, 1, 0.5], [5, 5, 6, 6], [0, 0, 1, 0.05]]))
+OTHERS = bounds_features(np.array([[0, 0, 1, 1]]))
+EMPTY = bounds_features(np.empty((0, 4)))
+
+
+@pytest.fixture(name='recorder')
+def fixture_recorder():
+    """Instrumentation enabled while the test runs"""
+    yield instrumentation.enable()
+    instrumentation.disable()
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_relaxation_counters(recorder, workers):
+    """Lines are counted by their step, unmatched lines and lines of skipped segments count
+    all six steps and the drop of round digits in the last one"""
+    segments = [(LINES, [OTHERS, EMPTY]), (LINES, [OTHERS, EMPTY]),
+                (LINES.take(np.arange(2)), [EMPTY, EMPTY])]
+    results = match_segments_to_networks(segments, workers)
+    assert [matches.tolist() for matches in results[0]] == [[0, 0, -1, 0], [-1] * 4]
+    counters = recorder.counters
+    assert counters['segments_skipped'] == 1
+    assert counters['lines'] == 2 * 4 * 2 + 2 * 2
+    assert counters['lines_unmatched'] == 2 * (1 + 4) + 2 * 2
+    assert (counters['matched_at_angle_20'], counters['matched_at_angle_25'],
+            counters['matched_at_angle_45']) == (4, 0, 2)
+    assert counters['relaxation_iterations'] == 2 * (1 + 1 + 6) + 14 * 6
+    assert counters['round_digits_drops'] == 2 + 14
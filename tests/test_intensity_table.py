@@ -0,0 +1,88 @@
+"""Intensity table compared with numbers of every street looked up in the datasets one by one"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from dataset_query import get_strava_data
+from intensity_table import build_intensity_table, write_intensity_table, \
+    read_street_intensity, BIKETOWORK_COLUMNS, CENSUS_COLUMNS, COUNTERS_COLUMNS, STRAVA_COLUMNS
+from strava_store import load_strava_store, COUNT_COLUMNS
+
+DAY_MS = 24 * 3600 * 1000
+
+
+@pytest.fixture(name='datasets')
+def fixture_datasets(tmp_path):
+    """Model of streets matched to some of the datasets, attribute tables and Strava CSV
+    spanning two years, street 5 is in the model twice"""
+    rng = np.random.default_rng(9)
+    model = pd.DataFrame({'id': [1, 2, 3, 4, 5, 5, 6],
+                          'counters_id': [10, np.nan, 10, 11, np.nan, np.nan, np.nan],
+                          'biketowork_id': [100, 101, np.nan, 100, 102, 102, 999],
+                          'city_census_id': [np.nan, 200, 201, np.nan, 200, 200, np.nan]})
+    biketowork = pd.DataFrame({'GID_ROAD': [100, 101, 102],
+                               **{column: rng.integers(0, 100, 3)
+                                  for column in BIKETOWORK_COLUMNS}})
+    census = pd.DataFrame({'id': [200, 201],
+                           **{column: rng.integers(0, 100, 2) for column in CENSUS_COLUMNS}})
+    start = pd.Timestamp('2021-12-20').value // 10**6
+    counters = pd.DataFrame({'LocationId': np.repeat([10, 11], 30),
+                             'datum': start + DAY_MS * np.tile(np.arange(30), 2),
+                             **{column: rng.integers(0, 20, 60) for column in COUNTERS_COLUMNS}})
+    days = pd.date_range('2021-12-25', '2022-01-10').strftime('%Y-%m-%d')
+    strava = pd.DataFrame([(osm_id, day) for osm_id in (1, 3, 5, 8) for day in days],
+                          columns=['osm_reference_id', 'date'])
+    for column in COUNT_COLUMNS:
+        strava[column] = rng.integers(0, 50, len(strava))
+    csv_path = str(tmp_path / 'strava_daily.csv')
+    strava.to_csv(csv_path, index=False)
+    return model, biketowork, census, counters, csv_path
+
+
+def _street_intensity(street, biketowork, census, counters, csv_path):
+    """Numbers of one street from rows of its matched IDs, as the per-street queries read them"""
+    numbers = {}
+    road = biketowork[biketowork['GID_ROAD'] == street['biketowork_id']]
+    for column, name in BIKETOWORK_COLUMNS.items():
+        numbers[name] = road[column].iloc[0] if len(road) else np.nan
+    road = census[census['id'] == street['city_census_id']]
+    for column, name in CENSUS_COLUMNS.items():
+        numbers[name] = road[column].iloc[0] if len(road) else np.nan
+    location = counters[counters['LocationId'] == street['counters_id']]
+    years = pd.to_datetime(location['datum'], unit='ms').dt.year
+    strava = get_strava_data(street['id'], '2000-01-01', '2100-01-01', csv_path)
+    for year in (2021, 2022):
+        for column, name in COUNTERS_COLUMNS.items():
+            numbers[f'{name}_{year}'] = location.loc[years == year, column].sum() \
+                if len(location) else np.nan
+        for column, name in STRAVA_COLUMNS.items():
+            numbers[f'{name}_{year}'] = strava.loc[strava['date'].dt.year == year, column].sum() \
+                if len(strava) else np.nan
+    return numbers
+
+
+def test_table_equals_street_lookups(datasets):
+    """Every street has one row with the numbers of the lookups of its matched IDs"""
+    model, biketowork, census, counters, csv_path = datasets
+    table = build_intensity_table(model, biketowork, census, counters,
+                                  load_strava_store(csv_path))
+    assert table['id'].tolist() == [1, 2, 3, 4, 5, 6]
+    for street, row in zip(model.drop_duplicates('id').to_dict('records'),
+                           table.to_dict('records')):
+        for name, expected in _street_intensity(street, biketowork, census, counters,
+                                                csv_path).items():
+            assert row[name] == pytest.approx(expected, nan_ok=True), (street['id'], name)
+
+
+def test_read_streets_of_written_table(datasets, tmp_path, monkeypatch):
+    """Rows of few streets are read back equal to the rows of the table"""
+    model, biketowork, census, counters, csv_path = datasets
+    table = build_intensity_table(model, biketowork, census, counters,
+                                  load_strava_store(csv_path))
+    monkeypatch.setattr('intensity_table.ROW_GROUP_SIZE', 2)
+    filepath = str(tmp_path / 'intensity.parquet')
+    write_intensity_table(table, filepath)
+    pd.testing.assert_frame_equal(read_street_intensity([5, 2, 7], filepath),
+                                  table[table['id'].isin([2, 5])].reset_index(drop=True))
+    assert read_street_intensity([3], filepath, ['strava_rides_2022']).columns.tolist() == \
+        ['id', 'strava_rides_2022']
@@ -0,0 +1,75 @@
+"""Matching of street networks in a process pool compared with the sequential segment loop"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks import synthetic_basemap, synthetic_foreign_network, changed_version
+from geometry_utils import match_lines_by_bbox_overlap
+from location_matching import match_street_network_to_osm, update_street_network
+from segmentation_utils import generate_segments, assign_segments_to_dataset
+
+NUM_SEGMENTS = 6
+
+
+@pytest.fixture(name='networks', scope='module')
+def fixture_networks(tmp_path_factory):
+    """Segmented basemap, foreign network and paths of two versions of the network"""
+    basemap = synthetic_basemap(400, seed=11)
+    foreign = synthetic_foreign_network(basemap, seed=12)
+    # segments cover both networks, every street has its segment
+    both = np.vstack([basemap.total_bounds, foreign.total_bounds])
+    segments = generate_segments((*both[:, :2].min(axis=0), *both[:, 2:].max(axis=0)),
+                                 NUM_SEGMENTS)
+    model = assign_segments_to_dataset(basemap, segments, 'id')
+    folder = tmp_path_factory.mktemp('networks')
+    paths = (str(folder / 'foreign.geojson'), str(folder / 'foreign_v2.geojson'))
+    foreign.to_file(paths[0], driver='GeoJSON')
+    changed_version(foreign, 'GID').to_file(paths[1], driver='GeoJSON')
+    return model, assign_segments_to_dataset(foreign, segments, 'GID'), segments, paths
+
+
+def _segment_loop(model, foreign, segments):
+    """Matches of the sequential loop, every basemap line against its segment"""
+    matches = {}
+    for segment_id in range(len(segments)):
+        foreign_segment = foreign[foreign['segment_id'] == segment_id]
+        for street_id, line in model[model['segment_id'] == segment_id][['id', 'geometry']] \
+                .itertuples(index=False):
+            match = match_lines_by_bbox_overlap(line, foreign_segment['geometry'])
+            matches[street_id] = np.nan if match is None else \
+                foreign_segment[foreign_segment['geometry'] == match]['GID'].array[0]
+    return pd.Series(matches, name='foreign_id')
+
+
+def _match(networks, workers):
+    model, _, segments, paths = networks
+    return match_street_network_to_osm(model, paths[0], 'GID', segments, 'foreign_id',
+                                       workers=workers)
+
+
+def test_matches_equal_segment_loop(networks):
+    """Matches of every street equal those of the sequential loop"""
+    model, foreign, segments, _ = networks
+    matched = _match(networks, 1).set_index('id')['foreign_id']
+    expected = _segment_loop(model, foreign, segments)
+    assert matched.notna().sum() > len(model) // 2
+    pd.testing.assert_series_equal(matched.sort_index(), expected.sort_index(),
+                                   check_dtype=False, check_names=False, check_index_type=False)
+
+
+@pytest.mark.parametrize('workers', [2, 3])
+def test_pool_results_are_deterministic(networks, workers):
+    """Pool returns the same rows in the same order as the sequential run, every time"""
+    sequential = _match(networks, 1)
+    for _ in range(2):
+        pd.testing.assert_frame_equal(_match(networks, workers), sequential)
+
+
+def test_pool_update_equals_sequential(networks):
+    """Update of the model matched in a pool equals the sequential update"""
+    model, _, segments, paths = networks
+    matched = model.join(_match(networks, 1)['foreign_id'])
+    sequential = update_street_network(matched.copy(), paths[1], 'GID', segments, 'foreign_id')
+    parallel = update_street_network(matched.copy(), paths[1], 'GID', segments, 'foreign_id',
+                                     workers=2)
+    pd.testing.assert_frame_equal(parallel, sequential)
@@ -0,0 +1,132 @@
+"""Matching service queried over HTTP on a local port, compared with the library functions"""
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import numpy as np
+import pytest
+from shapely import geometry as shp
+
+from benchmarks import synthetic_basemap, synthetic_foreign_network, synthetic_points
+from geometry_utils import match_lines_by_bbox_overlap
+from matching_service import MatchingService, create_server
+from segmentation_utils import generate_segments, segments_of_points, OUTSIDE_SEGMENT
+
+NUM_SEGMENTS = 4
+
+
+class _Source:  # pylint: disable=too-few-public-methods
+    """Basemap source whose stamp and failures are set by the tests"""
+
+    def __init__(self, basemap):
+        self.basemap = basemap
+        self.stamp = 0
+        self.failing = False
+        self.loads = 0
+
+    def load(self):
+        """Current basemap, raises while failing"""
+        if self.failing:
+            raise OSError('basemap cache is being written')
+        self.loads += 1
+        return self.basemap
+
+
+@pytest.fixture(name='basemap', scope='module')
+def fixture_basemap():
+    """Synthetic basemap and its segments"""
+    basemap = synthetic_basemap(400)
+    return basemap, generate_segments(tuple(basemap.total_bounds), NUM_SEGMENTS)
+
+
+@pytest.fixture(name='served')
+def fixture_served(basemap):
+    """Service of the basemap on a free local port, its source and URL"""
+    source = _Source(basemap[0])
+    service = MatchingService(source.load, lambda: source.stamp, basemap[1])
+    server = create_server(service, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield service, source, f'http://127.0.0.1:{server.server_port}'
+    service.stop()
+    server.shutdown()
+    server.server_close()
+
+
+def _get(url):
+    with urllib.request.urlopen(url, timeout=10) as response:
+        return json.loads(response.read())
+
+
+def _post(url, body):
+    request = urllib.request.Request(url, json.dumps(body).encode(), method='POST')
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return json.loads(response.read())
+
+
+def test_match_point_is_nearest_street(basemap, served):
+    """Point is matched to the street nearest by brute force"""
+    streets = basemap[0]
+    url = served[2]
+    for point in synthetic_points(streets, 20).geometry:
+        result = _get(f'{url}/match_point?x={point.x}&y={point.y}')
+        distances = np.array([street.distance(point) for street in streets.geometry])
+        assert result['osm_id'] == streets['id'].iloc[distances.argmin()]
+        assert result['distance'] == pytest.approx(distances.min())
+
+
+def test_match_line_equals_bbox_overlap(basemap, served):
+    """Best match of line is the match of match_lines_by_bbox_overlap() among its segment"""
+    streets, segments = basemap
+    segment_ids = segments_of_points(streets.bounds['minx'].to_numpy(),
+                                     streets.bounds['miny'].to_numpy(), segments)
+    lines = synthetic_foreign_network(streets).geometry.iloc[:40]
+    found = 0
+    for line in lines:
+        result = _post(f'{served[2]}/match_line', {'geometry': shp.mapping(line)})
+        in_segment = streets[segment_ids == result['segment_id']]
+        expected = match_lines_by_bbox_overlap(line, in_segment.geometry)
+        expected_id = None if expected is None \
+            else in_segment['id'][in_segment.geometry == expected].iloc[0]
+        assert result['best_osm_id'] == expected_id
+        found += expected_id is not None
+    assert found > len(lines) // 2
+
+
+def test_match_empty_line(served):
+    """Empty line matches nothing instead of failing on its missing bounds"""
+    result = _post(f'{served[2]}/match_line',
+                   {'geometry': {'type': 'LineString', 'coordinates': []}})
+    assert result == {'segment_id': OUTSIDE_SEGMENT, 'osm_ids': [], 'best_osm_id': None}
+
+
+def test_lookup_unknown_street(served):
+    """Unknown street is answered with 404"""
+    with pytest.raises(urllib.error.HTTPError) as error:
+        _get(f'{served[2]}/lookup_osm_id?id=-1')
+    assert error.value.code == 404
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_failed_reload_keeps_basemap(served, caplog):
+    """Failing reload is retried in the background, previous basemap answers meanwhile"""
+    service, source, url = served
+    warm = service.warm
+    source.failing, source.stamp = True, 1
+    service.watch(0.01)
+    assert _wait_for(lambda: 'Reload of the basemap failed' in caplog.text)
+    assert service.warm is warm
+    assert _get(f'{url}/status')['streets'] == len(source.basemap)
+
+    source.failing = False
+    assert _wait_for(lambda: service.warm is not warm)
+    assert source.loads == 2 and service.stamp == 1
+    assert np.array_equal(service.warm.store.ids, warm.store.ids)
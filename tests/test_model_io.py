@@ -0,0 +1,78 @@
+"""Round-trips of the model and its partial reads compared with filtering the full read"""
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+from shapely import geometry as shp
+
+from benchmarks import synthetic_basemap
+from model_io import write_model, read_model, model_driver, parquet_compatible
+from osm_basemap import prepare_basemap
+from segmentation_utils import generate_segments, BOUNDS_COLUMNS
+
+BOXES = [(16.55, 49.17, 16.65, 49.22), (16.0, 49.0, 16.1, 49.1), (16.4, 49.1, 16.8, 49.3)]
+
+
+@pytest.fixture(name='model', scope='module')
+def fixture_model():
+    """Prepared basemap with matched IDs and OSM tag of mixed types, some missing"""
+    basemap = synthetic_basemap(500, seed=8)
+    model = prepare_basemap(basemap, generate_segments(tuple(basemap.total_bounds), 6))
+    model['foreign_id'] = np.where(np.arange(len(model)) % 3, model['id'] * 10.0, np.nan)
+    model['lanes'] = [(None, 'yes', 2, 'unknown')[index % 4] for index in range(len(model))]
+    return model
+
+
+def _by_id(dataset):
+    return dataset.sort_values('id').reset_index(drop=True)
+
+
+@pytest.mark.parametrize('extension', ['.parquet', '.fgb'])
+def test_round_trip(model, tmp_path, extension):
+    """Model is read back with the same rows, values and geometries"""
+    filepath = str(tmp_path / f'model{extension}')
+    write_model(model, filepath)
+    assert [path.name for path in tmp_path.iterdir()] == [f'model{extension}']
+    expected = parquet_compatible(model)
+    # FlatGeobuf orders features by its spatial index
+    read = read_model(filepath) if extension == '.parquet' else _by_id(read_model(filepath))
+    assert sorted(read.columns) == sorted(expected.columns)
+    read = read[expected.columns]
+    pd.testing.assert_frame_equal(pd.DataFrame(read.drop(columns='geometry')),
+                                  pd.DataFrame(expected.drop(columns='geometry')),
+                                  check_dtype=False)
+    assert read.geometry.geom_equals_exact(expected.geometry, 1e-12).all()
+
+
+@pytest.mark.parametrize('extension', ['.parquet', '.fgb', '.geojson'])
+def test_filters_equal_full_read(model, tmp_path, extension):
+    """Selected columns and bounding box give the rows and columns of the filtered full read"""
+    filepath = str(tmp_path / f'model{extension}')
+    write_model(model, filepath)
+    full = read_model(filepath)
+    pd.testing.assert_frame_equal(_by_id(read_model(filepath, ['id', 'foreign_id'])),
+                                  _by_id(full[['id', 'foreign_id', 'geometry']]))
+    for bounding_box in BOXES:
+        # empty reads of the formats differ in dtypes only
+        expected = full[full.intersects(shp.box(*bounding_box))]
+        pd.testing.assert_frame_equal(_by_id(read_model(filepath, bounding_box=bounding_box)),
+                                      _by_id(expected), check_dtype=False)
+        pd.testing.assert_frame_equal(_by_id(read_model(filepath, ['id'], bounding_box)),
+                                      _by_id(expected[['id', 'geometry']]), check_dtype=False)
+    assert 0 < len(read_model(filepath, bounding_box=BOXES[0])) < len(full)
+
+
+def test_parquet_box_without_bounds_columns(model, tmp_path):
+    """Bounding box of model without bounds columns is filtered by geometry only"""
+    filepath = str(tmp_path / 'model.parquet')
+    write_model(model.drop(columns=BOUNDS_COLUMNS), filepath)
+    full = read_model(filepath)
+    pd.testing.assert_frame_equal(read_model(filepath, bounding_box=BOXES[0]),
+                                  full[full.intersects(shp.box(*BOXES[0]))].reset_index(drop=True))
+
+
+def test_unsupported_format():
+    """Only known extensions are written and read"""
+    assert model_driver('model.FGB') == 'FlatGeobuf'
+    with pytest.raises(ValueError):
+        write_model(gpd.GeoDataFrame({'geometry': []}), 'model.shp')
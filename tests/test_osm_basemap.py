@@ -0,0 +1,120 @@
+"""Basemap cache entries, OSM loading is replaced by a small synthetic network"""
+import os
+import sys
+import types
+
+import geopandas as gpd
+import pytest
+from shapely import geometry as shp
+
+import osm_basemap
+from osm_basemap import load_cached_basemap, basemap_cache_files, basemap_cache_path, \
+    file_digest, MATCHING_COLUMNS
+from segmentation_utils import generate_segments
+
+BOUNDING_BOX = (16.0, 49.0, 17.0, 49.5)
+
+
+@pytest.fixture(name='loads')
+def fixture_loads(monkeypatch):
+    """Replace reading of the '.osm.pbf' file, every read is recorded"""
+    loads = []
+
+    def load_osm_basemap(filepath, bounding_box=None,  # pylint: disable=unused-argument
+                         columns=None):
+        loads.append((filepath, columns))
+        basemap = gpd.GeoDataFrame({
+            'id': [1, 2], 'highway': ['cycleway', 'residential'],
+            'geometry': [shp.LineString([(16.1, 49.1), (16.2, 49.2)]),
+                         shp.LineString([(16.6, 49.3), (16.7, 49.4)])]})
+        return basemap[columns] if columns else basemap
+    monkeypatch.setattr(osm_basemap, 'load_osm_basemap', load_osm_basemap)
+    return loads
+
+
+def _pbf(tmp_path, name, content=b'osm'):
+    path = tmp_path / name
+    path.write_bytes(content)
+    return str(path)
+
+
+def test_entries_of_other_columns_and_segments_are_kept(tmp_path, loads):
+    """Pipeline and matching service keep their own entries of one file"""
+    pbf, cache_dir = _pbf(tmp_path, 'brno.osm.pbf'), str(tmp_path / 'cache')
+    grid, finer_grid = generate_segments(BOUNDING_BOX, 2), generate_segments(BOUNDING_BOX, 4)
+    for _ in range(2):
+        load_cached_basemap(pbf, BOUNDING_BOX, grid, cache_dir)
+        load_cached_basemap(pbf, BOUNDING_BOX, grid, cache_dir, columns=MATCHING_COLUMNS)
+        load_cached_basemap(pbf, BOUNDING_BOX, finer_grid, cache_dir)
+    assert len(loads) == 3
+    assert len(basemap_cache_files(pbf, cache_dir)) == 3
+
+
+def test_changed_file_replaces_entry_of_the_same_inputs(tmp_path, loads):
+    """Older content of the file is evicted only for the same inputs"""
+    pbf, cache_dir = _pbf(tmp_path, 'brno.osm.pbf'), str(tmp_path / 'cache')
+    grid, finer_grid = generate_segments(BOUNDING_BOX, 2), generate_segments(BOUNDING_BOX, 4)
+    load_cached_basemap(pbf, BOUNDING_BOX, grid, cache_dir)
+    load_cached_basemap(pbf, BOUNDING_BOX, finer_grid, cache_dir)
+    old_entry = basemap_cache_path(pbf, BOUNDING_BOX, grid, cache_dir)
+    finer_entry = basemap_cache_path(pbf, BOUNDING_BOX, finer_grid, cache_dir)
+
+    _pbf(tmp_path, 'brno.osm.pbf', b'newer osm')
+    basemap = load_cached_basemap(pbf, BOUNDING_BOX, grid, cache_dir)
+    new_entry = basemap_cache_path(pbf, BOUNDING_BOX, grid, cache_dir)
+    assert len(loads) == 3
+    assert new_entry != old_entry
+    assert basemap_cache_files(pbf, cache_dir) == sorted([new_entry, finer_entry])
+    assert list(basemap['segment_id']) == [0, 3]
+
+
+def test_files_with_dotted_names_do_not_share_entries(tmp_path, loads):
+    """Whole name of the file without extension is the prefix of its entries"""
+    cache_dir = str(tmp_path / 'cache')
+    grid = generate_segments(BOUNDING_BOX, 2)
+    older = _pbf(tmp_path, 'brno.2023.osm.pbf', b'2023')
+    newer = _pbf(tmp_path, 'brno.2024.osm.pbf', b'2024')
+    for _ in range(2):
+        load_cached_basemap(older, BOUNDING_BOX, grid, cache_dir)
+        load_cached_basemap(newer, BOUNDING_BOX, grid, cache_dir)
+    assert len(loads) == 2
+    assert len(basemap_cache_files(older, cache_dir)) == 1
+    assert len(basemap_cache_files(newer, cache_dir)) == 1
+
+
+class _FakeOSM:  # pylint: disable=too-few-public-methods
+    """pyrosm reader with a street in both networks, records the bounding boxes read"""
+    boxes = []
+
+    def __init__(self, filepath, bounding_box):  # pylint: disable=unused-argument
+        self.boxes.append(bounding_box)
+
+    def get_network(self, network_type):
+        """Cycling and driving networks sharing street 2"""
+        ids = [1, 2] if network_type == 'cycling' else [2, 3]
+        return gpd.GeoDataFrame({
+            'id': ids, 'highway': [network_type] * 2, 'maxspeed': [None, None],
+            'geometry': [shp.LineString([(16.1 + street, 49.1), (16.2 + street, 49.2)])
+                         for street in ids]})
+
+
+def test_osm_networks_pruned_and_deduplicated(monkeypatch):
+    """Whole bounding box is read once, streets of both networks are kept once"""
+    monkeypatch.setitem(sys.modules, 'pyrosm', types.SimpleNamespace(OSM=_FakeOSM))
+    _FakeOSM.boxes = []
+    basemap = osm_basemap.load_osm_basemap('brno.osm.pbf', BOUNDING_BOX,
+                                           MATCHING_COLUMNS + ['highway'])
+    assert _FakeOSM.boxes == [list(BOUNDING_BOX)]
+    assert basemap['id'].tolist() == [1, 2, 3]
+    assert basemap['highway'].tolist() == ['cycling', 'cycling', 'driving']
+    assert list(basemap.columns) == MATCHING_COLUMNS + ['highway']
+
+
+def test_digests_are_replaced_without_temporary_files(tmp_path):
+    """Remembered digests are valid JSON with no leftovers of the write"""
+    cache_dir = tmp_path / 'cache'
+    first = file_digest(_pbf(tmp_path, 'a.osm.pbf', b'a'), str(cache_dir))
+    second = file_digest(_pbf(tmp_path, 'b.osm.pbf', b'b'), str(cache_dir))
+    assert first != second
+    assert sorted(os.listdir(cache_dir)) == ['digests.json']
+    assert file_digest(str(tmp_path / 'a.osm.pbf'), str(cache_dir)) == first
@@ -0,0 +1,102 @@
+"""Segment assignment and candidates compared with brute force over all segments"""
+import numpy as np
+import pytest
+
+from segmentation_utils import generate_segments, generate_adaptive_segments, \
+    segment_candidates, segments_of_points, _matrix_candidates, _first_containing_segments, \
+    OUTSIDE_SEGMENT, assign_segments
+
+BOUNDING_BOX = (16.0, 49.0, 17.0, 49.5)
+NUM_SEGMENTS = 4
+
+
+def _touching_bounds(segment_matrix, size=400, seed=0):
+    """Bounds of streets, many of them start or end exactly on edges of segments"""
+    rng = np.random.default_rng(seed)
+    x_values = np.unique(np.array(segment_matrix)[:, [0, 2]])
+    y_values = np.unique(np.array(segment_matrix)[:, [1, 3]])
+    minx = np.where(rng.random(size) < 0.5, rng.choice(x_values, size),
+                    rng.uniform(BOUNDING_BOX[0] - 0.1, BOUNDING_BOX[2] + 0.1, size))
+    miny = np.where(rng.random(size) < 0.5, rng.choice(y_values, size),
+                    rng.uniform(BOUNDING_BOX[1] - 0.1, BOUNDING_BOX[3] + 0.1, size))
+    maxx = np.where(rng.random(size) < 0.3, rng.choice(x_values, size),
+                    minx + rng.exponential(0.1, size))
+    maxy = np.where(rng.random(size) < 0.3, rng.choice(y_values, size),
+                    miny + rng.exponential(0.1, size))
+    return np.column_stack([minx, miny, np.maximum(minx, maxx), np.maximum(miny, maxy)])
+
+
+def _brute_force_candidates(bounds, segment_matrix, halo):
+    candidates = {}
+    for index, (seg_minx, seg_miny, seg_maxx, seg_maxy) in enumerate(segment_matrix):
+        rows = [row for row, (minx, miny, maxx, maxy) in enumerate(bounds)
+                if maxx + halo >= seg_minx and minx - halo <= seg_maxx
+                and maxy + halo >= seg_miny and miny - halo <= seg_maxy]
+        if rows:
+            candidates[index] = rows
+    return candidates
+
+
+def _as_lists(candidates):
+    return {segment_id: list(rows) for segment_id, rows in candidates.items()}
+
+
+@pytest.mark.parametrize('halo', [0.0, 0.01, 0.25])
+def test_grid_candidates_equal_brute_force(halo):
+    """Streets touching segment edges are candidates of both segments"""
+    segment_matrix = generate_segments(BOUNDING_BOX, NUM_SEGMENTS)
+    bounds = _touching_bounds(segment_matrix)
+    assert _as_lists(segment_candidates(bounds, segment_matrix, halo)) \
+        == _brute_force_candidates(bounds, segment_matrix, halo)
+
+
+@pytest.mark.parametrize('halo', [0.0, 0.01, 0.25])
+def test_grid_and_generic_candidates_agree(halo):
+    """Regular grid shortcut gives the same candidates as the pass over segments"""
+    segment_matrix = generate_segments(BOUNDING_BOX, NUM_SEGMENTS)
+    bounds = _touching_bounds(segment_matrix, seed=1)
+    reach = bounds + np.array([-halo, -halo, halo, halo])
+    assert _as_lists(segment_candidates(bounds, segment_matrix, halo)) \
+        == _as_lists(_matrix_candidates(reach, segment_matrix))
+
+
+def test_adaptive_candidates_equal_brute_force():
+    """Quadtree segments go through the pass over segments"""
+    bounds = _touching_bounds(generate_segments(BOUNDING_BOX, NUM_SEGMENTS), seed=2)
+    segment_matrix = generate_adaptive_segments(BOUNDING_BOX, bounds, max_streets=20)
+    assert _as_lists(segment_candidates(bounds, segment_matrix)) \
+        == _brute_force_candidates(bounds, segment_matrix, 0.0)
+
+
+def test_grid_assignment_equals_first_containing_segment():
+    """Segments include lower edges, the last row and column also the upper edge"""
+    segment_matrix = generate_segments(BOUNDING_BOX, NUM_SEGMENTS)
+    bounds = _touching_bounds(segment_matrix, seed=3)
+    expected = []
+    for minx, miny, *_ in bounds:
+        expected.append(next(
+            (index for index, (seg_minx, seg_miny, seg_maxx, seg_maxy)
+             in enumerate(segment_matrix)
+             if seg_minx <= minx and seg_miny <= miny
+             and (minx < seg_maxx or minx == seg_maxx == BOUNDING_BOX[2])
+             and (miny < seg_maxy or miny == seg_maxy == BOUNDING_BOX[3])),
+            OUTSIDE_SEGMENT))
+    with pytest.warns(UserWarning):
+        assigned = assign_segments(bounds, segment_matrix, np.arange(len(bounds)))
+    assert list(assigned) == expected
+
+
+def test_adaptive_assignment_equals_pass_over_segments():
+    """Lookup table of quadtree segments finds the same segments as the pass over them"""
+    rng = np.random.default_rng(4)
+    dense = rng.normal([16.5, 49.2], 0.05, (2000, 2))
+    segment_matrix = generate_adaptive_segments(BOUNDING_BOX, np.hstack([dense, dense]),
+                                                max_streets=16)
+    edges = np.array(segment_matrix)
+    x_coords = np.concatenate([dense[:, 0], rng.choice(edges[:, [0, 2]].ravel(), 500),
+                               [BOUNDING_BOX[2], BOUNDING_BOX[0], np.nan, 20.0]])
+    y_coords = np.concatenate([dense[:, 1], rng.choice(edges[:, [1, 3]].ravel(), 500),
+                               [BOUNDING_BOX[3], 0.0, 49.1, 49.1]])
+    assert len(segment_matrix) > NUM_SEGMENTS ** 2
+    assert list(segments_of_points(x_coords, y_coords, segment_matrix)) \
+        == list(_first_containing_segments(x_coords, y_coords, edges))
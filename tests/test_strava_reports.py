@@ -0,0 +1,57 @@
+"""Batch Strava reports compared with reports of the streets rendered one by one"""
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import strava_reports
+from dataset_query import get_strava_data
+from strava_reports import generate_strava_reports, street_sums
+from strava_store import COUNT_COLUMNS
+
+STREETS = [450098706, 48578321, 7]
+INTERVAL = ('2022-05-03', '2022-05-20')
+
+
+@pytest.fixture(name='csv_path')
+def fixture_csv_path(tmp_path):
+    """Daily export of two streets with data in the interval and one street without"""
+    rng = np.random.default_rng(6)
+    days = list(pd.date_range('2022-05-01', '2022-05-31').strftime('%Y-%m-%d'))
+    rows = pd.DataFrame([(osm_id, day) for osm_id in STREETS[:2] for day in days] +
+                        [(STREETS[2], '2022-06-15')], columns=['osm_reference_id', 'date'])
+    for column in COUNT_COLUMNS:
+        rows[column] = rng.integers(0, 50, len(rows))
+    csv_path = str(tmp_path / 'strava_daily.csv')
+    rows.to_csv(csv_path, index=False)
+    return csv_path
+
+
+def _single_street_report(osm_id, csv_path):
+    """Report of the street queried and summed alone, as generate_strava_report() renders it"""
+    strava_df = get_strava_data(osm_id, *INTERVAL, csv_path)
+    return strava_df.to_html() + f'<img src="strava_{osm_id}.png" alt="text">' + \
+        street_sums(strava_df).to_html()
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_batch_reports_equal_single_reports(csv_path, tmp_path, workers):
+    """Every street with data gets the report of the single street query and its plot,
+    streets without data in the interval are skipped"""
+    output_dir = str(tmp_path / 'reports')
+    reports = generate_strava_reports(STREETS + [STREETS[0]], *INTERVAL, csv_path, output_dir,
+                                      workers)
+    assert sorted(reports) == sorted(STREETS[:2])
+    for osm_id, report_path in reports.items():
+        with open(report_path, encoding='utf-8') as file:
+            assert file.read() == _single_street_report(osm_id, csv_path)
+        assert os.path.getsize(os.path.join(output_dir, f'strava_{osm_id}.png')) > 0
+    assert len(os.listdir(output_dir)) == 4
+
+
+def test_reports_of_matched_streets(csv_path, tmp_path, monkeypatch):
+    """Without IDs, streets of the model matched to any dataset are reported"""
+    monkeypatch.setattr(strava_reports, 'matched_street_ids', lambda: [STREETS[1], STREETS[2]])
+    reports = generate_strava_reports(None, *INTERVAL, csv_path, str(tmp_path / 'reports'))
+    assert list(reports) == [STREETS[1]]
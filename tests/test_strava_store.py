@@ -0,0 +1,83 @@
+"""Lookups in the indexed Strava store compared with the CSV query they replaced"""
+import asyncio
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import strava_store
+from dataset_query import get_strava_data
+from strava_store import load_strava_store, street_counts, COUNT_COLUMNS
+
+STREETS = [48578321, 450098706, 7, 123456789]
+
+
+def _reference_strava_data(osm_id, date_start, date_end, csv_path):
+    """get_strava_data() of the CSV implementation"""
+    strava_df = pd.read_csv(csv_path)
+    strava_df['date'] = pd.to_datetime(strava_df['date'])
+    strava_df = strava_df[strava_df['osm_reference_id'] == osm_id]
+    strava_df = strava_df[strava_df['date'].dt.strftime('%Y-%m-%d') >= date_start]
+    strava_df = strava_df[strava_df['date'].dt.strftime('%Y-%m-%d') < date_end]
+    strava_df = strava_df.groupby(['date']).mean(numeric_only=True).reset_index()
+    return strava_df[['osm_reference_id', 'date', 'ride_count',
+                      'forward_trip_count', 'reverse_trip_count']]
+
+
+@pytest.fixture(name='csv_path')
+def fixture_csv_path(tmp_path):
+    """Daily export of few streets in shuffled order, some days of a street have two rows"""
+    rng = np.random.default_rng(3)
+    days = pd.date_range('2022-05-01', '2022-06-30').strftime('%Y-%m-%d')
+    rows = pd.DataFrame([(osm_id, day) for osm_id in STREETS[:3] for day in days
+                         if rng.random() < 0.8], columns=['osm_reference_id', 'date'])
+    rows = pd.concat([rows, rows.sample(frac=0.2, random_state=4)])
+    for column in COUNT_COLUMNS:
+        rows[column] = rng.integers(0, 50, len(rows))
+    rows['activity_type'] = 'Ride'
+    csv_path = str(tmp_path / 'strava_daily.csv')
+    rows.sample(frac=1, random_state=5).to_csv(csv_path, index=False)
+    yield csv_path
+    strava_store._open_store.cache_clear()  # pylint: disable=protected-access
+
+
+@pytest.mark.parametrize('interval', [('2022-05-01', '2022-07-01'), ('2022-05-10', '2022-05-20'),
+                                      ('2022-06-30', '2022-06-30'), ('2023-01-01', '2023-02-01')])
+def test_lookups_equal_csv_query(csv_path, interval):
+    """Rows of every street, also of unknown one, equal the CSV query"""
+    for osm_id in STREETS:
+        expected = _reference_strava_data(osm_id, *interval, csv_path)
+        pd.testing.assert_frame_equal(get_strava_data(osm_id, *interval, csv_path), expected,
+                                      check_dtype=False, check_index_type=False)
+
+
+def test_batch_lookup_equals_single_lookups(csv_path):
+    """Counts of many streets are the single lookups one after another"""
+    store = load_strava_store(csv_path)
+    expected = pd.concat([street_counts(store, [osm_id], '2022-05-10', '2022-06-10')
+                          for osm_id in STREETS], ignore_index=True)
+    pd.testing.assert_frame_equal(street_counts(store, STREETS, '2022-05-10', '2022-06-10'),
+                                  expected)
+
+
+def test_concurrent_first_lookups_ingest_once(csv_path, monkeypatch):
+    """First lookups running in threads at once ingest the CSV once and leave no temporary
+    files"""
+    ingests = []
+    ingest = strava_store.ingest_strava_csv
+    monkeypatch.setattr(strava_store, 'ingest_strava_csv',
+                        lambda *args: ingests.append(args) or ingest(*args))
+
+    async def lookups():
+        return await asyncio.gather(*[asyncio.to_thread(
+            get_strava_data, osm_id, '2022-05-01', '2022-07-01', csv_path)
+            for osm_id in STREETS * 2])
+    results = asyncio.run(lookups())
+    assert len(ingests) == 1
+    assert sorted(os.listdir(strava_store.default_store_dir(csv_path))) == \
+        ['counts.npy', 'dates.npy', 'offsets.npy', 'osm_ids.npy', 'source.json']
+    for osm_id, frame in zip(STREETS * 2, results):
+        pd.testing.assert_frame_equal(
+            frame, _reference_strava_data(osm_id, '2022-05-01', '2022-07-01', csv_path),
+            check_dtype=False, check_index_type=False)